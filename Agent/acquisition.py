@@ -0,0 +1,174 @@
+import time
+import logging
+import threading
+import requests
+from Agent.client import AgentClient
+from Agent.multipart import MultipartReader
+
+
+class CurrentAcquisition:
+
+    # Fetch the full /current snapshot on every poll
+    event_driven = False
+
+    def __init__(self, machine_status, client):
+
+        self.logger = logging.getLogger("Acquisition")
+        self.machine_status = machine_status
+        self.client = client
+        self.current_path = "/" + machine_status.machine_name + "/current"
+
+    def poll(self):
+
+        response = self.client.get(self.current_path)
+        response.raise_for_status()
+        self.machine_status.update_machine_state(response)
+        return True
+
+
+class SampleAcquisition(CurrentAcquisition):
+
+    # One initial /current, then only the changes with /sample?from=<nextSequence>&count=N
+    def __init__(self, machine_status, client, count=1000):
+
+        super().__init__(machine_status, client)
+        self.sample_path = "/" + machine_status.machine_name + "/sample"
+        self.count = count
+
+    def poll(self):
+
+        if self.machine_status.next_sequence is None:
+            return super().poll()
+
+        response = self.client.get(self.sample_path, params={"from": self.machine_status.next_sequence,
+                                                             "count": self.count})
+        if not self.machine_status.apply_sample(response):
+            self.logger.warning(f"Sequence gap at {self.machine_status.next_sequence}, refreshing from /current")
+            return super().poll()
+        return True
+
+
+class StreamingAcquisition(CurrentAcquisition):
+
+    # Keeps one connection open on /sample?interval=...&heartbeat=... and applies every part as it arrives
+    event_driven = True
+
+    def __init__(self, machine_status, client, interval=100, heartbeat=10000, count=1000, reconnect_delay=5.0):
+
+        super().__init__(machine_status, client)
+        self.sample_path = "/" + machine_status.machine_name + "/sample"
+        self.interval = interval
+        self.heartbeat = heartbeat
+        self.count = count
+        self.reconnect_delay = reconnect_delay
+        # Set by the reader thread whenever new observations were applied
+        self.updated = threading.Event()
+        self.lock = threading.Lock()
+        self.running = False
+        self.thread = None
+
+    def poll(self, timeout=None):
+
+        # The first call takes the snapshot (availability check) and starts the stream
+        if self.thread is None:
+            super().poll()
+            self.start()
+            return True
+
+        # Wait for the next update instead of sleeping
+        if timeout is None:
+            timeout = 2 * self.heartbeat / 1000.0
+        if not self.updated.wait(timeout):
+            return False
+        self.updated.clear()
+        return True
+
+    def start(self):
+
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+
+    def run(self):
+
+        while self.running:
+            try:
+                with self.lock:
+                    if self.machine_status.next_sequence is None:
+                        super().poll()
+                if self.machine_status.next_sequence is None:
+                    # Machine not available yet
+                    time.sleep(self.reconnect_delay)
+                    continue
+                self.consume()
+            except requests.RequestException as e:
+                self.logger.warning(f"Agent stream interrupted with - {e}")
+                time.sleep(self.reconnect_delay)
+            except Exception as e:
+                # e.g. a malformed part or document - reconnect and resync from /current instead of ending the
+                # reader with the state going stale
+                self.logger.error(f"Agent stream failed with - {e}, resyncing from /current")
+                with self.lock:
+                    self.machine_status.next_sequence = None
+                time.sleep(self.reconnect_delay)
+
+    def consume(self):
+
+        params = {
+            "from": self.machine_status.next_sequence,
+            "count": self.count,
+            "interval": self.interval,
+            "heartbeat": self.heartbeat,
+        }
+        # Read timeout covers missing heartbeats
+        timeout = (self.client.timeout[0], 2 * self.heartbeat / 1000.0)
+        with self.client.get(self.sample_path, params=params, stream=True, timeout=timeout) as response:
+            response.raise_for_status()
+            boundary = MultipartReader.boundary_from_content_type(response.headers.get("Content-Type"))
+            if boundary is None:
+                # Not a stream (e.g. an MTConnectError document)
+                self.apply(response.content)
+                return
+
+            reader = MultipartReader(boundary)
+            for chunk in response.iter_content(chunk_size=None):
+                for part in reader.feed(chunk):
+                    if not self.apply(part) or not self.running:
+                        return
+                if reader.finished:
+                    return
+
+    def apply(self, content):
+
+        with self.lock:
+            if not self.machine_status.apply_sample_content(content):
+                self.logger.warning(f"Sequence gap at {self.machine_status.next_sequence}, refreshing from /current")
+                super().poll()
+                self.updated.set()
+                return False
+
+        if self.machine_status.updated_items:
+            self.updated.set()
+        return True
+
+
+def get_acquisition(machine_status, agent_config, client=None):
+
+    # Select the acquisition mode from config.yml
+    if client is None:
+        client = AgentClient.from_config(agent_config)
+    mode = agent_config.get("acquisition", "current")
+    if mode == "current":
+        return CurrentAcquisition(machine_status, client)
+    if mode == "sample":
+        return SampleAcquisition(machine_status, client, count=agent_config.get("sample_count", 1000))
+    if mode == "stream":
+        return StreamingAcquisition(machine_status, client,
+                                    interval=agent_config.get("stream_interval", 100),
+                                    heartbeat=agent_config.get("stream_heartbeat", 10000),
+                                    count=agent_config.get("sample_count", 1000))
+
+    raise ValueError(f"Unknown acquisition mode - {mode}")
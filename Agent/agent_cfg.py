@@ -0,0 +1,160 @@
+import os
+import re
+import logging
+import tempfile
+import threading
+
+# `Key = Value`, the value runs to the end of the line or a comment
+SETTING = re.compile(r"^(\s*)([A-Za-z_][\w]*)(\s*=\s*)(.*?)(\s*(?:#.*)?)$")
+# `Name {` or a lone `{` for the block named on the previous line
+BLOCK_OPEN = re.compile(r"^\s*([A-Za-z_][\w]*)?\s*\{\s*(?:#.*)?$")
+BLOCK_NAME = re.compile(r"^\s*([A-Za-z_][\w]*)\s*(?:#.*)?$")
+BLOCK_CLOSE = re.compile(r"^\s*\}\s*(?:#.*)?$")
+
+
+class AdapterEntry:
+
+    # One block of the `Adapters { ... }` section of agent.cfg
+    __slots__ = ("name", "settings", "lines")
+
+    def __init__(self, name):
+
+        self.name = name
+        # key -> value
+        self.settings = {}
+        # key -> line number in the file
+        self.lines = {}
+
+    @property
+    def device(self):
+        # The block name is the device unless `Device` says otherwise
+        return self.settings.get("Device", self.name)
+
+    def get(self, key, default=None):
+        return self.settings.get(key, default)
+
+
+def parse_adapters(lines):
+
+    # Returns {device: AdapterEntry} for the blocks of the Adapters section
+    adapters = {}
+    stack = []
+    pending_name = None
+    entry = None
+    for number, line in enumerate(lines):
+        if BLOCK_CLOSE.match(line):
+            if stack:
+                if len(stack) == 2 and entry is not None:
+                    adapters[entry.device] = entry
+                    entry = None
+                stack.pop()
+            continue
+
+        match = BLOCK_OPEN.match(line)
+        if match:
+            stack.append(match.group(1) or pending_name)
+            pending_name = None
+            if len(stack) == 2 and stack[0] == "Adapters":
+                entry = AdapterEntry(stack[1])
+            continue
+
+        match = SETTING.match(line)
+        if match:
+            pending_name = None
+            if entry is not None and len(stack) == 2:
+                key, value = match.group(2), match.group(4).strip().strip('"')
+                entry.settings[key] = value
+                entry.lines[key] = number
+            continue
+
+        match = BLOCK_NAME.match(line)
+        pending_name = match.group(1) if match else None
+
+    return adapters
+
+
+class AgentConfigFile:
+
+    # Parsed view of the agent.cfg Adapters section. The index is rebuilt only when the file changed on disk.
+    def __init__(self, path):
+
+        self.logger = logging.getLogger("AgentConfigFile")
+        self.path = path
+        self.lock = threading.Lock()
+        self.lines = []
+        self.index = {}
+        self.signature = None
+
+    def stat_signature(self):
+        stat = os.stat(self.path)
+        return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+    def refresh(self):
+
+        # Re-parse only when the file was modified since the last read
+        signature = self.stat_signature()
+        if signature == self.signature:
+            return False
+        with open(self.path, "r") as filehandle:
+            self.lines = filehandle.readlines()
+        self.index = parse_adapters(self.lines)
+        self.signature = signature
+        return True
+
+    @property
+    def adapters(self):
+        with self.lock:
+            self.refresh()
+            return dict(self.index)
+
+    def adapter(self, device):
+        with self.lock:
+            self.refresh()
+            return self.index.get(device)
+
+    def set_adapter_value(self, device, key, value):
+
+        # Rewrites `key` of the adapter of `device` only, returns True when the file changed
+        with self.lock:
+            self.refresh()
+            entry = self.index.get(device)
+            if entry is None:
+                raise KeyError(f"No adapter for {device} in {self.path}")
+            if entry.settings.get(key) == value:
+                return False
+            if key not in entry.lines:
+                raise KeyError(f"Adapter {entry.name} has no {key} setting")
+
+            number = entry.lines[key]
+            match = SETTING.match(self.lines[number])
+            ending = "\n" if self.lines[number].endswith("\n") else ""
+            if match.group(4).startswith('"'):
+                value = f'"{value}"'
+            lines = list(self.lines)
+            lines[number] = (match.group(1) + match.group(2) + match.group(3) + value +
+                             match.group(5).rstrip("\n") + ending)
+            previous = entry.settings[key]
+            self.write(lines)
+            self.logger.info(f"{key} of adapter {entry.name} changed from {previous} to {value}")
+            return True
+
+    def write(self, lines):
+
+        # Atomic replace - the agent never reads a half written file
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, temp_path = tempfile.mkstemp(prefix=".agent.cfg.", dir=directory)
+        try:
+            with os.fdopen(fd, "w") as filehandle:
+                filehandle.writelines(lines)
+                filehandle.flush()
+                os.fsync(filehandle.fileno())
+            os.chmod(temp_path, os.stat(self.path).st_mode & 0o7777)
+            os.replace(temp_path, self.path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+        self.lines = lines
+        self.index = parse_adapters(lines)
+        self.signature = self.stat_signature()
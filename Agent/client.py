@@ -0,0 +1,98 @@
+import time
+import logging
+from collections import deque
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from Metrics.registry import registry
+
+AGENT_REQUEST_SECONDS = registry.histogram("mtc_agent_request_seconds", "Agent HTTP request time", labels=("endpoint",))
+AGENT_REQUEST_ERRORS = registry.counter("mtc_agent_request_errors_total", "Failed agent HTTP requests",
+                                        labels=("endpoint",))
+
+
+class LatencyStats:
+
+    # Latency of the most recent requests, in seconds
+    def __init__(self, window=600):
+
+        self.samples = deque(maxlen=window)
+        self.count = 0
+        self.last = None
+
+    def add(self, latency):
+
+        self.samples.append(latency)
+        self.count += 1
+        self.last = latency
+
+    def percentile(self, fraction):
+
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+    def summary(self, period=None):
+
+        if not self.samples:
+            return "no agent requests yet"
+        mean = sum(self.samples) / len(self.samples)
+        text = "agent requests: {} mean {:.1f} ms p95 {:.1f} ms max {:.1f} ms".format(
+            self.count, mean * 1e3, self.percentile(0.95) * 1e3, max(self.samples) * 1e3)
+        # Share of the polling period spent on the HTTP round trip
+        if period:
+            text += " ({:.1f}% of the {:.2f} s budget)".format(100 * mean / period, period)
+        return text
+
+
+class AgentClient:
+
+    # Keep-alive session to the MTConnect agent with timeouts, bounded retries and latency tracking
+    def __init__(self, base_url, connect_timeout=2.0, read_timeout=5.0, retries=3, backoff_factor=0.2,
+                 gzip=False, pool_size=4):
+
+        self.logger = logging.getLogger("AgentClient")
+        self.base_url = base_url.rstrip("/")
+        self.timeout = (connect_timeout, read_timeout)
+        self.latency = LatencyStats()
+
+        retry = Retry(total=retries, connect=retries, read=retries, backoff_factor=backoff_factor,
+                      status_forcelist=(500, 502, 503, 504), allowed_methods=("GET",))
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        # The agent usually runs on the same Pi - compression only pays off over a slow link
+        self.session.headers["Accept-Encoding"] = "gzip" if gzip else "identity"
+
+    @classmethod
+    def from_config(cls, agent_config):
+
+        http_config = agent_config.get("http", {})
+        return cls(agent_config["url"],
+                   connect_timeout=http_config.get("connect_timeout", 2.0),
+                   read_timeout=http_config.get("read_timeout", 5.0),
+                   retries=http_config.get("retries", 3),
+                   backoff_factor=http_config.get("backoff_factor", 0.2),
+                   gzip=http_config.get("gzip", False),
+                   pool_size=http_config.get("pool_size", 4))
+
+    def get(self, path, params=None, stream=False, timeout=None):
+
+        endpoint = path.rsplit("/", 1)[-1]
+        start = time.perf_counter()
+        try:
+            response = self.session.get(self.base_url + path, params=params, stream=stream,
+                                        timeout=timeout or self.timeout)
+        except requests.RequestException:
+            AGENT_REQUEST_ERRORS.labels(endpoint).inc()
+            raise
+        # For streams this is the time to the response headers
+        latency = time.perf_counter() - start
+        self.latency.add(latency)
+        AGENT_REQUEST_SECONDS.labels(endpoint).observe(latency)
+        return response
+
+    def close(self):
+        self.session.close()
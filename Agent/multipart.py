@@ -0,0 +1,62 @@
+import re
+
+
+class MultipartReader:
+
+    # Splits a multipart/x-mixed-replace byte stream into the bodies of its parts
+    def __init__(self, boundary):
+
+        self.delimiter = b"--" + boundary.encode()
+        self.buffer = bytearray()
+        self.finished = False
+
+    @staticmethod
+    def boundary_from_content_type(content_type):
+
+        # multipart/x-mixed-replace;boundary=2d8b2e0c0f8d...
+        match = re.search(r'boundary="?([^";]+)"?', content_type or "")
+        if match is None:
+            return None
+        return match.group(1)
+
+    def feed(self, chunk):
+
+        self.buffer += chunk
+        parts = []
+        while not self.finished:
+            start = self.buffer.find(self.delimiter)
+            if start < 0:
+                break
+            marker = start + len(self.delimiter)
+
+            # Closing delimiter --boundary--
+            if self.buffer[marker:marker + 2] == b"--":
+                self.finished = True
+                del self.buffer[:]
+                break
+
+            header_end = self.buffer.find(b"\r\n\r\n", marker)
+            if header_end < 0:
+                break
+            body_start = header_end + 4
+
+            content_length = None
+            for line in bytes(self.buffer[marker:header_end]).decode("latin-1").split("\r\n"):
+                key, _, value = line.partition(":")
+                if key.strip().lower() == "content-length":
+                    content_length = int(value.strip())
+
+            if content_length is None:
+                # No length - the body runs up to the next delimiter
+                body_end = self.buffer.find(self.delimiter, body_start)
+                if body_end < 0:
+                    break
+                parts.append(bytes(self.buffer[body_start:body_end]).rstrip(b"\r\n"))
+                del self.buffer[:body_end]
+            else:
+                if len(self.buffer) < body_start + content_length:
+                    break
+                parts.append(bytes(self.buffer[body_start:body_start + content_length]))
+                del self.buffer[:body_start + content_length]
+
+        return parts
@@ -0,0 +1,74 @@
+import os
+import logging
+from collections import namedtuple
+from xml.etree.ElementTree import fromstring, ParseError
+import requests
+
+# A DataItem of the MTConnectDevices document returned by /probe
+DataItemDefinition = namedtuple("DataItemDefinition", [
+    "id",
+    "category",         # SAMPLE, EVENT or CONDITION
+    "type",             # POSITION, EXECUTION, ...
+    "sub_type",
+    "units",
+    "representation",   # VALUE unless given - TIME_SERIES, DISCRETE, DATA_SET, TABLE
+])
+
+
+def local_name(tag):
+    return tag[tag.index("}") + 1:] if tag[0] == "{" else tag
+
+
+def parse_probe(content, machine_name):
+
+    # dataItemId -> DataItemDefinition of every data item of the machine's Device
+    root = fromstring(content)
+    definitions = {}
+    for device in root.iter():
+        if local_name(device.tag) != "Device" or device.get("name") != machine_name:
+            continue
+        for element in device.iter():
+            if local_name(element.tag) != "DataItem":
+                continue
+            definitions[element.get("id")] = DataItemDefinition(
+                element.get("id"), element.get("category"), element.get("type"), element.get("subType"),
+                element.get("units"), element.get("representation", "VALUE"))
+    return definitions
+
+
+def load_probe(client, machine_name, cache_dir=None):
+
+    # Data item definitions of the machine, read from the agent once at startup. The last good document is kept
+    # in `cache_dir` so that a start while the agent is down still decodes the values.
+    # Returns None when neither the agent nor the cache has the machine.
+    logger = logging.getLogger("Probe")
+    cache_path = os.path.join(cache_dir, machine_name + ".xml") if cache_dir else None
+
+    content = None
+    try:
+        response = client.get("/" + machine_name + "/probe")
+        response.raise_for_status()
+        content = response.content
+    except requests.RequestException as e:
+        logger.warning(f"Agent /probe failed with {e}")
+
+    if content is not None:
+        try:
+            definitions = parse_probe(content, machine_name)
+        except ParseError as e:
+            logger.warning(f"Invalid /probe document - {e}")
+            definitions = {}
+        if definitions:
+            if cache_path is not None:
+                os.makedirs(cache_dir, exist_ok=True)
+                temporary = cache_path + ".tmp"
+                with open(temporary, "wb") as filehandle:
+                    filehandle.write(content)
+                os.replace(temporary, cache_path)
+            return definitions
+
+    if cache_path is not None and os.path.exists(cache_path):
+        logger.info(f"Using the cached /probe of {machine_name}")
+        with open(cache_path, "rb") as filehandle:
+            return parse_probe(filehandle.read(), machine_name) or None
+    return None
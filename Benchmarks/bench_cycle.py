@@ -0,0 +1,205 @@
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import resource
+import subprocess
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Agent.client import AgentClient
+from Agent.acquisition import get_acquisition
+from Machine.monitoring import MachineStateMonitor
+from MQTT.encoders import JsonEncoder
+from MQTT.publisher import StatusPublisher
+from bench_parser import RecordedResponse
+from fake_agent import FakeAgent
+from stub_mqtt import StubMqttConnection
+from generate_fixtures import device_name, write_fixture
+
+
+# Cost of one poll cycle - agent request + MachineStateMonitor update, then encoding and publishing -
+# for documents of 1 to 50 devices with 10 to 1000 data items each. Every case runs in its own process
+# so that the peak RSS belongs to the case. Results are written as JSON, --compare flags regressions
+# against an earlier run.
+
+
+def timings(samples):
+
+    samples = sorted(samples)
+    return {
+        "mean_ms": 1e3 * sum(samples) / len(samples),
+        "p50_ms": 1e3 * samples[len(samples) // 2],
+        "p95_ms": 1e3 * samples[min(len(samples) - 1, int(0.95 * len(samples)))],
+        "max_ms": 1e3 * samples[-1],
+    }
+
+
+def run_case(devices, items, acquisition_mode, iterations, changes):
+
+    fixture = write_fixture(devices, items)
+    machine_name = device_name(0)
+    agent = FakeAgent(fixture, seed=0)
+    # No ticker, the observations change once per cycle
+    server = agent.serve(rate=0)
+    client = AgentClient(f"http://127.0.0.1:{server.server_address[1]}")
+    monitor = MachineStateMonitor(machine_name=machine_name, devices_xml=None)
+    acquisition = get_acquisition(monitor, {"acquisition": acquisition_mode}, client=client)
+    connection = StubMqttConnection()
+    publisher = StatusPublisher(connection, "status/bench", mode="delta", keyframe_interval=30)
+
+    # Warm up - first snapshot and keyframe
+    acquisition.poll()
+    publisher.publish(monitor)
+
+    poll_times, publish_times, cycle_times = [], [], []
+    for _ in range(iterations):
+        agent.tick(changes)
+        start = time.perf_counter()
+        acquisition.poll()
+        polled = time.perf_counter()
+        publisher.publish(monitor)
+        end = time.perf_counter()
+        poll_times.append(polled - start)
+        publish_times.append(end - polled)
+        cycle_times.append(end - start)
+
+    # Without the HTTP round trip - parsing a recorded /current document of every device and encoding the whole params
+    response = RecordedResponse(agent.current())
+    parser_monitor = MachineStateMonitor(machine_name=machine_name, devices_xml=None)
+    parse_times = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        parser_monitor.update_machine_state(response)
+        parse_times.append(time.perf_counter() - start)
+
+    encoder = JsonEncoder()
+    params = parser_monitor.machine_params
+    encode_times = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        message = encoder.encode(params, keyframe=True)
+        encode_times.append(time.perf_counter() - start)
+
+    agent.tick(changes)
+    sample_document = agent.sample(machine_name, monitor.next_sequence, 1000)[0]
+
+    # Python allocations of one cycle
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    acquisition.poll()
+    publisher.publish(monitor)
+    _, peak = tracemalloc.get_traced_memory()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    allocated = sum(stat.count_diff for stat in after.compare_to(before, "filename") if stat.count_diff > 0)
+
+    server.shutdown()
+    server.stop_ticker.set()
+    client.close()
+
+    return {
+        "devices": devices,
+        "items": items,
+        "acquisition": acquisition_mode,
+        "iterations": iterations,
+        "current_bytes": len(response.content),
+        "sample_bytes": len(sample_document),
+        "full_payload_bytes": len(message),
+        "published_bytes_per_cycle": connection.bytes / (iterations + 1),
+        "cycle": timings(cycle_times),
+        "poll": timings(poll_times),
+        "publish": timings(publish_times),
+        "parse_current": timings(parse_times),
+        "encode_full_json": timings(encode_times),
+        "alloc_peak_kib": peak / 1024,
+        "alloc_retained_blocks": allocated,
+        # Linux reports KiB
+        "peak_rss_kib": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+
+def run_isolated(devices, items, acquisition_mode, iterations, changes):
+
+    command = [sys.executable, os.path.abspath(__file__), "--case", f"{devices}x{items}",
+               "-a", acquisition_mode, "-n", str(iterations), "-c", str(changes)]
+    output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+    return json.loads(output)
+
+
+def metadata():
+
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {"time": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()), "commit": commit,
+            "python": platform.python_version(), "machine": platform.machine(), "platform": platform.platform()}
+
+
+def compare(results, baseline, threshold):
+
+    # Cases whose mean cycle time or peak RSS grew by more than `threshold`
+    previous = {(case["devices"], case["items"], case["acquisition"]): case for case in baseline["results"]}
+    regressions = []
+    for case in results:
+        old = previous.get((case["devices"], case["items"], case["acquisition"]))
+        if old is None:
+            continue
+        for metric, new_value, old_value in (("cycle mean", case["cycle"]["mean_ms"], old["cycle"]["mean_ms"]),
+                                             ("peak RSS", case["peak_rss_kib"], old["peak_rss_kib"])):
+            if old_value and new_value > old_value * (1 + threshold):
+                regressions.append(f"{case['devices']}x{case['items']} {case['acquisition']}: {metric} "
+                                   f"{old_value:.1f} -> {new_value:.1f} (+{100 * (new_value / old_value - 1):.0f}%)")
+    return regressions
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-d", "--devices", help="DeviceStreams per document", type=int, nargs="+", default=[1, 10, 50])
+    parser.add_argument("-i", "--items", help="Data items per device", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("-a", "--acquisition", help="Acquisition modes", nargs="+", default=["current", "sample"])
+    parser.add_argument("-n", "--iterations", help="Cycles per case", type=int, default=50)
+    parser.add_argument("-c", "--changes", help="Changed samples per device and cycle", type=int, default=5)
+    parser.add_argument("-o", "--output", help="JSON results file, stdout when not given")
+    parser.add_argument("--compare", help="Earlier results file to check for regressions")
+    parser.add_argument("--threshold", help="Allowed slowdown before a regression is reported", type=float,
+                        default=0.1)
+    parser.add_argument("--case", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.case:
+        # Child process of run_isolated
+        devices, items = (int(value) for value in args.case.split("x"))
+        print(json.dumps(run_case(devices, items, args.acquisition[0], args.iterations, args.changes)))
+        sys.exit(0)
+
+    results = []
+    for devices in args.devices:
+        for items in args.items:
+            for acquisition_mode in args.acquisition:
+                case = run_isolated(devices, items, acquisition_mode, args.iterations, args.changes)
+                results.append(case)
+                print(f"{devices:>3} devices x {items:>4} items {acquisition_mode:<8}"
+                      f" cycle {case['cycle']['mean_ms']:8.3f} ms (p95 {case['cycle']['p95_ms']:8.3f})"
+                      f"  parse {case['parse_current']['mean_ms']:8.3f} ms"
+                      f"  encode {case['encode_full_json']['mean_ms']:7.3f} ms"
+                      f"  rss {case['peak_rss_kib'] / 1024:6.1f} MiB", file=sys.stderr)
+
+    report = {"meta": metadata(), "results": results}
+    if args.output:
+        with open(args.output, "w") as filehandle:
+            json.dump(report, filehandle, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+    if args.compare:
+        with open(args.compare, "r") as filehandle:
+            regressions = compare(results, json.load(filehandle), args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        sys.exit(1 if regressions else 0)
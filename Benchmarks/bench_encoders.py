@@ -0,0 +1,66 @@
+import os
+import sys
+import time
+import yaml
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Machine.monitoring import MachineStateMonitor
+from MQTT.encoders import JsonEncoder, MessagePackEncoder, CborEncoder, SchemaEncoder, SchemaDecoder
+from bench_parser import FIXTURE, CONFIG, RecordedResponse
+
+
+def measure(encoder, payload, keyframe, iterations):
+
+    start = time.perf_counter()
+    for _ in range(iterations):
+        message = encoder.encode(payload, keyframe=keyframe)
+    return len(message), (time.perf_counter() - start) / iterations
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-f", "--fixture", help="Recorded /current document", default=FIXTURE)
+    parser.add_argument("-m", "--machine", help="Name of the DeviceStream", default="FANUCROBONANO")
+    parser.add_argument("-n", "--iterations", help="Number of encodes", type=int, default=5000)
+    parser.add_argument("-cf", "--config", help="Config file with the devices_xml allow-list", default=CONFIG)
+    args = parser.parse_args()
+
+    with open(args.fixture, "rb") as filehandle:
+        response = RecordedResponse(filehandle.read())
+    with open(args.config, "r") as filehandle:
+        devices_xml = yaml.load(filehandle, Loader=yaml.Loader)["adapter"]["devices_xml"]
+
+    monitor = MachineStateMonitor(machine_name=args.machine, devices_xml=devices_xml)
+    monitor.update_machine_state(response)
+    changed, full = monitor.take_changes(full=True)
+    # Typical delta while cutting - one axis position and its load
+    component_name = next(name for name, categories in full.items() if "Position" in categories.get("Samples", {}))
+    leaves = [(component_name, "Samples", "Position"), (component_name, "Samples", "Load")]
+    delta = monitor.state.serialize(leaves)
+    # The schema encoding keys its fields by dataItemId
+    schema_full = monitor.state.serialize(ids=True)
+    schema_delta = monitor.state.serialize(leaves, ids=True)
+
+    encoders = [("json", JsonEncoder()), ("msgpack", MessagePackEncoder()), ("cbor", CborEncoder())]
+    schema = SchemaEncoder()
+
+    print(f"Fixture: {args.fixture}, device: {args.machine}, {len(changed)} allow-listed leaves")
+    print(f"{'encoding':<18}{'full B':>8}{'full us':>10}{'delta B':>9}{'delta us':>10}")
+    for label, encoder in encoders:
+        full_bytes, full_time = measure(encoder, full, True, args.iterations)
+        delta_bytes, delta_time = measure(encoder, delta, False, args.iterations)
+        print(f"{label:<18}{full_bytes:>8}{full_time * 1e6:>10.1f}{delta_bytes:>9}{delta_time * 1e6:>10.1f}")
+
+    # Keyframe carries the field dictionary, later messages only IDs and values
+    keyframe_bytes, keyframe_time = measure(schema, schema_full, True, args.iterations)
+    full_bytes, full_time = measure(schema, schema_full, False, args.iterations)
+    delta_bytes, delta_time = measure(schema, schema_delta, False, args.iterations)
+    print(f"{'schema (keyframe)':<18}{keyframe_bytes:>8}{keyframe_time * 1e6:>10.1f}")
+    print(f"{'schema':<18}{full_bytes:>8}{full_time * 1e6:>10.1f}{delta_bytes:>9}{delta_time * 1e6:>10.1f}")
+
+    # Round trip through the cloud side decoder
+    decoder = SchemaDecoder()
+    decoder.decode(schema.encode(schema_full, keyframe=True))
+    assert decoder.decode(schema.encode(schema_delta)) == JsonEncoder.decode(JsonEncoder().encode(delta))
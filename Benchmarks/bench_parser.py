@@ -0,0 +1,136 @@
+import os
+import sys
+import json
+import time
+import yaml
+import argparse
+import tracemalloc
+from xml.dom.minidom import parseString
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Machine.monitoring import MachineStateMonitor
+
+
+FIXTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "current_multi_device.xml")
+CONFIG = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "config.yml")
+
+
+class RecordedResponse:
+
+    # Minimal stand-in for `requests.Response`
+    def __init__(self, content):
+        self.content = content
+        self.text = content.decode("utf-8")
+
+
+class LegacyMachineStateMonitor:
+
+    # The three pass minidom implementation, kept for comparison (device lookup fixed to not stop at the first device)
+    def __init__(self, machine_name, devices_xml):
+
+        self.machine_name = machine_name
+        self.machine_availability = False
+        self.selected_device = None
+        self.devices_xml = devices_xml
+        self.machine_params = {}
+
+    def get_set_machine_availability(self, response):
+
+        document = parseString(response.text)
+        availabilities = document.getElementsByTagName('Availability')
+        for availability in availabilities:
+            if availability.getAttribute("dataItemId") == self.machine_name + "_avail_01":
+                if availability.childNodes[0].nodeValue == "AVAILABLE":
+                    self.machine_availability = True
+                    return
+
+        self.machine_availability = False
+
+    def get_set_machine_type(self, response):
+
+        document = parseString(response.text)
+        devices = document.getElementsByTagName('DeviceStream')
+        for device in devices:
+            if device.getAttribute("name") == self.machine_name:
+                self.selected_device = device
+                return
+
+    def update_machine_state(self, response):
+
+        document = parseString(response.text)
+        self.get_set_machine_availability(response)
+
+        if self.machine_availability:
+            self.get_set_machine_type(response)
+        else:
+            return
+
+        for component in self.selected_device.getElementsByTagName('ComponentStream'):
+            component_name = component.getAttribute("name")
+            if component_name not in self.machine_params:
+                self.machine_params[component_name] = {}
+
+            for child_node in component.childNodes:
+                if child_node.nodeName not in self.machine_params[component_name]:
+                    self.machine_params[component_name][child_node.nodeName] = {}
+
+                for child_child_node in child_node.childNodes:
+                    if child_child_node not in self.machine_params[component_name][child_node.nodeName]:
+                        self.machine_params[component_name][child_node.nodeName][child_child_node.nodeName] = []
+
+                    if child_child_node.firstChild is not None:
+                        value = child_child_node.firstChild.nodeValue
+                    else:
+                        value = None
+                    self.machine_params[component_name][child_node.nodeName][child_child_node.nodeName].append(
+                        (child_child_node.getAttribute("name"), value))
+
+        return True
+
+
+def measure(monitor, response, iterations):
+
+    # Warm up
+    monitor.update_machine_state(response)
+
+    start = time.perf_counter()
+    for _ in range(iterations):
+        monitor.update_machine_state(response)
+    elapsed = (time.perf_counter() - start) / iterations
+
+    tracemalloc.start()
+    monitor.update_machine_state(response)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return elapsed, peak
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-f", "--fixture", help="Recorded /current document", default=FIXTURE)
+    parser.add_argument("-m", "--machine", help="Name of the DeviceStream", default="FANUCROBONANO")
+    parser.add_argument("-n", "--iterations", help="Number of parses", type=int, default=500)
+    parser.add_argument("-cf", "--config", help="Config file with the devices_xml allow-list", default=CONFIG)
+    args = parser.parse_args()
+
+    with open(args.fixture, "rb") as filehandle:
+        response = RecordedResponse(filehandle.read())
+    with open(args.config, "r") as filehandle:
+        devices_xml = yaml.load(filehandle, Loader=yaml.Loader)["adapter"]["devices_xml"]
+
+    results = {}
+    for label, monitor_class, allow_list in (("minidom (3 passes)", LegacyMachineStateMonitor, {}),
+                                             ("pull parser (1 pass)", MachineStateMonitor, {}),
+                                             ("pull parser + filter", MachineStateMonitor, devices_xml)):
+        monitor = monitor_class(machine_name=args.machine, devices_xml=allow_list)
+        elapsed, peak = measure(monitor, response, args.iterations)
+        results[label] = (elapsed, peak, len(json.dumps(monitor.machine_params)))
+
+    print(f"Fixture: {args.fixture} ({len(response.content)} bytes), device: {args.machine}")
+    for label, (elapsed, peak, payload) in results.items():
+        print(f"{label:<22} {elapsed * 1e3:8.3f} ms/poll   peak {peak / 1024:8.1f} KiB   payload {payload:6d} B")
+    baseline = results["minidom (3 passes)"][0]
+    for label in ("pull parser (1 pass)", "pull parser + filter"):
+        print(f"Speed-up ({label}): {baseline / results[label][0]:.2f}x")
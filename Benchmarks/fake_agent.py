@@ -0,0 +1,315 @@
+import os
+import re
+import time
+import random
+import argparse
+import itertools
+import threading
+from collections import deque
+from datetime import datetime, timezone
+from urllib.parse import urlparse, parse_qs
+from xml.etree.ElementTree import fromstring
+from xml.sax.saxutils import escape, quoteattr
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+# Local stand-in for the cppagent - serves /probe, /current, /sample and the multipart /sample stream
+FIXTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "current_multi_device.xml")
+NAMESPACE = "urn:mtconnect.org:MTConnectStreams:1.3"
+BOUNDARY = "9a5bf7cc6b8e4b0d8e0b0f1f3c2a1d7e"
+# Samples that change while the fake machine is running
+CHANGING = {"Position", "Load", "Angle", "PathFeedrate", "RotaryVelocity"}
+# Streams category -> DataItem category
+CATEGORIES = {"Samples": "SAMPLE", "Events": "EVENT", "Condition": "CONDITION"}
+
+
+def local_name(tag):
+    return tag.split("}")[-1]
+
+
+def utc_timestamp():
+    return datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+
+class FakeAgent:
+
+    def __init__(self, fixture=FIXTURE, buffer_size=131072, seed=None):
+
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.instance_id = str(int(time.time()))
+        self.buffer_size = buffer_size
+        # Observations in the buffer - (sequence, (device, component attributes, category, item))
+        self.buffer = deque(maxlen=buffer_size)
+        self.next_sequence = 1
+        # device -> (device attributes, [(device, component attributes, category, item)]) with item = [tag, attributes, text]
+        self.devices = {}
+        self.load_fixture(fixture)
+
+    @property
+    def first_sequence(self):
+        return self.buffer[0][0] if self.buffer else self.next_sequence
+
+    def load_fixture(self, fixture):
+
+        with open(fixture, "rb") as filehandle:
+            root = fromstring(filehandle.read())
+
+        for device in root.iter(f"{{{NAMESPACE}}}DeviceStream"):
+            name = device.get("name")
+            items = []
+            for component in device:
+                for category in component:
+                    for element in category:
+                        item = [local_name(element.tag), dict(element.attrib), element.text]
+                        items.append((name, dict(component.attrib), local_name(category.tag), item))
+            self.devices[name] = (dict(device.attrib), items)
+
+        # Every item enters the buffer once
+        for _, items in self.devices.values():
+            for entry in items:
+                self.record(entry, entry[3][2])
+
+    def record(self, entry, text):
+
+        device, component_attributes, category, item = entry
+        item[1]["sequence"] = str(self.next_sequence)
+        item[1]["timestamp"] = utc_timestamp()
+        item[2] = text
+        # Keep a copy, the item keeps changing
+        self.buffer.append((self.next_sequence, (device, component_attributes, category,
+                                                 [item[0], dict(item[1]), text])))
+        self.next_sequence += 1
+
+    def tick(self, changes=5):
+
+        # Jitter a few samples of every device
+        with self.lock:
+            for _, items in self.devices.values():
+                candidates = [entry for entry in items if entry[2] == "Samples" and entry[3][0] in CHANGING]
+                for entry in self.random.sample(candidates, min(changes, len(candidates))):
+                    try:
+                        value = float(entry[3][2]) + self.random.uniform(-0.5, 0.5)
+                    except (TypeError, ValueError):
+                        continue
+                    self.record(entry, f"{value:.4f}")
+
+    def render_header(self, next_sequence, last_sequence):
+
+        return (f'<Header creationTime="{utc_timestamp()}" sender="fake-agent" instanceId="{self.instance_id}" '
+                f'version="1.5.0.14" bufferSize="{self.buffer_size}" nextSequence="{next_sequence}" '
+                f'firstSequence="{self.first_sequence}" lastSequence="{last_sequence}"/>')
+
+    @staticmethod
+    def render_streams(grouped):
+
+        parts = ["<Streams>"]
+        for device_attributes, components in grouped:
+            attributes = "".join(f" {k}={quoteattr(v)}" for k, v in device_attributes.items())
+            parts.append(f"<DeviceStream{attributes}>")
+            for component_attributes, categories in components.values():
+                attributes = "".join(f" {k}={quoteattr(v)}" for k, v in component_attributes.items())
+                parts.append(f"<ComponentStream{attributes}>")
+                for category, items in categories.items():
+                    parts.append(f"<{category}>")
+                    for tag, item_attributes, text in items:
+                        attributes = "".join(f" {k}={quoteattr(v)}" for k, v in item_attributes.items())
+                        if text is None:
+                            parts.append(f"<{tag}{attributes}/>")
+                        else:
+                            parts.append(f"<{tag}{attributes}>{escape(text)}</{tag}>")
+                    parts.append(f"</{category}>")
+                parts.append("</ComponentStream>")
+            parts.append("</DeviceStream>")
+        parts.append("</Streams>")
+        return "".join(parts)
+
+    def group(self, device_names, items):
+
+        # device -> componentId -> category -> items, in document order
+        grouped = {}
+        for device_name, component_attributes, category, item in items:
+            device = grouped.setdefault(device_name, (self.devices[device_name][0], {}))
+            component = device[1].setdefault(component_attributes["componentId"], (component_attributes, {}))
+            component[1].setdefault(category, []).append(item)
+        return [grouped[name] for name in device_names if name in grouped]
+
+    def device_names(self, device):
+        return list(self.devices) if device is None else [device]
+
+    def current(self, device=None):
+
+        with self.lock:
+            names = self.device_names(device)
+            items = []
+            for name in names:
+                for _, component_attributes, category, item in self.devices[name][1]:
+                    items.append((name, component_attributes, category, [item[0], dict(item[1]), item[2]]))
+            header = self.render_header(self.next_sequence, self.next_sequence - 1)
+            return self.document(header, self.render_streams(self.group(names, items)))
+
+    def sample(self, device=None, start=None, count=100):
+
+        with self.lock:
+            if start is None:
+                start = self.first_sequence
+            if start < self.first_sequence or start > self.next_sequence:
+                return self.error("OUT_OF_RANGE", f"'from' must be between {self.first_sequence} "
+                                                  f"and {self.next_sequence}"), self.next_sequence
+
+            names = self.device_names(device)
+            items = []
+            next_sequence = self.next_sequence
+            # Sequences in the buffer are contiguous
+            for sequence, observation in itertools.islice(self.buffer, start - self.first_sequence, None):
+                if len(items) == count:
+                    next_sequence = sequence
+                    break
+                if observation[0] in names:
+                    items.append(observation)
+            header = self.render_header(next_sequence, self.next_sequence - 1)
+            return self.document(header, self.render_streams(self.group(names, items))), next_sequence
+
+    def probe(self, device=None):
+
+        # MTConnectDevices built from the items of the fixture - PathFeedrate -> PATH_FEEDRATE
+        with self.lock:
+            parts = ["<Devices>"]
+            for name in self.device_names(device):
+                device_attributes, items = self.devices[name]
+                parts.append(f"<Device id={quoteattr(device_attributes.get('uuid', name))} name={quoteattr(name)}>"
+                             f"<DataItems>")
+                for _, _, category, (tag, attributes, _) in items:
+                    if category == "Condition":
+                        data_item_type = attributes.get("type", "")
+                    else:
+                        data_item_type = re.sub(r"(?<!^)(?=[A-Z])", "_", tag).upper()
+                    sub_type = f" subType={quoteattr(attributes['subType'])}" if "subType" in attributes else ""
+                    parts.append(f"<DataItem id={quoteattr(attributes['dataItemId'])} "
+                                 f"category=\"{CATEGORIES[category]}\" type={quoteattr(data_item_type)}{sub_type}/>")
+                parts.append("</DataItems></Device>")
+            parts.append("</Devices>")
+            header = self.render_header(self.next_sequence, self.next_sequence - 1)
+        return (f'<?xml version="1.0" encoding="UTF-8"?>\n'
+                f'<MTConnectDevices xmlns="urn:mtconnect.org:MTConnectDevices:1.3">'
+                f'{header}{"".join(parts)}</MTConnectDevices>').encode("utf-8")
+
+    @staticmethod
+    def document(header, streams):
+        return (f'<?xml version="1.0" encoding="UTF-8"?>\n<MTConnectStreams xmlns="{NAMESPACE}">'
+                f'{header}{streams}</MTConnectStreams>').encode("utf-8")
+
+    def error(self, code, message):
+        return (f'<?xml version="1.0" encoding="UTF-8"?>\n'
+                f'<MTConnectError xmlns="urn:mtconnect.org:MTConnectError:1.3">'
+                f'{self.render_header(self.next_sequence, self.next_sequence - 1)}'
+                f'<Errors><Error errorCode="{code}">{escape(message)}</Error></Errors>'
+                f'</MTConnectError>').encode("utf-8")
+
+    def serve(self, host="127.0.0.1", port=0, rate=10.0):
+
+        # Start the HTTP server and the ticker in background threads, returns the server
+        agent = self
+        stop = threading.Event()
+
+        class Handler(FakeAgentHandler):
+            fake_agent = agent
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        server.daemon_threads = True
+        server.stop_ticker = stop
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+        def ticker():
+            while not stop.wait(1.0 / rate):
+                agent.tick()
+
+        if rate > 0:
+            threading.Thread(target=ticker, daemon=True).start()
+        return server
+
+
+class FakeAgentHandler(BaseHTTPRequestHandler):
+
+    fake_agent = None
+    protocol_version = "HTTP/1.1"
+    # Headers and body go out as separate writes, Nagle would hold the body for the delayed ACK
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        return
+
+    def do_GET(self):
+
+        url = urlparse(self.path)
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        segments = [segment for segment in url.path.split("/") if segment]
+        if not segments or segments[-1] not in ("probe", "current", "sample"):
+            self.send_error(404)
+            return
+
+        device = segments[0] if len(segments) == 2 else None
+        if device is not None and device not in self.fake_agent.devices:
+            self.send_error(404)
+            return
+
+        start = int(query["from"]) if "from" in query else None
+        count = int(query.get("count", 100))
+        if segments[-1] == "probe":
+            self.send_document(self.fake_agent.probe(device))
+        elif segments[-1] == "current":
+            self.send_document(self.fake_agent.current(device))
+        elif "interval" in query:
+            self.stream(device, start, count, int(query["interval"]), int(query.get("heartbeat", 10000)))
+        else:
+            self.send_document(self.fake_agent.sample(device, start, count)[0])
+
+    def send_document(self, body):
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/xml")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def stream(self, device, start, count, interval, heartbeat):
+
+        self.send_response(200)
+        self.send_header("Content-Type", f"multipart/x-mixed-replace;boundary={BOUNDARY}")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        if start is None:
+            start = self.fake_agent.next_sequence
+        last_sent = 0.0
+        try:
+            while True:
+                body, next_sequence = self.fake_agent.sample(device, start, count)
+                # Send changes right away, otherwise only on heartbeat
+                if next_sequence != start or time.monotonic() - last_sent >= heartbeat / 1000.0:
+                    part = (f"--{BOUNDARY}\r\nContent-type: text/xml\r\n"
+                            f"Content-length: {len(body)}\r\n\r\n").encode("ascii") + body + b"\r\n"
+                    # One HTTP chunk per part, like the cppagent
+                    self.wfile.write(f"{len(part):x}\r\n".encode("ascii") + part + b"\r\n")
+                    self.wfile.flush()
+                    last_sent = time.monotonic()
+                    start = next_sequence
+                time.sleep(interval / 1000.0)
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-f", "--fixture", help="Recorded /current document", default=FIXTURE)
+    parser.add_argument("-p", "--port", help="Port to listen on", type=int, default=5001)
+    parser.add_argument("-r", "--rate", help="Changes per second", type=float, default=10.0)
+    args = parser.parse_args()
+
+    fake_server = FakeAgent(args.fixture).serve(host="0.0.0.0", port=args.port, rate=args.rate)
+    print(f"Fake agent listening on port {fake_server.server_address[1]}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        fake_server.shutdown()
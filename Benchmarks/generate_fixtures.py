@@ -0,0 +1,122 @@
+import os
+import random
+import argparse
+from xml.sax.saxutils import quoteattr
+
+
+# Synthetic MTConnectStreams /current documents of a given size, laid out like the cppagent output
+# Generated on demand and not committed, the documents are deterministic for a seed
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "generated")
+NAMESPACE = "urn:mtconnect.org:MTConnectStreams:1.3"
+TIMESTAMP = "2024-02-14T18:32:20.993908Z"
+
+
+def device_name(index):
+    return f"MACHINE{index:02d}"
+
+
+def device_items(name, items, rng):
+
+    # [(component attributes, (category, tag, item attributes, text))] - exactly `items` data items
+    components = [
+        ({"component": "Device", "name": name, "componentId": f"{name}_dev"}, [
+            ("Events", "Availability", {"dataItemId": f"{name}_avail_01"}, "AVAILABLE"),
+        ]),
+        ({"component": "Controller", "name": "controller", "componentId": f"{name}_cont"}, [
+            ("Events", "EmergencyStop", {"dataItemId": f"{name}_estop"}, "ARMED"),
+            ("Events", "ControllerMode", {"dataItemId": f"{name}_mode"}, "AUTOMATIC"),
+            ("Events", "Message", {"dataItemId": f"{name}_msg"}, "UNAVAILABLE"),
+            ("Condition", "Normal", {"dataItemId": f"{name}_system", "type": "SYSTEM"}, None),
+        ]),
+        ({"component": "Path", "name": "path", "componentId": f"{name}_path"}, [
+            ("Events", "Execution", {"dataItemId": f"{name}_exec"}, "ACTIVE"),
+            ("Events", "PartCount", {"dataItemId": f"{name}_pc"}, "12"),
+            ("Samples", "PathFeedrate", {"dataItemId": f"{name}_pf", "subType": "ACTUAL"}, "1200.0000"),
+        ]),
+    ]
+    count = sum(len(entries) for _, entries in components)
+
+    # Axes fill up the rest - Linear with Position and Load, Rotary with Angle, RotaryVelocity and Load
+    axis = 0
+    while count < items:
+        rotary = axis % 3 == 2
+        axis_name = f"A{axis}"
+        component = {"component": "Rotary" if rotary else "Linear", "name": axis_name,
+                     "componentId": f"{name}_{axis_name}"}
+        tags = ("Angle", "RotaryVelocity", "Load") if rotary else ("Position", "Load")
+        entries = []
+        for tag in tags[:items - count]:
+            attributes = {"dataItemId": f"{name}_{axis_name}_{tag.lower()}", "name": f"{axis_name}{tag[0]}",
+                          "subType": "ACTUAL"}
+            entries.append(("Samples", tag, attributes, f"{rng.uniform(-100.0, 100.0):.4f}"))
+        components.append((component, entries))
+        count += len(entries)
+        axis += 1
+
+    # Trim the fixed components for very small documents, the availability stays
+    return [(component, entry) for component, entries in components for entry in entries][:items]
+
+
+def generate_current(devices, items, seed=0):
+
+    # /current document with `devices` DeviceStreams of `items` data items each
+    rng = random.Random(seed)
+    sequence = 1
+    streams = ["<Streams>"]
+    for index in range(devices):
+        name = device_name(index)
+        streams.append(f"<DeviceStream name={quoteattr(name)} uuid={quoteattr(name.lower())}>")
+        # Group by component and category, in document order
+        grouped = {}
+        for component, (category, tag, attributes, text) in device_items(name, items, rng):
+            entry = grouped.setdefault(component["componentId"], (component, {}))
+            entry[1].setdefault(category, []).append((tag, attributes, text))
+
+        for component, categories in grouped.values():
+            streams.append("<ComponentStream" + "".join(f" {k}={quoteattr(v)}" for k, v in component.items()) + ">")
+            for category, elements in categories.items():
+                streams.append(f"<{category}>")
+                for tag, attributes, text in elements:
+                    attributes = dict(attributes, timestamp=TIMESTAMP, sequence=str(sequence))
+                    sequence += 1
+                    rendered = "".join(f" {k}={quoteattr(v)}" for k, v in attributes.items())
+                    streams.append(f"<{tag}{rendered}/>" if text is None else f"<{tag}{rendered}>{text}</{tag}>")
+                streams.append(f"</{category}>")
+            streams.append("</ComponentStream>")
+        streams.append("</DeviceStream>")
+    streams.append("</Streams>")
+
+    header = (f'<Header creationTime="{TIMESTAMP}" sender="fixture" instanceId="1707935412" version="1.5.0.14" '
+              f'bufferSize="131072" nextSequence="{sequence}" firstSequence="1" lastSequence="{sequence - 1}"/>')
+    return (f'<?xml version="1.0" encoding="UTF-8"?>\n<MTConnectStreams xmlns="{NAMESPACE}">'
+            f'{header}{"".join(streams)}</MTConnectStreams>').encode("utf-8")
+
+
+def fixture_path(devices, items, directory=FIXTURE_DIR):
+    return os.path.join(directory, f"current_{devices}x{items}.xml")
+
+
+def write_fixture(devices, items, directory=FIXTURE_DIR, seed=0):
+
+    # Written once and reused
+    path = fixture_path(devices, items, directory)
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    if not os.path.exists(path):
+        with open(path, "wb") as filehandle:
+            filehandle.write(generate_current(devices, items, seed))
+    return path
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-d", "--devices", help="DeviceStreams per document", type=int, nargs="+", default=[1, 10, 50])
+    parser.add_argument("-i", "--items", help="Data items per device", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("-o", "--output", help="Directory for the fixtures", default=FIXTURE_DIR)
+    args = parser.parse_args()
+
+    for devices in args.devices:
+        for items in args.items:
+            path = write_fixture(devices, items, args.output)
+            print(f"{path} ({os.path.getsize(path)} bytes)")
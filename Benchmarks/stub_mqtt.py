@@ -0,0 +1,32 @@
+import itertools
+import threading
+from concurrent.futures import Future
+
+
+class StubMqttConnection:
+
+    # Stand-in for the awscrt MQTT connection, every publish is acknowledged right away
+    def __init__(self):
+
+        self.lock = threading.Lock()
+        self.packet_ids = itertools.count(1)
+        # topic -> [messages, bytes]
+        self.topics = {}
+
+    def publish(self, topic, payload, qos):
+
+        future = Future()
+        future.set_result({"packet_id": None})
+        with self.lock:
+            counters = self.topics.setdefault(topic, [0, 0])
+            counters[0] += 1
+            counters[1] += len(payload)
+            return future, next(self.packet_ids)
+
+    @property
+    def messages(self):
+        return sum(counters[0] for counters in self.topics.values())
+
+    @property
+    def bytes(self):
+        return sum(counters[1] for counters in self.topics.values())
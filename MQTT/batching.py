@@ -0,0 +1,213 @@
+import time
+import threading
+from awscrt import mqtt
+from MQTT.publisher import PublishMetrics
+from Machine.converters import format_timestamp
+
+
+class FieldSeries:
+
+    # Observations of one data item inside the batching window
+    __slots__ = ("component_name", "category", "data_item", "sub_type", "name", "timestamps", "values",
+                 "last_sequence")
+
+    def __init__(self, observation):
+
+        self.component_name = observation.component_name
+        self.category = observation.category
+        self.data_item = observation.data_item
+        self.sub_type = observation.sub_type
+        self.name = observation.name
+        self.timestamps = []
+        self.values = []
+        self.last_sequence = None
+
+    def as_series(self):
+        return {"t": self.timestamps, "v": self.values}
+
+    def as_aggregate(self):
+
+        # min/max/mean/last over the numeric values of the window
+        numbers = []
+        for value in self.values:
+            try:
+                numbers.append(float(value))
+            except (TypeError, ValueError):
+                continue
+
+        aggregate = {"n": len(self.values), "last": self.values[-1], "t": self.timestamps[-1]}
+        if numbers:
+            aggregate["min"] = min(numbers)
+            aggregate["max"] = max(numbers)
+            aggregate["mean"] = sum(numbers) / len(numbers)
+        return aggregate
+
+    def describe(self):
+        return {"component": self.component_name, "category": self.category, "dataItem": self.data_item,
+                "subType": self.sub_type, "name": self.name}
+
+
+class BatchPublisher:
+
+    # Collects observations from MachineStateMonitor over a window and publishes them as one message.
+    # The window closes after `window_seconds` or `window_count` observations, whichever comes first.
+    # With `aggregate`, Samples are reduced to min/max/mean/last - Events and Conditions are always sent as series.
+    # With `buffers` (the RingBufferStore of the monitor, read under the monitor `lock`) the aggregates are computed
+    # from the window of the ring buffers instead of copies of the values, at most `capacity` values per data item.
+    # Observations are only collected while `enabled`, i.e. while the upload is on.
+    def __init__(self, mqtt_connection, topic, encoder, window_seconds=10.0, window_count=None, aggregate=False,
+                 qos=mqtt.QoS.AT_LEAST_ONCE, buffers=None, lock=None):
+
+        self.mqtt_connection = mqtt_connection
+        self.topic = topic
+        self.encoder = encoder
+        self.window_seconds = window_seconds
+        self.window_count = window_count
+        self.aggregate = aggregate
+        self.qos = qos
+        self.enabled = True
+        self.lock = threading.Lock()
+        # dataItemId -> FieldSeries
+        self.fields = {}
+        # Aggregated from the ring buffers - dataItemId -> last sequence counted towards `window_count`, and
+        # buffer.total at the start of the window
+        self.buffers = buffers if aggregate else None
+        self.monitor_lock = lock
+        self.buffered = {}
+        self.marks = {}
+        self.count = 0
+        self.window_start = time.time()
+        # Counters
+        self.messages_sent = 0
+        self.bytes_sent = 0
+        self.metrics = PublishMetrics(topic)
+
+    @classmethod
+    def from_config(cls, mqtt_connection, topic, encoder, batch_config, buffers=None, lock=None):
+        return cls(mqtt_connection, topic, encoder,
+                   window_seconds=batch_config.get("window_seconds", 10.0),
+                   window_count=batch_config.get("window_count"),
+                   aggregate=batch_config.get("aggregate", False),
+                   qos=mqtt.QoS.AT_MOST_ONCE if batch_config.get("qos", 1) == 0 else mqtt.QoS.AT_LEAST_ONCE,
+                   buffers=buffers, lock=lock)
+
+    def on_observations(self, observations):
+
+        # Listener of MachineStateMonitor - with `always_poll` the machine is polled while the upload is paused,
+        # nothing is collected then
+        if not self.enabled:
+            return
+        with self.lock:
+            fields = self.fields
+            buffered = self.buffered
+            for observation in observations:
+                # Kept in the ring buffers already, only counted
+                if self.buffers is not None and observation.category == "Samples" \
+                        and observation.category in self.buffers.categories:
+                    if buffered.get(observation.data_item_id) == observation.sequence:
+                        continue
+                    buffered[observation.data_item_id] = observation.sequence
+                    self.count += 1
+                    continue
+                series = fields.get(observation.data_item_id)
+                if series is None:
+                    series = fields[observation.data_item_id] = FieldSeries(observation)
+                # A /current snapshot repeats observations that did not change
+                if observation.sequence == series.last_sequence:
+                    continue
+                series.last_sequence = observation.sequence
+                series.timestamps.append(observation.timestamp)
+                series.values.append(observation.value)
+                self.count += 1
+
+    def ready(self):
+
+        if self.window_count is not None and self.count >= self.window_count:
+            return True
+        return time.time() - self.window_start >= self.window_seconds
+
+    def reset(self):
+
+        if self.buffers is not None:
+            with self.monitor_lock:
+                self.marks = {data_item_id: buffer.total for data_item_id, buffer in self.buffers.items()}
+        with self.lock:
+            self.fields = {}
+            self.buffered = {}
+            self.count = 0
+            self.window_start = time.time()
+
+    def flush(self):
+
+        # Close the window and build the batch document
+        aggregates = {}
+        if self.buffers is not None:
+            # Monitor lock first, like the listener
+            with self.monitor_lock, self.lock:
+                aggregates = self.aggregate_buffers()
+                fields, self.fields = self.fields, {}
+                start, self.window_start = self.window_start, time.time()
+                self.count = 0
+        else:
+            with self.lock:
+                fields, self.fields = self.fields, {}
+                start, self.window_start = self.window_start, time.time()
+                self.count = 0
+
+        document = {"start": start, "end": self.window_start, "fields": aggregates}
+        for data_item_id, series in fields.items():
+            field = series.describe()
+            if self.aggregate and series.category == "Samples":
+                field.update(series.as_aggregate())
+            else:
+                field.update(series.as_series())
+            document["fields"][data_item_id] = field
+        return document
+
+    def aggregate_buffers(self):
+
+        # min/max/mean/last of the values appended to the ring buffers since the last window, vectorized over the
+        # buffer windows - called with both locks held
+        np = self.buffers.np
+        aggregates = {}
+        self.buffered = {}
+        for data_item_id, buffer in self.buffers.items():
+            new = buffer.total - self.marks.get(data_item_id, 0)
+            self.marks[data_item_id] = buffer.total
+            if new <= 0:
+                continue
+            times, values = buffer.latest(new)
+            last_value = float(values[-1])
+            aggregate = buffer.describe()
+            aggregate.update({"n": len(values), "last": None if last_value != last_value else last_value,
+                              "t": format_timestamp(float(times[-1]))})
+            numbers = values[~np.isnan(values)]
+            if len(numbers):
+                aggregate["min"] = float(numbers.min())
+                aggregate["max"] = float(numbers.max())
+                aggregate["mean"] = float(numbers.mean())
+            aggregates[data_item_id] = aggregate
+        return aggregates
+
+    def publish_if_ready(self):
+
+        if not self.ready():
+            return None
+        document = self.flush()
+        # Nothing observed in the window
+        if not document["fields"]:
+            return None
+
+        start = time.perf_counter()
+        message = self.encoder.pack(document)
+        encoded = time.perf_counter()
+        self.metrics.encode_seconds.observe(encoded - start)
+        future, _ = self.mqtt_connection.publish(
+            topic=self.topic,
+            payload=message,
+            qos=self.qos
+        )
+        self.metrics.published(message, future, encoded)
+        self.messages_sent += 1
+        self.bytes_sent += len(message)
+        return future
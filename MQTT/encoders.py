@@ -0,0 +1,203 @@
+import json
+
+
+# Payload encoders for the status upload, selected with `upload.encoding` in config.yml.
+# Every encoder has a matching decoder for the cloud side.
+#   json    - nested machine_params as JSON (previous behaviour)
+#   msgpack - nested machine_params as MessagePack (needs `msgpack`)
+#   cbor    - nested machine_params as CBOR (needs `cbor2`)
+#   schema  - numeric field IDs and values only, packed with MessagePack or CBOR. A field is one dataItemId, the
+#             field dictionary (component, category, dataItem, dataItemId, name) is sent with every keyframe
+#             and whenever a new field shows up, so messages in between carry only [id, value, id, value, ...].
+#             The ids of the fields of a removed leaf are listed under "r"
+
+
+def load_msgpack():
+    try:
+        import msgpack
+    except ImportError:
+        raise ImportError("The msgpack encoding requires the `msgpack` package - pip install msgpack")
+    return msgpack
+
+
+def load_cbor():
+    try:
+        import cbor2
+    except ImportError:
+        raise ImportError("The cbor encoding requires the `cbor2` package - pip install cbor2")
+    return cbor2
+
+
+class JsonEncoder:
+
+    # Params entries are (name, value) pairs
+    data_item_ids = False
+    name = "json"
+
+    def encode(self, payload, keyframe=False):
+        return json.dumps(payload)
+
+    def pack(self, document):
+        return json.dumps(document)
+
+    @staticmethod
+    def decode(message):
+        return json.loads(message)
+
+    unpack = decode
+
+
+class MessagePackEncoder:
+
+    # Params entries are (name, value) pairs
+    data_item_ids = False
+    name = "msgpack"
+
+    def __init__(self):
+        self.msgpack = load_msgpack()
+
+    def encode(self, payload, keyframe=False):
+        return self.msgpack.packb(payload)
+
+    def pack(self, document):
+        return self.msgpack.packb(document)
+
+    def decode(self, message):
+        return self.msgpack.unpackb(message)
+
+    unpack = decode
+
+
+class CborEncoder:
+
+    # Params entries are (name, value) pairs
+    data_item_ids = False
+    name = "cbor"
+
+    def __init__(self):
+        self.cbor2 = load_cbor()
+
+    def encode(self, payload, keyframe=False):
+        return self.cbor2.dumps(payload)
+
+    def pack(self, document):
+        return self.cbor2.dumps(document)
+
+    def decode(self, message):
+        return self.cbor2.loads(message)
+
+    unpack = decode
+
+
+class SchemaEncoder:
+
+    # Params entries are (name, value, dataItemId) - serialized with `ids=True`, so a field keeps its id when other
+    # data items of the leaf are dropped or show up in a different order
+    data_item_ids = True
+    name = "schema"
+
+    def __init__(self, packer="msgpack"):
+
+        self.packer = MessagePackEncoder() if packer == "msgpack" else CborEncoder()
+        # dataItemId -> field id
+        self.fields = {}
+        self.definitions = []
+
+    def encode(self, payload, keyframe=False):
+
+        fields = self.fields
+        values = []
+        removed = []
+        new_definitions = []
+        for component_name, categories in payload.items():
+            for category, data_items in categories.items():
+                for data_item, entries in data_items.items():
+                    # Removed leaf of a delta
+                    if entries is None:
+                        removed.extend(definition[0] for definition in self.definitions
+                                       if definition[1:4] == [component_name, category, data_item])
+                        continue
+                    for name, value, data_item_id in entries:
+                        field_id = fields.get(data_item_id)
+                        if field_id is None:
+                            field_id = len(self.definitions)
+                            fields[data_item_id] = field_id
+                            definition = [field_id, component_name, category, data_item, data_item_id, name]
+                            self.definitions.append(definition)
+                            new_definitions.append(definition)
+                        values.append(field_id)
+                        values.append(value)
+
+        message = {"v": values}
+        if removed:
+            message["r"] = removed
+        if keyframe:
+            message["k"] = 1
+            message["f"] = self.definitions
+        elif new_definitions:
+            message["f"] = new_definitions
+        return self.packer.encode(message)
+
+    def pack(self, document):
+        # Documents other than machine_params (e.g. batches) are packed as they are
+        return self.packer.pack(document)
+
+
+class SchemaDecoder:
+
+    # Cloud side of the schema encoding - keeps the field dictionary between messages
+    def __init__(self, packer="msgpack"):
+
+        self.packer = MessagePackEncoder() if packer == "msgpack" else CborEncoder()
+        self.fields = {}
+
+    def unpack(self, message):
+        # Documents other than machine_params (e.g. batches)
+        return self.packer.decode(message)
+
+    def decode(self, message):
+
+        message = self.packer.decode(message)
+        for field_id, component_name, category, data_item, data_item_id, name in message.get("f", []):
+            self.fields[field_id] = (component_name, category, data_item, data_item_id, name)
+
+        payload = {}
+        values = message["v"]
+        for position in range(0, len(values), 2):
+            field = self.fields.get(values[position])
+            # Joined after the field was defined - wait for the next keyframe
+            if field is None:
+                continue
+            component_name, category, data_item, _, name = field
+            entries = payload.setdefault(component_name, {}).setdefault(category, {}).setdefault(data_item, [])
+            entries.append([name, values[position + 1]])
+        for field_id in message.get("r", []):
+            field = self.fields.get(field_id)
+            if field is not None:
+                component_name, category, data_item, _, _ = field
+                payload.setdefault(component_name, {}).setdefault(category, {})[data_item] = None
+        return payload
+
+
+def get_encoder(upload_config):
+
+    encoding = upload_config.get("encoding", "json")
+    if encoding == "json":
+        return JsonEncoder()
+    if encoding == "msgpack":
+        return MessagePackEncoder()
+    if encoding == "cbor":
+        return CborEncoder()
+    if encoding == "schema":
+        return SchemaEncoder(packer=upload_config.get("schema_packer", "msgpack"))
+
+    raise ValueError(f"Unknown upload encoding - {encoding}")
+
+
+def get_decoder(upload_config):
+
+    # Same config on the cloud side selects the matching decoder
+    encoding = upload_config.get("encoding", "json")
+    if encoding == "schema":
+        return SchemaDecoder(packer=upload_config.get("schema_packer", "msgpack"))
+    return get_encoder(upload_config)
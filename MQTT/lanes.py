@@ -0,0 +1,153 @@
+import time
+import logging
+import threading
+from collections import deque
+from awscrt import mqtt
+from Metrics.registry import registry
+
+LANE_QUEUED = registry.gauge("mtc_lane_queued_messages", "Messages waiting in a publish lane", labels=("lane",))
+LANE_DROPPED = registry.counter("mtc_lane_dropped_total", "Messages dropped because a publish lane was full",
+                                labels=("lane",))
+LANE_WAIT_SECONDS = registry.histogram("mtc_lane_wait_seconds", "Time a message waited in a publish lane",
+                                       labels=("lane",))
+LANE_PUBACK_SECONDS = registry.histogram("mtc_lane_puback_seconds",
+                                         "Time from the hand-off of a lane message to its completion",
+                                         labels=("lane",))
+LANE_FAILURES = registry.counter("mtc_lane_failures_total", "Lane messages that were not acknowledged",
+                                 labels=("lane",))
+
+
+def to_qos(value):
+    return mqtt.QoS.AT_MOST_ONCE if value == 0 else mqtt.QoS.AT_LEAST_ONCE
+
+
+class PublishLane:
+
+    # Stands in for the MQTT connection of the publishers, like the spool: messages are queued and handed to
+    # `mqtt_connection` in order by the lane's own thread, so a backed up lane never holds up the others.
+    # At most `max_queue` messages wait, beyond that the oldest are dropped. `qos` overrides the QoS of the
+    # publishers, e.g. AT_MOST_ONCE for the bulk samples.
+    def __init__(self, name, mqtt_connection, qos=None, max_queue=1000):
+
+        self.logger = logging.getLogger("PublishLane")
+        self.name = name
+        self.mqtt_connection = mqtt_connection
+        self.qos = qos
+        self.max_queue = max_queue
+        # (topic, payload, qos, monotonic time queued)
+        self.queue = deque()
+        self.condition = threading.Condition()
+        self.running = False
+        self.thread = None
+        self.dropped = LANE_DROPPED.labels(name)
+        self.wait_seconds = LANE_WAIT_SECONDS.labels(name)
+        self.puback_seconds = LANE_PUBACK_SECONDS.labels(name)
+        self.failures = LANE_FAILURES.labels(name)
+        # Queue depth is read when the metrics are scraped
+        LANE_QUEUED.labels(name).set_function(lambda: len(self.queue))
+
+    @classmethod
+    def from_config(cls, name, mqtt_connection, lane_config):
+        qos = lane_config.get("qos")
+        return cls(name, mqtt_connection,
+                   qos=None if qos is None else to_qos(qos),
+                   max_queue=lane_config.get("max_queue", 1000))
+
+    def publish(self, topic, payload, qos):
+
+        # Same signature as the MQTT connection, the lane reports the acknowledgement itself
+        with self.condition:
+            if len(self.queue) >= self.max_queue:
+                self.queue.popleft()
+                self.dropped.inc()
+            self.queue.append((topic, payload, qos, time.monotonic()))
+            self.condition.notify()
+        return None, None
+
+    def start(self):
+
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name=f"lane-{self.name}", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+
+    def run(self):
+
+        while True:
+            with self.condition:
+                while self.running and not self.queue:
+                    self.condition.wait()
+                if not self.running:
+                    return
+                topic, payload, qos, queued = self.queue.popleft()
+
+            sent = time.monotonic()
+            self.wait_seconds.observe(sent - queued)
+            try:
+                future, _ = self.mqtt_connection.publish(topic=topic, payload=payload,
+                                                         qos=self.qos if self.qos is not None else qos)
+            except Exception as e:
+                self.logger.warning(f"Publish on the {self.name} lane failed with - {e}")
+                self.failures.inc()
+                continue
+            if future is not None:
+                future.add_done_callback(lambda f, sent=sent: self.on_publish_complete(f, sent))
+
+    def on_publish_complete(self, future, sent):
+
+        # Runs on the connection's event-loop thread
+        if future.exception() is None:
+            self.puback_seconds.observe(time.monotonic() - sent)
+        else:
+            self.failures.inc()
+
+
+class EventPublisher:
+
+    # Listener of MachineStateMonitor - the Events and Conditions of the Controller component (EmergencyStop,
+    # Message, alarms, ...) go out on status/<client_id>/events through the urgent lane as soon as they are observed,
+    # instead of with the next status or batch. Only while `enabled`, i.e. while the upload is on.
+    def __init__(self, lane, topic, machine_name, encoder, components=("Controller",),
+                 categories=("Events", "Condition"), qos=mqtt.QoS.AT_LEAST_ONCE):
+
+        self.lane = lane
+        self.topic = topic
+        self.machine_name = machine_name
+        self.encoder = encoder
+        self.components = set(components)
+        self.categories = set(categories)
+        self.qos = qos
+        self.enabled = False
+        # dataItemId -> last sequence sent, a /current snapshot repeats observations that did not change
+        self.sequences = {}
+
+    @classmethod
+    def from_config(cls, lane, topic, machine_name, encoder, urgent_config):
+        return cls(lane, topic, machine_name, encoder,
+                   components=urgent_config.get("components", ["Controller"]),
+                   categories=urgent_config.get("categories", ["Events", "Condition"]),
+                   qos=to_qos(urgent_config.get("qos", 1)))
+
+    def on_observations(self, observations):
+
+        if not self.enabled:
+            return
+        events = []
+        sequences = self.sequences
+        for observation in observations:
+            if observation.component not in self.components or observation.category not in self.categories:
+                continue
+            if sequences.get(observation.data_item_id) == observation.sequence:
+                continue
+            sequences[observation.data_item_id] = observation.sequence
+            events.append({"component": observation.component_name, "category": observation.category,
+                           "dataItem": observation.data_item, "subType": observation.sub_type,
+                           "name": observation.name, "value": observation.value, "t": observation.timestamp})
+        if events:
+            # Events are rare and small, packed right away - the lane thread only publishes
+            message = self.encoder.pack({"machine": self.machine_name, "events": events})
+            self.lane.publish(self.topic, message, self.qos)
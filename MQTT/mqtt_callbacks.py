@@ -1,6 +1,11 @@
 import sys
 import json
+import threading
 from awsiot import mqtt
+from Metrics.registry import registry
+
+MQTT_INTERRUPTIONS = registry.counter("mtc_mqtt_interruptions_total", "MQTT connection interruptions")
+MQTT_CONNECTED = registry.gauge("mtc_mqtt_connected", "1 while the MQTT connection is up")
 
 
 class MqttCallbacks:
@@ -8,12 +13,24 @@ class MqttCallbacks:
         self.params = params
         self.logger = logger
         self.threading_event = threading_event
+        # Set while the MQTT connection is up
+        self.connected = threading.Event()
+        MQTT_CONNECTED.set_function(lambda: int(self.connected.is_set()))
+        # Called with every decoded message, e.g. MqttRpc.on_message
+        self.message_listeners = []
+
+    def add_message_listener(self, listener):
+        self.message_listeners.append(listener)
 
     def on_connection_interrupted(self, connection, error, **kwargs):
         self.logger.warn("Connection interrupted. Error: {}".format(error))
+        self.connected.clear()
+        MQTT_INTERRUPTIONS.inc()
 
     def on_connection_resumed(self, connection, return_code, session_present, **kwargs):
         self.logger.info("Connection resumed. return_code: {} session_present: {}".format(return_code, session_present))
+        if return_code == mqtt.ConnectReturnCode.ACCEPTED:
+            self.connected.set()
 
         if return_code == mqtt.ConnectReturnCode.ACCEPTED and not session_present:
             self.logger.info("Session did not persist. Resubscribing to existing topics...")
@@ -40,11 +57,14 @@ class MqttCallbacks:
         # Put the payload in queue
         self.params = payload
         self.threading_event.set()
+        for listener in self.message_listeners:
+            listener(payload)
 
     def on_connection_success(self, connection, callback_data):
         assert isinstance(callback_data, mqtt.OnConnectionSuccessData)
         self.logger.info("Connection Successful with return code: {} session present: {}".format(
             callback_data.return_code, callback_data.session_present))
+        self.connected.set()
 
     # Callback when a connection attempt fails
     def on_connection_failure(self, connection, callback_data):
@@ -54,3 +74,4 @@ class MqttCallbacks:
     # Callback when a connection has been disconnected or shutdown successfully
     def on_connection_closed(self, connection, callback_data):
         self.logger.info("Connection closed")
+        self.connected.clear()
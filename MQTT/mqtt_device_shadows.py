@@ -2,9 +2,9 @@ import os
 import threading
 import logging
 import yaml
-from awscrt import mqtt, http
-from awsiot import iotshadow, mqtt_connection_builder
-from uuid import uuid4
+from awscrt import http
+from awsiot import mqtt_connection_builder
+from MQTT.shadow_writer import ExpiringTokens, ShadowWriter
 
 
 class LockedDeviceState:
@@ -13,14 +13,20 @@ class LockedDeviceState:
         self.states = {
             "adapters_connected": None,
             "upload_enable": None,
+            # Sampling overrides, None uses config.yml
+            "session_timeout": None,
+            "active_interval": None,
+            "idle_interval": None,
         }
         self.disconnect_called = False
-        self.request_tokens = set()
+        # Tokens of the get and update requests waiting for a response, dropped when not answered in time
+        self.request_tokens = ExpiringTokens()
 
 
 class DeviceShadows:
 
-    def __init__(self, locked_device_state, client_id, shadow_thing_name, shadow_client):
+    def __init__(self, locked_device_state, client_id, shadow_thing_name, shadow_client, update_window=0.2,
+                 token_ttl=10.0):
 
         # Setup logging
         root = logging.getLogger()
@@ -36,6 +42,20 @@ class DeviceShadows:
         self.SHADOW_DEFAULT = {}
         for key in self.locked_device_state.states.keys():
             self.SHADOW_DEFAULT[key] = self.locked_device_state.states[key]
+        # Called without arguments whenever a local shadow value changes, keep them short -
+        # they run on the connection's event-loop thread, sometimes with the state lock held
+        self.listeners = []
+        # Merges the local changes into rate limited updates of the changed keys only
+        self.locked_device_state.request_tokens.ttl = token_ttl
+        self.writer = ShadowWriter(shadow_client, client_id, shadow_thing_name,
+                                   self.locked_device_state.request_tokens, window=update_window)
+
+    def add_listener(self, listener):
+        self.listeners.append(listener)
+
+    def notify_listeners(self):
+        for listener in self.listeners:
+            listener()
 
     def on_shadow_delta_updated(self, delta):
 
@@ -97,13 +117,9 @@ class DeviceShadows:
         except Exception as e:
             self.logger.error(f"Exception occurred at 'on_get_shadow_rejected' with - {e}")
 
-    def on_publish_update_shadow(self, future):
-
-        try:
-            future.result()
-            self.logger.info("Shadow Update request published.")
-        except Exception as e:
-            self.logger.error(f"Failed to publish update request with - {e}")
+    def flush(self, timeout=2.0):
+        # Send the pending changes right away and wait for the response
+        return self.writer.flush(timeout)
 
     def on_update_shadow_accepted(self, response):
 
@@ -113,10 +129,14 @@ class DeviceShadows:
                 try:
                     self.locked_device_state.request_tokens.remove(response.client_token)
                 except KeyError:
+                    if self.locked_device_state.request_tokens.expired(response.client_token):
+                        self.logger.info("Ignoring late update_shadow_accepted message.")
+                        return
                     self.logger.info("Shadow Update Request Initiated from Cloud")
                     if response.state.reported is not None:
                         self.set_local_value_due_cloud_change(response.state.reported)
                         return
+            self.writer.acknowledged(response.client_token)
 
             if response.state.reported is None:
                 self.logger.info("Clearing all shadow states.")
@@ -135,6 +155,7 @@ class DeviceShadows:
                 except KeyError:
                     self.logger.info("Ignoring update_shadow_rejected message due to unexpected token.")
                     return
+            self.writer.acknowledged(error.client_token)
 
             self.logger.error("Update request was rejected. code:{} message:'{}'".format(
                 error.code, error.message))
@@ -146,10 +167,12 @@ class DeviceShadows:
         with self.locked_device_state.lock:
             for key in reported_value.keys():
                 self.locked_device_state.states[key] = reported_value[key]
+        self.notify_listeners()
 
     def set_local_value_due_cloud_change(self, reported_value):
         for key in reported_value.keys():
             self.locked_device_state.states[key] = reported_value[key]
+        self.notify_listeners()
 
     def change_shadow_value(self, new_value):
 
@@ -157,7 +180,7 @@ class DeviceShadows:
         changed_values = []
         with self.locked_device_state.lock:
             for key in new_value.keys():
-                if self.locked_device_state.states[key] == new_value[key]:
+                if self.locked_device_state.states.get(key) == new_value[key]:
                     continue
                 else:
                     changed_values.append(key)
@@ -170,33 +193,10 @@ class DeviceShadows:
                 return
 
         self.logger.info("Shadow values that were changed - {}".format(changed_values))
+        self.notify_listeners()
 
-        # Use unique messages on accepted or rejected topics
-        token = str(uuid4())
-        if new_value["upload_enable"] == "clear_shadow":
-            tmp_state = iotshadow.ShadowState(
-                reported=None,
-                desired=None,
-                reported_is_nullable=True,
-                desired_is_nullable=True)
-            request = iotshadow.UpdateNamedShadowRequest(
-                thing_name=self.client_id,
-                shadow_name=self.shadow_thing_name,
-                state=tmp_state,
-                client_token=token
-            )
-
+        # Only the changed keys, merged with other changes made within the update window
+        if new_value.get("upload_enable") == "clear_shadow":
+            self.writer.clear_shadow()
         else:
-            request = iotshadow.UpdateNamedShadowRequest(
-                thing_name=self.client_id,
-                shadow_name=self.shadow_thing_name,
-                state=iotshadow.ShadowState(
-                    reported=self.locked_device_state.states,
-                    desired=self.locked_device_state.states
-                ),
-                client_token=token,
-            )
-
-        future = self.shadow_client.publish_update_named_shadow(request, mqtt.QoS.AT_LEAST_ONCE)
-        self.locked_device_state.request_tokens.add(token)
-        future.add_done_callback(self.on_publish_update_shadow)
+            self.writer.write({key: new_value[key] for key in changed_values})
@@ -0,0 +1,148 @@
+import time
+import logging
+from awscrt import mqtt
+from Metrics.registry import registry
+from MQTT.encoders import JsonEncoder, get_encoder
+
+ENCODE_SECONDS = registry.histogram("mtc_encode_seconds", "Payload serialization and encoding time",
+                                    labels=("topic",))
+MESSAGES_PUBLISHED = registry.counter("mtc_messages_published_total", "Messages handed to the MQTT connection",
+                                      labels=("topic",))
+BYTES_PUBLISHED = registry.counter("mtc_published_bytes_total", "Payload bytes handed to the MQTT connection",
+                                   labels=("topic",))
+PUBACK_SECONDS = registry.histogram("mtc_puback_seconds", "Time from publish to the broker acknowledgement",
+                                    labels=("topic",))
+PUBLISH_FAILURES = registry.counter("mtc_publish_failures_total", "Publishes that were not acknowledged",
+                                    labels=("topic",))
+
+
+class PublishMetrics:
+
+    # Counters of one topic, with the PUBACK latency taken from the publish future
+    def __init__(self, topic):
+
+        self.encode_seconds = ENCODE_SECONDS.labels(topic)
+        self.messages = MESSAGES_PUBLISHED.labels(topic)
+        self.bytes = BYTES_PUBLISHED.labels(topic)
+        self.puback_seconds = PUBACK_SECONDS.labels(topic)
+        self.failures = PUBLISH_FAILURES.labels(topic)
+
+    def published(self, message, future, start):
+
+        self.messages.inc()
+        self.bytes.inc(len(message))
+        # The spool returns no future, it reports the PUBACK itself
+        if future is not None:
+            future.add_done_callback(lambda f: self.acknowledged(f, start))
+
+    def acknowledged(self, future, start):
+
+        # Runs on the connection's event-loop thread
+        if future.exception() is None:
+            self.puback_seconds.observe(time.perf_counter() - start)
+        else:
+            self.failures.inc()
+
+
+class StatusPublisher:
+
+    # Publishes machine_params to status/<client_id>
+    #   full  - the whole params on every call (previous behaviour)
+    #   delta - only the leaves that changed since the last publish, with a full keyframe every
+    #           `keyframe_interval` seconds so late subscribers can resync. Subscribers merge deltas into their state,
+    #           a None leaf is a data item that is gone.
+    def __init__(self, mqtt_connection, topic, mode="full", keyframe_interval=30.0, qos=mqtt.QoS.AT_LEAST_ONCE,
+                 encoder=None):
+
+        self.logger = logging.getLogger("StatusPublisher")
+        self.mqtt_connection = mqtt_connection
+        self.topic = topic
+        self.mode = mode
+        self.keyframe_interval = keyframe_interval
+        self.qos = qos
+        self.encoder = encoder if encoder is not None else JsonEncoder()
+        self.last_keyframe = None
+        # Counters
+        self.messages_sent = 0
+        self.bytes_sent = 0
+        self.metrics = PublishMetrics(topic)
+
+    @classmethod
+    def from_config(cls, mqtt_connection, topic, upload_config):
+        return cls(mqtt_connection, topic,
+                   mode=upload_config.get("mode", "full"),
+                   keyframe_interval=upload_config.get("keyframe_interval", 30.0),
+                   encoder=get_encoder(upload_config))
+
+    def request_keyframe(self):
+        # The next publish sends the whole params
+        self.last_keyframe = None
+
+    def publish(self, machine_status):
+
+        now = time.monotonic()
+        keyframe = self.last_keyframe is None or now - self.last_keyframe >= self.keyframe_interval
+        if keyframe:
+            self.last_keyframe = now
+
+        start = time.perf_counter()
+        changed, payload = machine_status.take_changes(full=keyframe or self.mode == "full",
+                                                       ids=self.encoder.data_item_ids)
+        # Nothing changed - nothing to send
+        if not keyframe and self.mode != "full" and not changed:
+            return None
+
+        message = self.encoder.encode(payload, keyframe=keyframe)
+        encoded = time.perf_counter()
+        self.metrics.encode_seconds.observe(encoded - start)
+        future, _ = self.mqtt_connection.publish(
+            topic=self.topic,
+            payload=message,
+            qos=self.qos
+        )
+        self.metrics.published(message, future, encoded)
+        self.messages_sent += 1
+        self.bytes_sent += len(message)
+        return future
+
+
+class FeaturePublisher:
+
+    # Publishes the cycle and rolling feature records of a FeatureExtractor (Machine/features.py) to
+    # status/<client_id>/features - all records waiting since the last call in one message, nothing when there are none
+    def __init__(self, mqtt_connection, topic, extractor, encoder=None, qos=mqtt.QoS.AT_LEAST_ONCE):
+
+        self.mqtt_connection = mqtt_connection
+        self.topic = topic
+        self.extractor = extractor
+        self.encoder = encoder if encoder is not None else JsonEncoder()
+        self.qos = qos
+        # Counters
+        self.messages_sent = 0
+        self.bytes_sent = 0
+        self.metrics = PublishMetrics(topic)
+
+    @classmethod
+    def from_config(cls, mqtt_connection, topic, extractor, encoder, features_config):
+        return cls(mqtt_connection, topic, extractor, encoder,
+                   qos=mqtt.QoS.AT_MOST_ONCE if features_config.get("qos", 1) == 0 else mqtt.QoS.AT_LEAST_ONCE)
+
+    def publish(self):
+
+        records = self.extractor.take_records()
+        if not records:
+            return None
+
+        start = time.perf_counter()
+        message = self.encoder.pack({"machine": self.extractor.machine_status.machine_name, "records": records})
+        encoded = time.perf_counter()
+        self.metrics.encode_seconds.observe(encoded - start)
+        future, _ = self.mqtt_connection.publish(
+            topic=self.topic,
+            payload=message,
+            qos=self.qos
+        )
+        self.metrics.published(message, future, encoded)
+        self.messages_sent += 1
+        self.bytes_sent += len(message)
+        return future
@@ -0,0 +1,72 @@
+import json
+import logging
+import threading
+from uuid import uuid4
+from collections import OrderedDict
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from awscrt import mqtt
+
+
+class MqttRpc:
+
+    # Request/response over MQTT. Every request carries a `client_token`, the response is matched back to the
+    # waiting request by that token - several requests can be in flight and waiting takes no CPU.
+    # Responses without a token go to the oldest waiting request (a responder that does not echo the token).
+    def __init__(self, mqtt_connection, timeout=60.0, qos=mqtt.QoS.AT_LEAST_ONCE):
+
+        self.logger = logging.getLogger("MqttRpc")
+        self.mqtt_connection = mqtt_connection
+        self.timeout = timeout
+        self.qos = qos
+        self.lock = threading.Lock()
+        # client_token -> Future, oldest first
+        self.pending = OrderedDict()
+
+    def request(self, topic, payload):
+
+        # Returns a future resolved with the response payload
+        token = str(uuid4())
+        future = Future()
+        with self.lock:
+            self.pending[token] = future
+
+        payload = dict(payload, client_token=token)
+        try:
+            self.mqtt_connection.publish(topic=topic, payload=json.dumps(payload), qos=self.qos)
+        except Exception:
+            with self.lock:
+                self.pending.pop(token, None)
+            raise
+        future.client_token = token
+        return future
+
+    def call(self, topic, payload, timeout=None):
+
+        # Blocks until the response arrives, raises TimeoutError after `timeout` seconds
+        future = self.request(topic, payload)
+        try:
+            return future.result(self.timeout if timeout is None else timeout)
+        except FutureTimeoutError:
+            with self.lock:
+                self.pending.pop(future.client_token, None)
+            raise TimeoutError(f"No response on {topic} within {self.timeout if timeout is None else timeout} s")
+
+    def on_message(self, payload):
+
+        # Message listener of MqttCallbacks - runs on the connection's event-loop thread
+        if not isinstance(payload, dict):
+            return
+        token = payload.get("client_token")
+        with self.lock:
+            if token is not None:
+                future = self.pending.pop(token, None)
+            elif self.pending:
+                _, future = self.pending.popitem(last=False)
+            else:
+                future = None
+
+        if future is None:
+            self.logger.info("Ignoring response without a waiting request")
+            return
+        future.set_result(payload)
@@ -0,0 +1,239 @@
+import time
+import logging
+import threading
+from collections import OrderedDict
+from uuid import uuid4
+from awscrt import mqtt
+from awsiot import iotshadow
+from Metrics.registry import registry
+
+SHADOW_UPDATES = registry.counter("mtc_shadow_updates_total", "Shadow update requests sent")
+SHADOW_COALESCED = registry.counter("mtc_shadow_coalesced_total", "Shadow changes merged into a later update")
+SHADOW_TOKENS_EXPIRED = registry.counter("mtc_shadow_tokens_expired_total",
+                                         "Shadow requests that were not answered in time")
+
+
+class ExpiringTokens:
+
+    # Client tokens of the shadow requests waiting for their accepted/rejected response. A token that is not
+    # answered within `ttl` seconds is dropped, a late answer is then recognised with `expired`.
+    def __init__(self, ttl=10.0, remember=256):
+
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        # token -> monotonic time it was added, oldest first
+        self.tokens = OrderedDict()
+        # Recently expired tokens
+        self.expired_tokens = OrderedDict()
+        self.remember = remember
+
+    def purge(self, now):
+
+        while self.tokens:
+            token, added = next(iter(self.tokens.items()))
+            if now - added < self.ttl:
+                break
+            del self.tokens[token]
+            self.expired_tokens[token] = now
+            SHADOW_TOKENS_EXPIRED.inc()
+        while len(self.expired_tokens) > self.remember:
+            self.expired_tokens.popitem(last=False)
+
+    def add(self, token):
+        with self.lock:
+            self.purge(time.monotonic())
+            self.tokens[token] = time.monotonic()
+
+    def remove(self, token):
+        # KeyError when the token is unknown or expired, like set.remove
+        with self.lock:
+            self.purge(time.monotonic())
+            del self.tokens[token]
+
+    def expired(self, token):
+        with self.lock:
+            return token in self.expired_tokens
+
+    def __contains__(self, token):
+        with self.lock:
+            self.purge(time.monotonic())
+            return token in self.tokens
+
+    def __len__(self):
+        with self.lock:
+            self.purge(time.monotonic())
+            return len(self.tokens)
+
+
+class ShadowWriter:
+
+    # Sends the local shadow changes to the named shadow. Changes made within `window` seconds are merged into one
+    # update with only the changed keys, the latest value of a key wins. At most one update is in flight - changes
+    # made meanwhile wait for its response, or for its token to expire after `request_tokens.ttl` seconds.
+    def __init__(self, shadow_client, thing_name, shadow_name, request_tokens, window=0.2, qos=mqtt.QoS.AT_LEAST_ONCE):
+
+        self.logger = logging.getLogger("ShadowWriter")
+        self.shadow_client = shadow_client
+        self.thing_name = thing_name
+        self.shadow_name = shadow_name
+        self.request_tokens = request_tokens
+        self.window = window
+        self.qos = qos
+        self.condition = threading.Condition()
+        # key -> value waiting to be sent
+        self.pending = {}
+        # Clear the whole shadow before the pending changes
+        self.clear_pending = False
+        # Monotonic time the pending changes are sent
+        self.due = None
+        # Token, changes and send time of the update in flight, `in_flight_clear` when it clears the shadow
+        self.in_flight = None
+        self.in_flight_changes = None
+        self.in_flight_clear = False
+        self.sent_at = None
+        self.running = False
+        self.thread = None
+
+    def start(self):
+
+        with self.condition:
+            if self.thread is not None:
+                return
+            self.running = True
+            self.thread = threading.Thread(target=self.run, daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+
+    def write(self, changes):
+
+        self.start()
+        with self.condition:
+            if self.pending or self.in_flight is not None:
+                SHADOW_COALESCED.inc(len(changes))
+            self.pending.update(changes)
+            if self.due is None:
+                self.due = time.monotonic() + self.window
+            self.condition.notify_all()
+
+    def clear_shadow(self):
+
+        # Reported and desired set to null - earlier pending changes are dropped
+        self.start()
+        with self.condition:
+            self.pending.clear()
+            self.clear_pending = True
+            if self.due is None:
+                self.due = time.monotonic() + self.window
+            self.condition.notify_all()
+
+    def acknowledged(self, token):
+
+        # Accepted or rejected response of an update
+        with self.condition:
+            if token == self.in_flight:
+                self.in_flight = None
+                self.in_flight_changes = None
+                self.in_flight_clear = False
+                self.condition.notify_all()
+
+    def flush(self, timeout=2.0):
+
+        # Send the pending changes now and wait until they are answered, e.g. before disconnecting
+        deadline = time.monotonic() + timeout
+        with self.condition:
+            if self.due is not None:
+                self.due = time.monotonic()
+                self.condition.notify_all()
+            while self.pending or self.clear_pending or self.in_flight is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not self.running:
+                    return False
+                self.condition.wait(remaining)
+        return True
+
+    def requeue(self):
+
+        # The update in flight was lost - a clear is sent again before the pending changes, changes go out again
+        # unless a newer value is pending
+        if self.in_flight_clear:
+            self.clear_pending = True
+        for key, value in self.in_flight_changes.items():
+            self.pending.setdefault(key, value)
+        self.in_flight = None
+        self.in_flight_changes = None
+        self.in_flight_clear = False
+        if self.due is None:
+            self.due = time.monotonic() + self.window
+
+    def run(self):
+
+        while True:
+            with self.condition:
+                while True:
+                    if not self.running:
+                        return
+                    now = time.monotonic()
+                    timeout = None
+                    if self.in_flight is not None:
+                        expires = self.sent_at + self.request_tokens.ttl
+                        if now < expires:
+                            timeout = expires - now
+                        else:
+                            self.logger.warning("Shadow update was not answered, sending the changes again")
+                            self.requeue()
+                            continue
+                    elif self.pending or self.clear_pending:
+                        if now >= self.due:
+                            break
+                        timeout = self.due - now
+                    self.condition.wait(timeout)
+
+                token = str(uuid4())
+                clear = self.clear_pending
+                if clear:
+                    state = iotshadow.ShadowState(reported=None, desired=None, reported_is_nullable=True,
+                                                  desired_is_nullable=True)
+                    changes = {}
+                    self.clear_pending = False
+                else:
+                    changes, self.pending = self.pending, {}
+                    state = iotshadow.ShadowState(reported=changes, desired=changes)
+                # Changes written after a clear go out once it is answered
+                if not self.pending:
+                    self.due = None
+                self.in_flight = token
+                self.in_flight_changes = changes
+                self.in_flight_clear = clear
+                self.sent_at = now
+                self.request_tokens.add(token)
+
+            request = iotshadow.UpdateNamedShadowRequest(thing_name=self.thing_name, shadow_name=self.shadow_name,
+                                                         state=state, client_token=token)
+            try:
+                future = self.shadow_client.publish_update_named_shadow(request, self.qos)
+            except Exception as e:
+                self.logger.error(f"Failed to publish update request with - {e}")
+                self.published_failed(token)
+                continue
+            SHADOW_UPDATES.inc()
+            future.add_done_callback(lambda f, token=token: self.on_published(f, token))
+
+    def on_published(self, future, token):
+
+        try:
+            future.result()
+            self.logger.info("Shadow Update request published.")
+        except Exception as e:
+            self.logger.error(f"Failed to publish update request with - {e}")
+            self.published_failed(token)
+
+    def published_failed(self, token):
+
+        with self.condition:
+            if token == self.in_flight:
+                self.requeue()
+                self.condition.notify_all()
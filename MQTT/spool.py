@@ -0,0 +1,226 @@
+import os
+import time
+import sqlite3
+import logging
+import threading
+from awscrt import mqtt
+from Metrics.registry import registry
+
+SPOOL_MESSAGES = registry.gauge("mtc_spool_messages", "Messages waiting in the spool")
+SPOOL_BYTES = registry.gauge("mtc_spool_bytes", "Payload bytes waiting in the spool")
+SPOOL_INFLIGHT = registry.gauge("mtc_spool_inflight", "Spooled messages sent and not acknowledged yet")
+SPOOL_EVICTED = registry.counter("mtc_spool_evicted_total", "Messages dropped from the full spool")
+SPOOL_PUBACK_SECONDS = registry.histogram("mtc_spool_puback_seconds",
+                                          "Time from forwarding a spooled message to the broker acknowledgement")
+SPOOL_FAILURES = registry.counter("mtc_spool_failures_total", "Spooled messages that were not acknowledged")
+
+
+class MessageSpool:
+
+    # Append-only SQLite log of the messages waiting for the broker.
+    # The total payload size is capped at `max_bytes`, the oldest messages are evicted first.
+    def __init__(self, path, max_bytes=256 * 1024 * 1024):
+
+        self.logger = logging.getLogger("MessageSpool")
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        # WAL with relaxed syncing keeps SD card writes small, a crash can only lose the last few messages
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS spool ("
+                        "id INTEGER PRIMARY KEY AUTOINCREMENT, topic TEXT NOT NULL, payload BLOB NOT NULL, "
+                        "qos INTEGER NOT NULL, size INTEGER NOT NULL, created REAL NOT NULL)")
+
+        self.count, self.bytes = self.db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM spool").fetchone()
+        self.evicted = 0
+
+    def append(self, topic, payload, qos):
+
+        if isinstance(payload, str):
+            payload = payload.encode("utf-8")
+        size = len(payload)
+        with self.lock:
+            cursor = self.db.execute("INSERT INTO spool (topic, payload, qos, size, created) VALUES (?, ?, ?, ?, ?)",
+                                     (topic, payload, int(qos), size, time.time()))
+            self.count += 1
+            self.bytes += size
+            if self.bytes > self.max_bytes:
+                self.evict()
+            return cursor.lastrowid
+
+    def evict(self):
+
+        # Drop the oldest messages until the spool is 10% below the cap, so that the next appends do not evict again.
+        # Only the rows that are dropped are read, the backlog is not loaded into memory
+        excess = self.bytes - (self.max_bytes - self.max_bytes // 10)
+        last_id = None
+        dropped = 0
+        cursor = self.db.execute("SELECT id, size FROM spool ORDER BY id")
+        try:
+            for message_id, size in cursor:
+                if excess <= 0:
+                    break
+                excess -= size
+                self.bytes -= size
+                last_id = message_id
+                dropped += 1
+        finally:
+            cursor.close()
+        if last_id is not None:
+            self.db.execute("DELETE FROM spool WHERE id <= ?", (last_id,))
+            self.count -= dropped
+            self.evicted += dropped
+            SPOOL_EVICTED.inc(dropped)
+            self.logger.warning(f"Spool over {self.max_bytes} bytes, evicted {dropped} oldest messages")
+
+    def peek(self, after_id, limit):
+
+        # Oldest messages first
+        with self.lock:
+            return self.db.execute("SELECT id, topic, payload, qos FROM spool WHERE id > ? ORDER BY id LIMIT ?",
+                                   (after_id, limit)).fetchall()
+
+    def remove(self, message_id):
+
+        with self.lock:
+            row = self.db.execute("SELECT size FROM spool WHERE id = ?", (message_id,)).fetchone()
+            if row is None:
+                # Already evicted
+                return
+            self.db.execute("DELETE FROM spool WHERE id = ?", (message_id,))
+            self.count -= 1
+            self.bytes -= row[0]
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+
+class SpoolForwarder:
+
+    # Stands in for the MQTT connection of the publishers: every message is written to the spool first and
+    # forwarded in order while the connection is up, at most `drain_rate` messages per second.
+    # A message leaves the spool once the broker acknowledged it.
+    def __init__(self, mqtt_connection, spool, connected, drain_rate=50.0, max_inflight=20, ack_timeout=60.0):
+
+        self.logger = logging.getLogger("SpoolForwarder")
+        self.mqtt_connection = mqtt_connection
+        self.spool = spool
+        self.connected = connected
+        self.drain_interval = 1.0 / drain_rate
+        self.max_inflight = max_inflight
+        self.ack_timeout = ack_timeout
+        # message id -> publish time
+        self.inflight = {}
+        self.inflight_lock = threading.Lock()
+        self.pending = threading.Event()
+        self.running = False
+        self.thread = None
+        # Queue depth is read when the metrics are scraped
+        SPOOL_MESSAGES.set_function(lambda: self.spool.count)
+        SPOOL_BYTES.set_function(lambda: self.spool.bytes)
+        SPOOL_INFLIGHT.set_function(lambda: len(self.inflight))
+
+    @classmethod
+    def from_config(cls, mqtt_connection, connected, spool_config):
+        spool = MessageSpool(spool_config["path"], max_bytes=spool_config.get("max_bytes", 256 * 1024 * 1024))
+        return cls(mqtt_connection, spool, connected,
+                   drain_rate=spool_config.get("drain_rate", 50.0),
+                   max_inflight=spool_config.get("max_inflight", 20))
+
+    def publish(self, topic, payload, qos):
+
+        # Same signature as the MQTT connection
+        message_id = self.spool.append(topic, payload, qos)
+        self.pending.set()
+        return None, message_id
+
+    def start(self):
+
+        if self.spool.count:
+            self.logger.info(f"Forwarding {self.spool.count} messages ({self.spool.bytes} bytes) left in the spool")
+            self.pending.set()
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+
+        self.running = False
+        self.pending.set()
+
+    def run(self):
+
+        last_id = 0
+        while self.running:
+            self.pending.wait()
+            self.pending.clear()
+
+            while self.running:
+                # Hold the messages while the broker is unreachable, stop() still ends the loop
+                if not self.connected.wait(self.drain_interval):
+                    continue
+                self.expire_inflight()
+                with self.inflight_lock:
+                    capacity = self.max_inflight - len(self.inflight)
+                if capacity <= 0:
+                    time.sleep(self.drain_interval)
+                    continue
+
+                rows = self.spool.peek(last_id, capacity)
+                if not rows:
+                    # Start over from the oldest message that is still waiting for its acknowledgement
+                    with self.inflight_lock:
+                        expired = not self.inflight and self.spool.count > 0
+                    if expired:
+                        last_id = 0
+                        continue
+                    break
+
+                for message_id, topic, payload, qos in rows:
+                    if not self.connected.is_set() or not self.running:
+                        break
+                    self.send(message_id, topic, payload, qos)
+                    last_id = message_id
+                    time.sleep(self.drain_interval)
+
+    def send(self, message_id, topic, payload, qos):
+
+        with self.inflight_lock:
+            self.inflight[message_id] = time.monotonic()
+        try:
+            future, _ = self.mqtt_connection.publish(topic=topic, payload=payload, qos=mqtt.QoS(qos))
+        except Exception as e:
+            self.logger.warning(f"Publish from spool failed with - {e}")
+            with self.inflight_lock:
+                self.inflight.pop(message_id, None)
+            return
+        future.add_done_callback(lambda f, message_id=message_id: self.on_publish_complete(message_id, f))
+
+    def on_publish_complete(self, message_id, future):
+
+        # Runs on the connection's event-loop thread
+        with self.inflight_lock:
+            sent = self.inflight.pop(message_id, None)
+        if future.exception() is None:
+            if sent is not None:
+                SPOOL_PUBACK_SECONDS.observe(time.monotonic() - sent)
+            self.spool.remove(message_id)
+        else:
+            SPOOL_FAILURES.inc()
+            self.logger.warning(f"Message {message_id} not acknowledged - {future.exception()}")
+        self.pending.set()
+
+    def expire_inflight(self):
+
+        # Messages never acknowledged are sent again
+        now = time.monotonic()
+        with self.inflight_lock:
+            for message_id, sent in list(self.inflight.items()):
+                if now - sent > self.ack_timeout:
+                    del self.inflight[message_id]
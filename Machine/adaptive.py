@@ -0,0 +1,129 @@
+import time
+import logging
+
+# Execution states of a running program
+ACTIVE_EXECUTION = {"ACTIVE", "INTERRUPTED", "FEED_HOLD", "WAIT"}
+# Samples that move while the machine is cutting
+MOTION_ITEMS = {"PathFeedrate", "Load", "Position", "Angle", "RotaryVelocity", "SpindleSpeed"}
+# Shadow keys that override the sampling settings at runtime, "none" falls back to config.yml
+SHADOW_KEYS = ("session_timeout", "active_interval", "idle_interval")
+
+
+class SamplingSettings:
+
+    # Poll intervals and upload session length, from config.yml and overridden through the device shadow
+    def __init__(self, default_interval=1.0, active_interval=0.1, idle_interval=5.0, idle_after=30.0,
+                 motion_threshold=0.5, adaptive=True, session_timeout=1800.0, extend_while_active=True):
+
+        self.logger = logging.getLogger("SamplingSettings")
+        self.defaults = {"session_timeout": session_timeout, "active_interval": active_interval,
+                         "idle_interval": idle_interval}
+        self.default_interval = default_interval
+        self.active_interval = active_interval
+        self.idle_interval = idle_interval
+        self.idle_after = idle_after
+        self.motion_threshold = motion_threshold
+        self.adaptive = adaptive
+        self.session_timeout = session_timeout
+        self.extend_while_active = extend_while_active
+
+    @classmethod
+    def from_config(cls, sampling_config, default_interval=1.0):
+        return cls(default_interval=default_interval,
+                   active_interval=sampling_config.get("active_interval", 0.1),
+                   idle_interval=sampling_config.get("idle_interval", 5.0),
+                   idle_after=sampling_config.get("idle_after", 30.0),
+                   motion_threshold=sampling_config.get("motion_threshold", 0.5),
+                   adaptive=sampling_config.get("adaptive", True),
+                   session_timeout=sampling_config.get("session_timeout", 1800.0),
+                   extend_while_active=sampling_config.get("extend_while_active", True))
+
+    def apply_shadow(self, states):
+
+        # DeviceShadows listener - `states` is the local shadow state
+        for key in SHADOW_KEYS:
+            value = states.get(key)
+            try:
+                value = self.defaults[key] if value is None else float(value)
+            except (TypeError, ValueError):
+                self.logger.warning(f"Ignoring shadow value {key}={value}")
+                continue
+            if value <= 0:
+                self.logger.warning(f"Ignoring shadow value {key}={value}")
+                continue
+            if getattr(self, key) != value:
+                self.logger.info(f"{key} changed from {getattr(self, key)} to {value}")
+                setattr(self, key, value)
+
+    def session_expired(self, started, rates, now=None):
+
+        # The upload session ends `session_timeout` seconds after it started,
+        # or after the machine was last active with `extend_while_active`
+        now = time.time() if now is None else now
+        last = started
+        if self.extend_while_active:
+            for rate in rates:
+                if rate.last_active is not None:
+                    last = max(last, rate.last_active)
+        return now - last > self.session_timeout
+
+
+class AdaptiveRate:
+
+    # Poll interval of one machine from its observed state - fast while machining, a slow heartbeat while idle
+    # or in emergency stop. Listener of MachineStateMonitor.
+    def __init__(self, settings):
+
+        self.settings = settings
+        self.execution = None
+        self.emergency_stop = None
+        # Wall clock time of the last observation of a running program or moving axis
+        self.last_active = None
+        # dataItemId -> last numeric value of the motion samples
+        self.last_values = {}
+
+    def on_observations(self, observations):
+
+        # Runs with the monitor lock held
+        active = False
+        threshold = self.settings.motion_threshold
+        for observation in observations:
+            data_item = observation.data_item
+            if data_item == "Execution":
+                self.execution = observation.value
+            elif data_item == "EmergencyStop":
+                self.emergency_stop = observation.value
+            elif data_item in MOTION_ITEMS and observation.category == "Samples":
+                try:
+                    value = float(observation.value)
+                except (TypeError, ValueError):
+                    continue
+                previous = self.last_values.get(observation.data_item_id)
+                self.last_values[observation.data_item_id] = value
+                if data_item == "PathFeedrate" and value > threshold:
+                    active = True
+                elif previous is not None and abs(value - previous) > threshold:
+                    active = True
+
+        if active or self.execution in ACTIVE_EXECUTION:
+            self.last_active = time.time()
+
+    @property
+    def active(self):
+        if self.emergency_stop == "TRIGGERED":
+            return False
+        if self.execution in ACTIVE_EXECUTION:
+            return True
+        return self.last_active is not None and time.time() - self.last_active < self.settings.idle_after
+
+    def interval(self):
+
+        settings = self.settings
+        if not settings.adaptive:
+            return settings.default_interval
+        if self.active:
+            return settings.active_interval
+        # Nothing observed yet
+        if self.execution is None and self.last_active is None and self.emergency_stop is None:
+            return settings.default_interval
+        return settings.idle_interval
@@ -0,0 +1,195 @@
+import time
+import asyncio
+import logging
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from Machine.adaptive import SamplingSettings
+from Metrics.registry import registry
+
+QUEUE_DEPTH = registry.gauge("mtc_publish_queue_depth", "Machines waiting for the publish task")
+
+
+class AsyncRuntime:
+
+    # Upload control on one asyncio event loop instead of the sleeping `while True` loop.
+    #  - one acquisition task per machine polls the agent and queues the machine when it has new observations
+    #  - the publish task encodes and publishes the queued machines
+    #  - the shadow task starts and stops the upload, woken right away by the DeviceShadows listener
+    # The blocking agent requests and MQTT publishes run on a thread pool, a slow agent only holds up its own task.
+    # With `always_poll` the machines are polled while the upload is stopped too, e.g. for the historian.
+    def __init__(self, channels, device_shadows, agent_client=None, queue_size=16, settings=None,
+                 report_interval=60.0, always_poll=False, error_delay=1.0):
+
+        self.logger = logging.getLogger("AsyncRuntime")
+        self.channels = channels
+        # Publishing follows the upload_enabled event, the channels only pass it on to their event publishers
+        for channel in channels:
+            channel.publishing = False
+        self.device_shadows = device_shadows
+        self.locked_device_state = device_shadows.locked_device_state
+        self.agent_client = agent_client
+        self.queue_size = queue_size
+        # Session timeout, can change at runtime through the shadow
+        self.settings = settings if settings is not None else SamplingSettings()
+        self.report_interval = report_interval
+        self.always_poll = always_poll
+        # Seconds before a machine is polled again after an unexpected error
+        self.error_delay = error_delay
+        # One thread per machine for the blocking polls, one for the publishes and one for the shadow updates
+        self.executor = ThreadPoolExecutor(max_workers=len(channels) + 2, thread_name_prefix="runtime")
+        # Created on the event loop in run()
+        self.loop = None
+        self.queue = None
+        self.upload_enabled = None
+        self.shadow_changed = None
+        self.stopping = None
+        # Machines waiting in the queue, a machine is queued at most once
+        self.pending = set()
+
+    @classmethod
+    def from_config(cls, channels, device_shadows, agent_client, runtime_config, settings=None, always_poll=False,
+                    report_interval=60.0):
+        return cls(channels, device_shadows, agent_client,
+                   queue_size=runtime_config.get("queue_size", 16),
+                   settings=settings,
+                   report_interval=report_interval,
+                   always_poll=always_poll)
+
+    def on_shadow_changed(self):
+
+        # DeviceShadows listener - runs on the connection's event-loop thread
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.shadow_changed.set)
+
+    def stop(self):
+
+        # Safe to call from any thread or a signal handler
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.stopping.set)
+
+    def run(self):
+        asyncio.run(self.main())
+
+    async def main(self):
+
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=self.queue_size)
+        self.upload_enabled = asyncio.Event()
+        self.shadow_changed = asyncio.Event()
+        self.stopping = asyncio.Event()
+        self.device_shadows.add_listener(self.on_shadow_changed)
+        QUEUE_DEPTH.set_function(self.queue.qsize)
+
+        tasks = [asyncio.create_task(self.acquire(channel), name=f"acquire-{channel.name}")
+                 for channel in self.channels]
+        tasks.append(asyncio.create_task(self.publish(), name="publish"))
+        tasks.append(asyncio.create_task(self.control(), name="shadow"))
+        if self.agent_client is not None:
+            tasks.append(asyncio.create_task(self.report(), name="report"))
+
+        await self.stopping.wait()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        # Blocked polls finish on their own, do not wait for them
+        self.executor.shutdown(wait=False)
+
+    def upload_enable(self):
+        with self.locked_device_state.lock:
+            return self.locked_device_state.states["upload_enable"] == 1
+
+    async def control(self):
+
+        # Follows `upload_enable` of the shadow and ends the upload session after the session timeout
+        rates = [channel.rate for channel in self.channels if channel.rate is not None]
+        started = None
+        while True:
+            self.shadow_changed.clear()
+            if self.upload_enable():
+                if started is None:
+                    started = time.time()
+                    self.logger.info("Upload started")
+                    # Start the upload session with the whole params
+                    for channel in self.channels:
+                        channel.reset()
+                        channel.publishing = True
+                    self.upload_enabled.set()
+                elif self.settings.session_expired(started, rates):
+                    # Shutdown data transfer after the session timeout
+                    await self.loop.run_in_executor(self.executor, self.device_shadows.change_shadow_value,
+                                                    {"upload_enable": 0})
+                    continue
+            elif started is not None:
+                started = None
+                self.logger.info("Upload stopped")
+                self.upload_enabled.clear()
+                for channel in self.channels:
+                    channel.publishing = False
+
+            # The session timeout and the machine activity can change any time, check once a second
+            timeout = None if started is None else 1.0
+            try:
+                await asyncio.wait_for(self.shadow_changed.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def acquire(self, channel):
+
+        next_run = time.monotonic()
+        while True:
+            if not self.upload_enabled.is_set() and not self.always_poll:
+                await self.upload_enabled.wait()
+                next_run = time.monotonic()
+
+            try:
+                updated = await self.loop.run_in_executor(self.executor, channel.poll)
+            except requests.RequestException as e:
+                self.logger.warning(f"MTConnect agent request for {channel.name} failed with {e}")
+                updated = False
+            except Exception as e:
+                # e.g. a malformed document - keep the machine's task alive and try again after a pause
+                self.logger.error(f"Poll of {channel.name} failed with - {e}")
+                await asyncio.sleep(max(channel.interval(), self.error_delay))
+                next_run = time.monotonic()
+                continue
+
+            if not channel.machine_status.machine_availability:
+                if not any(other.machine_status.machine_availability for other in self.channels):
+                    self.logger.error("NO MACHINE AVAILABLE")
+                    self.stopping.set()
+                    return
+            elif self.upload_enabled.is_set() and channel.publish_due(updated) and channel not in self.pending:
+                # Waits for room in the queue when publishing falls behind, the changes keep accumulating
+                # in the monitor until the machine is published
+                self.pending.add(channel)
+                await self.queue.put(channel)
+
+            # Fixed rate, event-driven acquisitions block in poll() instead
+            interval = channel.interval()
+            if interval:
+                now = time.monotonic()
+                next_run = max(next_run + interval, now)
+                await asyncio.sleep(next_run - now)
+
+    async def publish(self):
+
+        while True:
+            channel = await self.queue.get()
+            self.pending.discard(channel)
+            if not self.upload_enabled.is_set():
+                continue
+            try:
+                await self.loop.run_in_executor(self.executor, channel.publish)
+            except Exception as e:
+                self.logger.error(f"Publish of {channel.name} failed with - {e}")
+
+    async def report(self):
+
+        # Time spent on the agent round trip
+        while True:
+            await asyncio.sleep(self.report_interval)
+            if self.upload_enabled.is_set():
+                period = min(channel.poll_interval or 1.0 for channel in self.channels)
+                self.logger.info(self.agent_client.latency.summary(period=period))
+                for line in registry.summary():
+                    self.logger.info(line)
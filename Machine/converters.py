@@ -0,0 +1,114 @@
+import sys
+from datetime import datetime, timezone
+
+# Observations without a value
+UNAVAILABLE = "UNAVAILABLE"
+# Events with an integer value
+INTEGER_EVENTS = {"PART_COUNT", "LINE", "LINE_NUMBER", "BLOCK_COUNT", "TOOL_NUMBER", "POCKET_NUMBER",
+                  "PALLET_ID"}
+# Events with a controlled vocabulary
+ENUM_EVENTS = {"AVAILABILITY", "EXECUTION", "CONTROLLER_MODE", "EMERGENCY_STOP", "DOOR_STATE", "FUNCTIONAL_MODE",
+               "ROTARY_MODE", "AXIS_STATE", "AXIS_COUPLING", "PATH_MODE", "ACTUATOR_STATE", "DIRECTION",
+               "CHUCK_STATE", "POWER_STATE", "END_OF_BAR", "PROGRAM_EDIT", "PART_DETECT", "ACTIVE_AXES"}
+# Events with a timestamp value
+TIMESTAMP_EVENTS = {"PROCESS_TIME", "DATE_CODE"}
+# Samples with three coordinates
+VECTOR_SAMPLES = {"PATH_POSITION", "ORIENTATION"}
+
+
+def parse_timestamp(timestamp):
+    # MTConnect timestamps are UTC - 2024-01-01T12:00:00.123456Z
+    return datetime.fromisoformat(timestamp.replace("Z", "+00:00")).timestamp()
+
+
+def format_timestamp(seconds):
+    # Epoch seconds back to an MTConnect timestamp
+    return datetime.fromtimestamp(seconds, timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+
+# Converters from the text of an observation to its value, UNAVAILABLE becomes None.
+# Text that does not convert is kept as it is.
+
+def to_text(text):
+    return None if text == UNAVAILABLE else text
+
+
+def to_enum(text):
+    # Interned - few distinct values, compared often
+    if text is None or text == UNAVAILABLE:
+        return None
+    return sys.intern(text)
+
+
+def to_float(text):
+    if text is None or text == UNAVAILABLE:
+        return None
+    try:
+        return float(text)
+    except ValueError:
+        return text
+
+
+def to_int(text):
+    if text is None or text == UNAVAILABLE:
+        return None
+    try:
+        return int(text)
+    except ValueError:
+        return to_float(text)
+
+
+def to_vector(text):
+    # 3D samples and time series - space separated numbers
+    if text is None or text == UNAVAILABLE:
+        return None
+    try:
+        return [float(number) for number in text.split()]
+    except ValueError:
+        return text
+
+
+def to_timestamp(text):
+    # Seconds since the epoch
+    if text is None or text == UNAVAILABLE:
+        return None
+    try:
+        return parse_timestamp(text)
+    except ValueError:
+        return text
+
+
+def converter_for(definition):
+
+    # Converter of one data item from its /probe definition, None to keep the text (Conditions, data sets)
+    if definition.category == "SAMPLE":
+        if definition.representation == "TIME_SERIES":
+            return to_vector
+        if definition.representation in ("DATA_SET", "TABLE"):
+            return None
+        if definition.type in VECTOR_SAMPLES or (definition.units or "").endswith("_3D"):
+            return to_vector
+        return to_float
+    if definition.category == "EVENT":
+        if definition.representation in ("DATA_SET", "TABLE"):
+            return None
+        if definition.type in INTEGER_EVENTS:
+            return to_int
+        if definition.type in ENUM_EVENTS:
+            return to_enum
+        if definition.type in TIMESTAMP_EVENTS:
+            return to_timestamp
+        return to_text
+    return None
+
+
+def build_converters(definitions):
+
+    # dataItemId -> converter, compiled once from the /probe definitions and looked up by the parser.
+    # Data items missing from the table keep their text.
+    converters = {}
+    for data_item_id, definition in definitions.items():
+        converter = converter_for(definition)
+        if converter is not None:
+            converters[data_item_id] = converter
+    return converters
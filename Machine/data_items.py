@@ -0,0 +1,67 @@
+class DataItemIndex:
+
+    # Lookup index compiled from the `devices_xml` allow-list in config.yml
+    #   ComponentStream -> Events/Samples/Condition -> dataItem -> subTypes
+    # A data item listed without subtypes accepts every subtype (key with sub_type None)
+    # A data item can also carry filter options next to its subtypes, see Machine/filters.py
+    #   Position: {sub_types: [ACTUAL], deadband: 0.001}
+    ANY_SUB_TYPE = None
+
+    def __init__(self, devices_xml):
+
+        self.keys = set()
+        self.components = set()
+        self.categories = set()
+        # key -> filter options of the data item
+        self.options = {}
+        self.compile(devices_xml or {})
+        # Nothing configured - extract everything
+        self.enabled = len(self.keys) > 0
+
+    def compile(self, devices_xml):
+
+        for component, categories in devices_xml.items():
+            self.components.add(component)
+            for category, data_items in (categories or {}).items():
+                self.categories.add((component, category))
+
+                # A plain list of data items - any subtype
+                if isinstance(data_items, (list, tuple)):
+                    for data_item in data_items:
+                        self.keys.add((component, category, data_item, self.ANY_SUB_TYPE))
+                    continue
+
+                for data_item, sub_types in (data_items or {}).items():
+                    options = None
+                    if isinstance(sub_types, dict):
+                        options = {key: value for key, value in sub_types.items() if key != "sub_types"}
+                        sub_types = sub_types.get("sub_types")
+                    if not sub_types:
+                        sub_types = [self.ANY_SUB_TYPE]
+                    for sub_type in sub_types:
+                        key = (component, category, data_item, sub_type)
+                        self.keys.add(key)
+                        if options:
+                            self.options[key] = options
+
+    def accepts_component(self, component):
+        return not self.enabled or component in self.components
+
+    def accepts_category(self, component, category):
+        return not self.enabled or (component, category) in self.categories
+
+    def accepts(self, component, category, data_item, sub_type):
+
+        if not self.enabled:
+            return True
+        keys = self.keys
+        return (component, category, data_item, sub_type) in keys or \
+            (component, category, data_item, self.ANY_SUB_TYPE) in keys
+
+    def options_of(self, component, category, data_item, sub_type):
+
+        # Filter options of the data item, None if it has none
+        options = self.options.get((component, category, data_item, sub_type))
+        if options is None:
+            options = self.options.get((component, category, data_item, self.ANY_SUB_TYPE))
+        return options
@@ -0,0 +1,288 @@
+import time
+import logging
+import threading
+from collections import deque
+from Machine.converters import parse_timestamp
+
+# Execution states that end a cycle - FEED_HOLD, INTERRUPTED, WAIT, OPTIONAL_STOP only pause it
+CYCLE_END_EXECUTION = {"READY", "STOPPED", "PROGRAM_STOPPED", "PROGRAM_COMPLETED", None, "UNAVAILABLE"}
+
+
+class RunningStats:
+
+    # Count, sum, sum of squares and extremes of one channel, folded in segment by segment
+    __slots__ = ("count", "total", "squares", "minimum", "maximum", "below")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.squares = 0.0
+        self.minimum = None
+        self.maximum = None
+        # Values below 100 - feedrate override
+        self.below = 0
+
+    def add(self, np, values):
+
+        values = values[~np.isnan(values)]
+        if not len(values):
+            return
+        self.count += len(values)
+        self.total += float(values.sum())
+        self.squares += float(np.dot(values, values))
+        minimum, maximum = float(values.min()), float(values.max())
+        self.minimum = minimum if self.minimum is None else min(self.minimum, minimum)
+        self.maximum = maximum if self.maximum is None else max(self.maximum, maximum)
+        self.below += int(np.count_nonzero(values < 100.0))
+
+    def load(self):
+        if not self.count:
+            return None
+        return {"n": self.count, "mean": self.total / self.count, "rms": (self.squares / self.count) ** 0.5,
+                "peak": max(abs(self.minimum), abs(self.maximum))}
+
+    def feedrate(self):
+        if not self.count:
+            return None
+        return {"n": self.count, "mean": self.total / self.count, "max": self.maximum}
+
+    def override(self):
+        if not self.count:
+            return None
+        return {"n": self.count, "mean": self.total / self.count, "min": self.minimum, "max": self.maximum,
+                "below_100": self.below / self.count}
+
+
+class FeatureExtractor:
+
+    # Edge analytics on the ring buffers of one machine (Machine/ring_buffers.py). A cycle starts when Execution
+    # turns ACTIVE and ends when it turns READY/STOPPED/... - without an Execution data item, when the feedrate rises
+    # above `feedrate_threshold` and stays below it for `idle_seconds`. Every `interval` seconds the new samples of
+    # the Load, PathFeedrate and override channels are folded into the statistics of the running cycle, so cycles
+    # longer than the buffers are covered too. Records:
+    #   cycle   - start, end, duration and RMS/peak/mean load per axis, feedrate and override statistics of a cycle
+    #   rolling - the same over the last `rolling_window` seconds, every `rolling_interval` seconds while cutting
+    def __init__(self, machine_status, buffers, interval=1.0, rolling_window=10.0, rolling_interval=10.0,
+                 feedrate_threshold=0.0, idle_seconds=5.0, min_cycle_seconds=1.0, max_records=1000):
+
+        self.logger = logging.getLogger("FeatureExtractor")
+        self.machine_status = machine_status
+        self.buffers = buffers
+        self.np = buffers.np
+        self.interval = interval
+        self.rolling_window = rolling_window
+        self.rolling_interval = rolling_interval
+        self.feedrate_threshold = feedrate_threshold
+        self.idle_seconds = idle_seconds
+        self.min_cycle_seconds = min_cycle_seconds
+        # Cycle boundaries seen by the listener, folded by the next update - ("start" | "end", epoch seconds)
+        self.transitions = []
+        self.execution = None
+        self.execution_seen = False
+        self.in_cycle = False
+        # Agent timestamp of the last motion, and the monotonic time it was seen
+        self.last_motion = None
+        self.last_motion_seen = None
+        # Statistics of the running cycle - dataItemId -> (kind, label, RunningStats)
+        self.cycle_start = None
+        self.cycle_stats = {}
+        # dataItemId -> buffer.total already folded
+        self.folded = {}
+        self.last_rolling = 0.0
+        # Records waiting to be published, the oldest are dropped beyond `max_records`
+        self.records = deque(maxlen=max_records)
+        self.lock = threading.Lock()
+        self.running = False
+        self.thread = None
+
+    @classmethod
+    def from_config(cls, machine_status, buffers, features_config):
+        return cls(machine_status, buffers,
+                   interval=features_config.get("interval", 1.0),
+                   rolling_window=features_config.get("rolling_window", 10.0),
+                   rolling_interval=features_config.get("rolling_interval", 10.0),
+                   feedrate_threshold=features_config.get("feedrate_threshold", 0.0),
+                   idle_seconds=features_config.get("idle_seconds", 5.0),
+                   min_cycle_seconds=features_config.get("min_cycle_seconds", 1.0))
+
+    def on_observations(self, observations):
+
+        # Listener of MachineStateMonitor - runs with the monitor lock held, only records the transitions
+        for observation in observations:
+            data_item = observation.data_item
+            if data_item == "Execution":
+                self.execution_seen = True
+                execution = observation.value
+                if execution == self.execution:
+                    continue
+                self.execution = execution
+                if execution == "ACTIVE" and not self.in_cycle:
+                    self.in_cycle = True
+                    self.transitions.append(("start", parse_timestamp(observation.timestamp)))
+                elif execution in CYCLE_END_EXECUTION and self.in_cycle:
+                    self.in_cycle = False
+                    self.transitions.append(("end", parse_timestamp(observation.timestamp)))
+            elif data_item == "PathFeedrate" and observation.sub_type in (None, "ACTUAL") \
+                    and not self.execution_seen:
+                try:
+                    moving = float(observation.value) > self.feedrate_threshold
+                except (TypeError, ValueError):
+                    continue
+                timestamp = parse_timestamp(observation.timestamp)
+                # Idle for `idle_seconds` of agent time since the last motion - the filters may have dropped
+                # every sample in between
+                if self.in_cycle and timestamp - self.last_motion > self.idle_seconds:
+                    self.in_cycle = False
+                    self.transitions.append(("end", self.last_motion))
+                if moving:
+                    self.last_motion = timestamp
+                    self.last_motion_seen = time.monotonic()
+                    if not self.in_cycle:
+                        self.in_cycle = True
+                        self.transitions.append(("start", timestamp))
+
+    def channels(self):
+
+        # (dataItemId, kind, label, buffer) of the channels the features are computed from. The label is the name or
+        # component of the data item, with its subType - e.g. X/ACTUAL and X/COMMANDED loads of one axis
+        channels = []
+        for data_item_id, buffer in self.buffers.items():
+            label = buffer.name or buffer.component_name
+            if buffer.sub_type is not None:
+                label = f"{label}/{buffer.sub_type}"
+            if buffer.data_item == "Load":
+                channels.append((data_item_id, "load", label, buffer))
+            elif buffer.data_item == "PathFeedrate":
+                if buffer.sub_type == "OVERRIDE":
+                    channels.append((data_item_id, "override", label, buffer))
+                elif buffer.sub_type in (None, "ACTUAL"):
+                    channels.append((data_item_id, "feedrate", label, buffer))
+        return channels
+
+    def update(self):
+
+        with self.machine_status.lock:
+            channels = self.channels()
+            # Without Execution the cycle ends after `idle_seconds` without motion - measured on the wall clock
+            # here, no samples arrive while the machine stands still
+            if self.in_cycle and not self.execution_seen and self.last_motion is not None \
+                    and time.monotonic() - self.last_motion_seen > self.idle_seconds:
+                self.in_cycle = False
+                self.transitions.append(("end", self.last_motion))
+            transitions, self.transitions = self.transitions, []
+
+            # New samples of every channel since the last update, cut at the cycle boundaries
+            segments = []
+            for data_item_id, kind, label, buffer in channels:
+                new = buffer.total - self.folded.get(data_item_id, 0)
+                self.folded[data_item_id] = buffer.total
+                # Values overwritten before they were folded are lost - keep `interval` well below the buffer span
+                if new > buffer.capacity:
+                    self.logger.warning(f"{new - buffer.capacity} values of {data_item_id} were overwritten before "
+                                        f"the features were updated")
+                if new > 0:
+                    times, values = buffer.latest(new)
+                    # Copied - the buffer keeps filling after the lock is released
+                    segments.append((data_item_id, kind, label, times.copy(), values.copy()))
+            rolling = None
+            now = time.time()
+            if self.in_cycle and now - self.last_rolling >= self.rolling_interval:
+                self.last_rolling = now
+                rolling = self.rolling(channels)
+
+        for transition, timestamp in transitions:
+            # Samples before the boundary belong to the cycle that was running
+            if self.cycle_start is not None:
+                self.fold(segments, end=timestamp)
+            if transition == "start":
+                self.cycle_start = timestamp
+                self.cycle_stats = {}
+            elif self.cycle_start is not None:
+                self.close_cycle(timestamp)
+        if self.cycle_start is not None:
+            self.fold(segments)
+        if rolling is not None:
+            self.add_record(rolling)
+
+    def fold(self, segments, end=None):
+
+        # Samples of the segments from the start of the running cycle up to and including `end`
+        np = self.np
+        for data_item_id, kind, label, times, values in segments:
+            lower = int(np.searchsorted(times, self.cycle_start, side="left"))
+            upper = len(times) if end is None else int(np.searchsorted(times, end, side="right"))
+            if upper > lower:
+                channel = self.cycle_stats.get(data_item_id)
+                if channel is None:
+                    channel = self.cycle_stats[data_item_id] = (kind, label, RunningStats())
+                channel[2].add(np, values[lower:upper])
+
+    def summarize(self, stats_by_id):
+
+        record = {"load": {}, "feedrate": {}, "override": {}}
+        for data_item_id, (kind, label, stats) in stats_by_id.items():
+            summary = getattr(stats, kind)()
+            if summary is not None:
+                # Unnamed data items of the same type and component
+                if label in record[kind]:
+                    label = f"{label}/{data_item_id}"
+                record[kind][label] = summary
+        return record
+
+    def close_cycle(self, end):
+
+        start, self.cycle_start = self.cycle_start, None
+        stats, self.cycle_stats = self.cycle_stats, {}
+        if end - start < self.min_cycle_seconds:
+            return
+        record = {"type": "cycle", "machine": self.machine_status.machine_name, "start": start, "end": end,
+                  "duration": end - start}
+        record.update(self.summarize(stats))
+        self.add_record(record)
+        self.logger.info(f"Cycle of {self.machine_status.machine_name} finished after {end - start:.1f} s")
+
+    def rolling(self, channels):
+
+        # Statistics over the last `rolling_window` seconds of every channel, vectorized over the buffer windows
+        latest = max((buffer.times[buffer.position + buffer.capacity - 1] for _, _, _, buffer in channels
+                      if buffer.count), default=None)
+        if latest is None:
+            return None
+        stats_by_id = {}
+        for data_item_id, kind, label, buffer in channels:
+            _, values = buffer.since(latest - self.rolling_window)
+            stats = RunningStats()
+            stats.add(self.np, values)
+            stats_by_id[data_item_id] = (kind, label, stats)
+        record = {"type": "rolling", "machine": self.machine_status.machine_name, "end": latest,
+                  "window": self.rolling_window}
+        record.update(self.summarize(stats_by_id))
+        return record
+
+    def add_record(self, record):
+        with self.lock:
+            self.records.append(record)
+
+    def take_records(self):
+        with self.lock:
+            records = list(self.records)
+            self.records.clear()
+            return records
+
+    def start(self):
+
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+
+    def run(self):
+
+        while self.running:
+            time.sleep(self.interval)
+            try:
+                self.update()
+            except Exception as e:
+                self.logger.error(f"Feature extraction failed with - {e}")
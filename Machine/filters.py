@@ -0,0 +1,229 @@
+import time
+from Machine.converters import parse_timestamp
+
+
+def numeric(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class DeadbandFilter:
+
+    # Passes a value when it moved more than `deadband` from the last passed value, or more than `percent`
+    # of it. Every published value is within the deadband of the value the agent reported.
+    def __init__(self, deadband=0.0, percent=0.0, max_interval=None):
+
+        self.deadband = deadband
+        self.percent = percent
+        # Seconds after which a value passes even if it did not move, None to never force one
+        self.max_interval = max_interval
+        self.last_value = None
+        self.last_time = None
+        # Values left out
+        self.dropped = 0
+
+    def update(self, observation, value, timestamp):
+
+        last = self.last_value
+        if last is not None:
+            limit = max(self.deadband, abs(last) * self.percent / 100.0)
+            expired = self.max_interval is not None and timestamp - self.last_time >= self.max_interval
+            if abs(value - last) <= limit and not expired:
+                self.dropped += 1
+                return ()
+        self.last_value = value
+        self.last_time = timestamp
+        return (observation,)
+
+    def flush(self):
+        return ()
+
+    def reset(self):
+        self.last_value = None
+        self.last_time = None
+
+
+class SwingingDoorFilter:
+
+    # Swinging door compression - keeps the points where the signal changes its slope. A point is only left out
+    # while the line between the passed points around it stays within `deviation` of it.
+    # A point is only known to be needed once the next one leaves the door, so the filter holds the latest
+    # point back until then - or until `max_hold` seconds passed without a new value.
+    def __init__(self, deviation, max_interval=None, max_hold=2.0):
+
+        self.deviation = deviation
+        self.max_interval = max_interval
+        self.max_hold = max_hold
+        # Last passed point
+        self.archive_value = None
+        self.archive_time = None
+        # Slopes of the door from the last passed point
+        self.upper = None
+        self.lower = None
+        # Latest point, not passed yet - (observation, value, timestamp)
+        self.held = None
+        # Monotonic time the held point was received
+        self.held_since = None
+        # Values left out
+        self.dropped = 0
+
+    def archive(self, value, timestamp):
+
+        self.archive_value = value
+        self.archive_time = timestamp
+        self.upper = None
+        self.lower = None
+
+    def hold(self, observation, value, timestamp):
+
+        # The previous held point lies inside the door
+        if self.held is not None:
+            self.dropped += 1
+        self.held = (observation, value, timestamp)
+        self.held_since = time.monotonic()
+
+    def update(self, observation, value, timestamp):
+
+        # First point
+        if self.archive_value is None:
+            self.archive(value, timestamp)
+            return (observation,)
+
+        elapsed = timestamp - self.archive_time
+        if elapsed <= 0:
+            # Same timestamp as the last passed point - compare the values only
+            if abs(value - self.archive_value) <= self.deviation:
+                self.dropped += 1
+                return ()
+            self.drop_held()
+            self.archive(value, timestamp)
+            return (observation,)
+
+        if self.max_interval is not None and elapsed >= self.max_interval:
+            held = self.flush()
+            self.archive(value, timestamp)
+            return held + (observation,)
+
+        upper = (value + self.deviation - self.archive_value) / elapsed
+        lower = (value - self.deviation - self.archive_value) / elapsed
+        upper = upper if self.upper is None else min(self.upper, upper)
+        lower = lower if self.lower is None else max(self.lower, lower)
+
+        # The line from the last passed point to this one stays inside the door - within `deviation`
+        # of every point since, this point can replace the held one
+        if lower <= (value - self.archive_value) / elapsed <= upper:
+            self.upper, self.lower = upper, lower
+            self.hold(observation, value, timestamp)
+            return ()
+
+        # The door closed - pass the held point and open a new door from it through this one
+        held_observation, held_value, held_time = self.held
+        self.held = None
+        self.archive(held_value, held_time)
+        elapsed = timestamp - held_time
+        if elapsed > 0:
+            self.upper = (value + self.deviation - held_value) / elapsed
+            self.lower = (value - self.deviation - held_value) / elapsed
+        self.hold(observation, value, timestamp)
+        return (held_observation,)
+
+    def drop_held(self):
+
+        if self.held is not None:
+            self.dropped += 1
+            self.held = None
+
+    def flush(self):
+
+        # Pass the held point - the signal stopped changing or went non numeric
+        if self.held is None:
+            return ()
+        held_observation, held_value, held_time = self.held
+        self.held = None
+        self.archive(held_value, held_time)
+        return (held_observation,)
+
+    def reset(self):
+
+        self.held = None
+        self.archive_value = None
+        self.archive_time = None
+        self.upper = None
+        self.lower = None
+
+
+def create_filter(options):
+
+    # Filter of one data item from its options in `devices_xml`, None if it has none
+    max_interval = options.get("max_interval")
+    if options.get("compression") is not None:
+        return SwingingDoorFilter(float(options["compression"]), max_interval=max_interval,
+                                  max_hold=options.get("max_hold", 2.0))
+    if options.get("deadband") is not None or options.get("deadband_percent") is not None:
+        return DeadbandFilter(deadband=float(options.get("deadband") or 0.0),
+                              percent=float(options.get("deadband_percent") or 0.0), max_interval=max_interval)
+    return None
+
+
+class DataItemFilters:
+
+    # Per data item filtering stage between the parser and the machine state. Only the observations that pass
+    # are applied, marked as changed and handed to the listeners (batching, historian, ...).
+    def __init__(self, data_item_index):
+
+        self.data_item_index = data_item_index
+        self.enabled = bool(data_item_index.options)
+        # dataItemId -> filter, None for the data items without one
+        self.filters = {}
+        # dataItemId -> last sequence seen, a /current snapshot repeats observations that did not change
+        self.sequences = {}
+        # Swinging door filters, checked for held points on every update
+        self.doors = []
+        # Observations left out by all filters
+        self.dropped = 0
+
+    def filter_of(self, observation):
+
+        data_item_id = observation.data_item_id
+        try:
+            return self.filters[data_item_id]
+        except KeyError:
+            options = self.data_item_index.options_of(observation.component, observation.category,
+                                                      observation.data_item, observation.sub_type)
+            data_filter = self.filters[data_item_id] = create_filter(options) if options else None
+            if isinstance(data_filter, SwingingDoorFilter):
+                self.doors.append(data_filter)
+            return data_filter
+
+    def apply(self, observations):
+
+        passed = []
+        sequences = self.sequences
+        for observation in observations:
+            data_filter = self.filter_of(observation)
+            if data_filter is None:
+                passed.append(observation)
+                continue
+            if sequences.get(observation.data_item_id) == observation.sequence:
+                continue
+            sequences[observation.data_item_id] = observation.sequence
+
+            value = numeric(observation.value)
+            if value is None or observation.timestamp is None:
+                # UNAVAILABLE, ... always passes, the next number starts over
+                passed.extend(data_filter.flush())
+                data_filter.reset()
+                passed.append(observation)
+                continue
+            dropped = data_filter.dropped
+            passed.extend(data_filter.update(observation, value, parse_timestamp(observation.timestamp)))
+            self.dropped += data_filter.dropped - dropped
+
+        # Points held back for too long
+        now = time.monotonic()
+        for door in self.doors:
+            if door.held is not None and now - door.held_since >= door.max_hold:
+                passed.extend(door.flush())
+        return passed
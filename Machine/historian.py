@@ -0,0 +1,321 @@
+import os
+import json
+import time
+import shutil
+import logging
+import threading
+from datetime import datetime
+from Machine.converters import parse_timestamp
+
+
+def load_numpy():
+    try:
+        import numpy
+    except ImportError:
+        raise ImportError("The historian requires the `numpy` package - pip install numpy")
+    return numpy
+
+
+class ColumnBuffer:
+
+    # Observations of one data item waiting for the next flush
+    __slots__ = ("component_name", "category", "data_item", "sub_type", "name", "numeric", "times", "values",
+                 "last_sequence")
+
+    def __init__(self, observation):
+
+        self.component_name = observation.component_name
+        self.category = observation.category
+        self.data_item = observation.data_item
+        self.sub_type = observation.sub_type
+        self.name = observation.name
+        # Samples are stored as float64, everything else dictionary encoded
+        self.numeric = observation.category == "Samples"
+        self.times = []
+        self.values = []
+        self.last_sequence = None
+
+    def describe(self):
+        return {"component": self.component_name, "category": self.category, "dataItem": self.data_item,
+                "subType": self.sub_type, "name": self.name, "kind": "number" if self.numeric else "text"}
+
+
+class Historian:
+
+    # Local history of every observation of one machine, independent of the upload.
+    # One directory per hour, <root>/<machine>/<YYYYMMDDHH>/, with per data item columns appended on every flush:
+    #   <dataItemId>.t    - float64 epoch seconds
+    #   <dataItemId>.v    - float64 values of the Samples (NaN for UNAVAILABLE) or uint32 dictionary codes
+    #   <dataItemId>.dict - one JSON string per line, code n is line n
+    #   meta.json         - dataItemId -> component, category, dataItem, subType, name, kind
+    # Hours older than `retention_hours` are deleted.
+    def __init__(self, root, machine_name, retention_hours=168, flush_interval=5.0):
+
+        self.np = load_numpy()
+        self.logger = logging.getLogger("Historian")
+        self.machine_name = machine_name
+        self.directory = os.path.join(root, machine_name)
+        self.retention_hours = retention_hours
+        self.flush_interval = flush_interval
+        self.lock = threading.Lock()
+        self.write_lock = threading.Lock()
+        # dataItemId -> ColumnBuffer
+        self.buffers = {}
+        # (hour, dataItemId) -> {value: code}
+        self.dictionaries = {}
+        # hour -> meta of the partition
+        self.metas = {}
+        self.running = False
+        self.thread = None
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+
+    @classmethod
+    def from_config(cls, machine_name, historian_config):
+        return cls(historian_config["path"], machine_name,
+                   retention_hours=historian_config.get("retention_hours", 168),
+                   flush_interval=historian_config.get("flush_interval", 5.0))
+
+    def on_observations(self, observations):
+
+        # Listener of MachineStateMonitor - runs with the monitor lock held, only buffers
+        with self.lock:
+            buffers = self.buffers
+            for observation in observations:
+                buffer = buffers.get(observation.data_item_id)
+                if buffer is None:
+                    buffer = buffers[observation.data_item_id] = ColumnBuffer(observation)
+                # A /current snapshot repeats observations that did not change
+                if observation.sequence == buffer.last_sequence:
+                    continue
+                buffer.last_sequence = observation.sequence
+                buffer.times.append(observation.timestamp)
+                buffer.values.append(observation.value)
+
+    def start(self):
+
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+
+        self.running = False
+        self.flush()
+
+    def run(self):
+
+        last_retention = 0.0
+        while self.running:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+                if time.time() - last_retention > 3600:
+                    self.apply_retention()
+                    last_retention = time.time()
+            except Exception as e:
+                self.logger.error(f"Historian flush failed with - {e}")
+
+    def partition_path(self, hour):
+        return os.path.join(self.directory, time.strftime("%Y%m%d%H", time.gmtime(hour * 3600)))
+
+    def flush(self):
+
+        # Swap the buffers and append them to the hour partitions
+        with self.lock:
+            pending = []
+            for data_item_id, buffer in self.buffers.items():
+                if buffer.times:
+                    pending.append((data_item_id, buffer, buffer.times, buffer.values))
+                    buffer.times, buffer.values = [], []
+
+        np = self.np
+        with self.write_lock:
+            for data_item_id, buffer, timestamps, values in pending:
+                times = np.array([parse_timestamp(timestamp) for timestamp in timestamps], dtype="<f8")
+                hours = (times // 3600).astype(np.int64)
+                for hour in np.unique(hours):
+                    mask = hours == hour
+                    self.append(int(hour), data_item_id, buffer, times[mask],
+                                [value for value, keep in zip(values, mask) if keep])
+
+    def append(self, hour, data_item_id, buffer, times, values):
+
+        np = self.np
+        path = self.partition_path(hour)
+        meta = self.load_meta(hour)
+        if data_item_id not in meta:
+            meta[data_item_id] = buffer.describe()
+            self.write_meta(hour, meta)
+
+        if buffer.numeric:
+            column = np.array([to_float(value) for value in values], dtype="<f8")
+        else:
+            column = np.array(self.encode(hour, data_item_id, values), dtype="<u4")
+
+        # Values first - a crash between the two writes leaves extra values, reads align on the times
+        with open(os.path.join(path, data_item_id + ".v"), "ab") as filehandle:
+            column.tofile(filehandle)
+        with open(os.path.join(path, data_item_id + ".t"), "ab") as filehandle:
+            times.tofile(filehandle)
+
+    def encode(self, hour, data_item_id, values):
+
+        # Dictionary codes of the values, new values are appended to the dictionary file
+        dictionary = self.dictionaries.get((hour, data_item_id))
+        if dictionary is None:
+            dictionary = {value: code for code, value in enumerate(self.read_dictionary(hour, data_item_id))}
+            self.dictionaries[(hour, data_item_id)] = dictionary
+
+        codes = []
+        new_values = []
+        for value in values:
+            code = dictionary.get(value)
+            if code is None:
+                code = dictionary[value] = len(dictionary)
+                new_values.append(value)
+            codes.append(code)
+        if new_values:
+            with open(os.path.join(self.partition_path(hour), data_item_id + ".dict"), "a") as filehandle:
+                filehandle.writelines(json.dumps(value) + "\n" for value in new_values)
+        return codes
+
+    def read_dictionary(self, hour, data_item_id):
+
+        path = os.path.join(self.partition_path(hour), data_item_id + ".dict")
+        if not os.path.exists(path):
+            return []
+        with open(path, "r") as filehandle:
+            return [json.loads(line) for line in filehandle]
+
+    def load_meta(self, hour):
+
+        meta = self.metas.get(hour)
+        if meta is not None:
+            return meta
+        path = self.partition_path(hour)
+        if not os.path.exists(path):
+            os.makedirs(path)
+        meta = self.read_meta(hour)
+        # Only the current and the previous hour are written to
+        for old in [key for key in self.metas if key < hour - 1]:
+            del self.metas[old]
+        for old in [key for key in self.dictionaries if key[0] < hour - 1]:
+            del self.dictionaries[old]
+        self.metas[hour] = meta
+        return meta
+
+    def read_meta(self, hour):
+
+        path = os.path.join(self.partition_path(hour), "meta.json")
+        if not os.path.exists(path):
+            return {}
+        with open(path, "r") as filehandle:
+            return json.load(filehandle)
+
+    def write_meta(self, hour, meta):
+
+        path = os.path.join(self.partition_path(hour), "meta.json")
+        with open(path + ".tmp", "w") as filehandle:
+            json.dump(meta, filehandle)
+        os.replace(path + ".tmp", path)
+
+    def hours(self):
+
+        # Hour partitions on disk, oldest first
+        hours = []
+        for name in os.listdir(self.directory):
+            try:
+                hours.append(int(datetime.strptime(name + "+0000", "%Y%m%d%H%z").timestamp() // 3600))
+            except ValueError:
+                continue
+        return sorted(hours)
+
+    def apply_retention(self):
+
+        oldest = int(time.time() // 3600) - self.retention_hours
+        for hour in self.hours():
+            if hour >= oldest:
+                break
+            with self.write_lock:
+                shutil.rmtree(self.partition_path(hour), ignore_errors=True)
+                self.metas.pop(hour, None)
+            self.logger.info(f"Removed historian partition {self.partition_path(hour)}")
+
+    def data_items(self, start=None, end=None):
+
+        # dataItemId -> description, for the hours between start and end
+        items = {}
+        for hour in self.hours():
+            if (start is None or hour >= start // 3600) and (end is None or hour <= end // 3600):
+                items.update(self.read_meta(hour))
+        return items
+
+    def query(self, data_item_id, start, end):
+
+        # Observations of a data item with start <= time < end (epoch seconds), as (times, values) arrays.
+        # Values are float64 for Samples and an object array of strings otherwise
+        np = self.np
+        self.flush()
+        times, values = [], []
+        for hour in range(int(start // 3600), int(end // 3600) + 1):
+            path = os.path.join(self.partition_path(hour), data_item_id)
+            if not os.path.exists(path + ".t"):
+                continue
+            meta = self.read_meta(hour).get(data_item_id, {})
+            hour_times = np.fromfile(path + ".t", dtype="<f8")
+            if meta.get("kind") == "text":
+                codes = np.fromfile(path + ".v", dtype="<u4")[:len(hour_times)]
+                dictionary = np.array(self.read_dictionary(hour, data_item_id) + [None], dtype=object)
+                hour_values = dictionary[np.minimum(codes, len(dictionary) - 1)]
+            else:
+                hour_values = np.fromfile(path + ".v", dtype="<f8")[:len(hour_times)]
+            hour_times = hour_times[:len(hour_values)]
+            mask = (hour_times >= start) & (hour_times < end)
+            times.append(hour_times[mask])
+            values.append(hour_values[mask])
+
+        if not times:
+            return np.empty(0, dtype="<f8"), np.empty(0, dtype="<f8")
+        times = np.concatenate(times)
+        values = np.concatenate(values)
+        order = np.argsort(times, kind="stable")
+        return times[order], values[order]
+
+    def downsample(self, data_item_id, start, end, bucket, how="mean"):
+
+        # One value per `bucket` seconds - mean, min, max or last. Text data items support only last.
+        # Returns (bucket start times, values), empty buckets are left out
+        np = self.np
+        times, values = self.query(data_item_id, start, end)
+        if len(times) == 0:
+            return times, values
+
+        index = ((times - start) // bucket).astype(np.int64)
+        edges = np.flatnonzero(np.diff(index)) + 1
+        starts = np.concatenate(([0], edges))
+        bucket_times = start + index[starts] * bucket
+
+        if how == "last":
+            return bucket_times, values[np.concatenate((edges - 1, [len(values) - 1]))]
+        if values.dtype == object:
+            raise ValueError(f"{how} downsampling needs a numeric data item, {data_item_id} is text")
+        if how == "min":
+            return bucket_times, np.fmin.reduceat(values, starts)
+        if how == "max":
+            return bucket_times, np.fmax.reduceat(values, starts)
+        if how == "mean":
+            valid = ~np.isnan(values)
+            sums = np.add.reduceat(np.where(valid, values, 0.0), starts)
+            counts = np.add.reduceat(valid.astype(np.int64), starts)
+            with np.errstate(invalid="ignore", divide="ignore"):
+                return bucket_times, sums / counts
+        raise ValueError(f"Unknown downsampling - {how}")
+
+
+def to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        # UNAVAILABLE
+        return float("nan")
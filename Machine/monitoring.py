@@ -1,81 +1,157 @@
-from xml.dom.minidom import parseString
+import time
+import threading
+from Metrics.registry import registry
+from Machine.streams import StreamsParser
+from Machine.data_items import DataItemIndex
+from Machine.filters import DataItemFilters
+from Machine.state_store import StateStore
+
+PARSE_SECONDS = registry.histogram("mtc_parse_seconds", "MTConnectStreams document parse time",
+                                   labels=("machine", "document"))
+OBSERVATIONS = registry.counter("mtc_observations_total", "Observations applied to the machine state",
+                                labels=("machine",))
+FILTERED = registry.counter("mtc_observations_filtered_total", "Observations dropped by the deadband and compression "
+                            "filters", labels=("machine",))
 
 
 class MachineStateMonitor:
 
-    def __init__(self, machine_name, devices_xml):
+    def __init__(self, machine_name, devices_xml, converters=None, buffers=None):
 
         self.machine_name = machine_name
         self.machine_availability = False
         self.selected_device = None
         # Machine Params
         self.devices_xml = devices_xml
-        self.machine_params = {}
-
-    def get_set_machine_availability(self, response):
-
-        # Get the availability
-        document = parseString(response.text)
-
-        # Get all availabilities
-        availabilities = document.getElementsByTagName('Availability')
-        for availability in availabilities:
-            if availability.getAttribute("dataItemId") == self.machine_name + "_avail_01":
-                # Check status
-                if availability.childNodes[0].nodeValue == "AVAILABLE":
-                    self.machine_availability = True
-                    return
-
-        self.machine_availability = False
-
-    def get_set_machine_type(self, response):
-
-        # Get all Devices
-        document = parseString(response.text)
-
-        # Select the right machine
-        devices = document.getElementsByTagName('DeviceStream')
-        for device in devices:
-            if device.getAttribute("name") == self.machine_name:
-                self.selected_device = device
-            return
+        # Latest value of every data item, one slot per dataItemId
+        self.state = StateStore()
+        # Position in the agent buffer
+        self.instance_id = None
+        self.next_sequence = None
+        # Number of observations applied by the last update
+        self.updated_items = 0
+        # (component, category, dataItem) leaves of machine_params changed since the last publish
+        self.changed = set()
+        # Acquisition may run on its own thread
+        self.lock = threading.RLock()
+        # Called with the observations of every update, in sequence order
+        self.listeners = []
+        # Allow-list of the data items to extract, compiled once
+        self.data_item_index = DataItemIndex(devices_xml)
+        # Single pass parser for the MTConnectStreams document
+        # Values are typed during the parse when the /probe converters are given
+        self.parser = StreamsParser(machine_name, self.data_item_index, converters)
+        # Deadband and compression of the data items configured with filter options
+        self.filters = DataItemFilters(self.data_item_index)
+        # Recent history of the numeric data items in NumPy ring buffers, see Machine/ring_buffers.py
+        self.buffers = buffers
+        # Metrics
+        self.parse_current_seconds = PARSE_SECONDS.labels(machine_name, "current")
+        self.parse_sample_seconds = PARSE_SECONDS.labels(machine_name, "sample")
+        self.observations_total = OBSERVATIONS.labels(machine_name)
+        self.filtered = FILTERED.labels(machine_name)
 
     def update_machine_state(self, response):
 
-        # Get all Devices
-        document = parseString(response.text)
+        # Parse the document once - availability, device and component values
+        start = time.perf_counter()
+        document = self.parser.parse(response.content)
+        self.parse_current_seconds.observe(time.perf_counter() - start)
 
         # Start by updating machine availability
-        self.get_set_machine_availability(response)
-
-        if self.machine_availability:
-            self.get_set_machine_type(response)
-        else:
+        self.machine_availability = bool(document.availability)
+        if not self.machine_availability:
             return
+        self.selected_device = document.device
+
+        # A /current snapshot replaces the whole state
+        self.apply_observations(document, snapshot=True)
 
-        # Go through all component and assign values
-        for component in self.selected_device.getElementsByTagName('ComponentStream'):
+        return True
 
-            # Get the component name
-            component_name = component.getAttribute("name")
-            if component_name not in self.machine_params:
-                self.machine_params[component_name] = {}
+    def apply_sample(self, response):
+        return self.apply_sample_content(response.content)
 
-            # Go through the child nodes of component stream
-            for child_node in component.childNodes:
-                if child_node.nodeName not in self.machine_params[component_name]:
-                    self.machine_params[component_name][child_node.nodeName] = {}
+    def apply_sample_content(self, content):
 
-                # Get the respective values
-                for child_child_node in child_node.childNodes:
-                    if child_child_node not in self.machine_params[component_name][child_node.nodeName]:
-                        self.machine_params[component_name][child_node.nodeName][child_child_node.nodeName] = []
+        # Apply the changes returned by /sample?from=<next_sequence> (a response or one part of a stream)
+        # Returns False when the sequence is broken and a fresh /current is required
+        start = time.perf_counter()
+        document = self.parser.parse(content)
+        self.parse_sample_seconds.observe(time.perf_counter() - start)
+        if self.sequence_gap(document):
+            return False
 
-                    if child_child_node.firstChild is not None:
-                        value = child_child_node.firstChild.nodeValue
-                    else:
-                        value = None
-                    self.machine_params[component_name][child_node.nodeName][child_child_node.nodeName].append((child_child_node.getAttribute("name"), value))
+        if document.availability is not None:
+            self.machine_availability = document.availability
+        self.apply_observations(document)
 
         return True
 
+    def sequence_gap(self, document):
+
+        # Nothing to continue from
+        if self.next_sequence is None:
+            return True
+        # Agent returned an error document (OUT_OF_RANGE, ...)
+        if document.errors or not document.header:
+            return True
+        # Agent restarted
+        if document.header.get("instanceId") != self.instance_id:
+            return True
+        # Buffer overrun - the requested sequence is no longer in the agent buffer
+        if int(document.header["firstSequence"]) > self.next_sequence:
+            return True
+
+        return False
+
+    def apply_observations(self, document, snapshot=False):
+
+        with self.lock:
+            state = self.state
+            changed = self.changed
+            observations = document.observations
+            # The ring buffers keep every value - the analytics on them weight each sample equally, the
+            # deadband and swinging door filters would leave them only the transients
+            if self.buffers is not None:
+                for observation in observations:
+                    self.buffers.append(observation)
+            if self.filters.enabled:
+                dropped = self.filters.dropped
+                observations = self.filters.apply(observations)
+                self.filtered.inc(self.filters.dropped - dropped)
+
+            # Observations come in sequence order, the last one of each data item wins
+            for observation in observations:
+                if state.update(observation):
+                    changed.add((observation.component_name, observation.category, observation.data_item))
+            self.updated_items = len(document.observations)
+            self.observations_total.inc(self.updated_items)
+
+            # Data items missing from a snapshot are gone
+            if snapshot:
+                changed.update(state.retain({observation.data_item_id for observation in document.observations}))
+
+            self.instance_id = document.header.get("instanceId")
+            self.next_sequence = int(document.header["nextSequence"])
+
+            for listener in self.listeners:
+                listener(observations)
+
+    def add_listener(self, listener):
+        self.listeners.append(listener)
+
+    @property
+    def machine_params(self):
+
+        # Nested params for the upload, serialized on demand
+        with self.lock:
+            return self.state.serialize()
+
+    def take_changes(self, full=False, ids=False):
+
+        # Changed leaves since the previous call and the params to publish - all of them or only the changed leaves
+        with self.lock:
+            changed, self.changed = self.changed, set()
+            params = self.state.serialize(ids=ids) if full else self.state.serialize(changed, ids=ids)
+            return changed, params
@@ -0,0 +1,133 @@
+from Machine.converters import parse_timestamp
+
+
+def load_numpy():
+    try:
+        import numpy
+    except ImportError:
+        raise ImportError("The ring buffers require the `numpy` package - pip install numpy")
+    return numpy
+
+
+class RingBuffer:
+
+    # Last `capacity` values of one data item in preallocated float64 time and value columns.
+    # Every value is written twice, at `position` and `position + capacity`, so the latest n values are always one
+    # contiguous slice and windows are read-only views instead of copies. A window of n values stays intact for
+    # the next `capacity - n` appends - copy it to keep it longer.
+    __slots__ = ("np", "capacity", "times", "values", "position", "count", "total", "last_sequence",
+                 "component_name", "category", "data_item", "sub_type", "name")
+
+    def __init__(self, np, capacity, observation):
+
+        self.np = np
+        self.capacity = capacity
+        self.times = np.full(2 * capacity, np.nan)
+        self.values = np.full(2 * capacity, np.nan)
+        # Index of the next write
+        self.position = 0
+        # Values held, at most `capacity`
+        self.count = 0
+        # Values appended since the start
+        self.total = 0
+        self.last_sequence = None
+        self.component_name = observation.component_name
+        self.category = observation.category
+        self.data_item = observation.data_item
+        self.sub_type = observation.sub_type
+        self.name = observation.name
+
+    def append(self, timestamp, value):
+
+        position = self.position
+        mirror = position + self.capacity
+        self.times[position] = self.times[mirror] = timestamp
+        self.values[position] = self.values[mirror] = value
+        self.position = position + 1 if position + 1 < self.capacity else 0
+        if self.count < self.capacity:
+            self.count += 1
+        self.total += 1
+
+    def view(self, start, end):
+
+        times = self.times[start:end]
+        values = self.values[start:end]
+        times.flags.writeable = False
+        values.flags.writeable = False
+        return times, values
+
+    def latest(self, n=None):
+
+        # (times, values) of the last `n` values, oldest first
+        n = self.count if n is None else min(n, self.count)
+        end = self.position + self.capacity
+        return self.view(end - n, end)
+
+    def since(self, timestamp):
+
+        # (times, values) from `timestamp` (epoch seconds) on
+        times, values = self.latest()
+        start = int(self.np.searchsorted(times, timestamp, side="left"))
+        return times[start:], values[start:]
+
+    def describe(self):
+        return {"component": self.component_name, "category": self.category, "dataItem": self.data_item,
+                "subType": self.sub_type, "name": self.name}
+
+
+def to_number(value):
+
+    # Typed values are floats already, text is converted, UNAVAILABLE and vectors become NaN
+    if value.__class__ is float:
+        return value
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return float("nan")
+
+
+class RingBufferStore:
+
+    # Recent history of the numeric data items of one machine - a RingBuffer per dataItemId, allocated when the
+    # data item is first seen. Filled by MachineStateMonitor while it applies the observations, with its lock held -
+    # readers that need a consistent set of windows take `monitor.lock` as well.
+    # Memory per data item is fixed at 32 bytes times `capacity`.
+    def __init__(self, capacity=4096, categories=("Samples",)):
+
+        self.np = load_numpy()
+        self.capacity = capacity
+        self.categories = set(categories)
+        # dataItemId -> RingBuffer
+        self.buffers = {}
+
+    @classmethod
+    def from_config(cls, buffers_config):
+        return cls(capacity=buffers_config.get("capacity", 4096),
+                   categories=buffers_config.get("categories", ["Samples"]))
+
+    def append(self, observation):
+
+        if observation.category not in self.categories:
+            return
+        buffer = self.buffers.get(observation.data_item_id)
+        if buffer is None:
+            buffer = self.buffers[observation.data_item_id] = RingBuffer(self.np, self.capacity, observation)
+        # A /current snapshot repeats observations that did not change
+        if observation.sequence == buffer.last_sequence:
+            return
+        buffer.last_sequence = observation.sequence
+        buffer.append(parse_timestamp(observation.timestamp), to_number(observation.value))
+
+    def get(self, data_item_id):
+        return self.buffers.get(data_item_id)
+
+    def select(self, data_item=None, sub_type=None, component_name=None):
+
+        # Buffers of the matching data items, e.g. select("Load") for the loads of every axis
+        return [buffer for buffer in self.buffers.values()
+                if (data_item is None or buffer.data_item == data_item)
+                and (sub_type is None or buffer.sub_type == sub_type)
+                and (component_name is None or buffer.component_name == component_name)]
+
+    def items(self):
+        return self.buffers.items()
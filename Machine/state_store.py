@@ -0,0 +1,94 @@
+class DataItemState:
+
+    # Latest observation of one data item, updated in place
+    __slots__ = ("data_item_id", "component_name", "category", "data_item", "sub_type", "name",
+                 "value", "timestamp", "sequence")
+
+    def __init__(self, observation):
+
+        self.data_item_id = observation.data_item_id
+        self.component_name = observation.component_name
+        self.category = observation.category
+        self.data_item = observation.data_item
+        self.sub_type = observation.sub_type
+        self.name = observation.name
+        self.value = observation.value
+        self.timestamp = observation.timestamp
+        self.sequence = observation.sequence
+
+    @property
+    def leaf(self):
+        # Position in the serialized params
+        return self.component_name, self.category, self.data_item
+
+
+class StateStore:
+
+    # One slot per data item, allocated when the data item is first seen and reused afterwards.
+    # Serialized on demand into the nested params - {component: {category: {dataItem: [(name, value), ...]}}}
+    def __init__(self):
+
+        # dataItemId -> DataItemState
+        self.slots = {}
+        # (component, category, dataItem) -> [DataItemState, ...] in document order
+        self.leaves = {}
+
+    def __len__(self):
+        return len(self.slots)
+
+    def get(self, data_item_id):
+        return self.slots.get(data_item_id)
+
+    def update(self, observation):
+
+        # Returns True when the value of the data item changed
+        slot = self.slots.get(observation.data_item_id)
+        if slot is None:
+            slot = DataItemState(observation)
+            self.slots[observation.data_item_id] = slot
+            self.leaves.setdefault(slot.leaf, []).append(slot)
+            return True
+
+        changed = slot.value != observation.value
+        slot.value = observation.value
+        slot.timestamp = observation.timestamp
+        slot.sequence = observation.sequence
+        return changed
+
+    def retain(self, data_item_ids):
+
+        # Drop the data items that are not in `data_item_ids`, returns the leaves that lost a data item
+        removed = set()
+        for data_item_id in [key for key in self.slots if key not in data_item_ids]:
+            slot = self.slots.pop(data_item_id)
+            slots = self.leaves[slot.leaf]
+            slots.remove(slot)
+            if not slots:
+                del self.leaves[slot.leaf]
+            removed.add(slot.leaf)
+        return removed
+
+    def serialize(self, leaves=None, ids=False):
+
+        # With `leaves`, a leaf that no longer has any data item is serialized as None so that
+        # subscribers merging the delta drop it. With `ids`, entries are (name, value, dataItemId)
+        params = {}
+        if leaves is None:
+            items = self.leaves.items()
+        else:
+            items = [(leaf, self.leaves.get(leaf)) for leaf in leaves]
+
+        for (component_name, category, data_item), slots in items:
+            categories = params.get(component_name)
+            if categories is None:
+                categories = params[component_name] = {}
+            data_items = categories.get(category)
+            if data_items is None:
+                data_items = categories[category] = {}
+            if slots is None:
+                data_items[data_item] = None
+            elif ids:
+                data_items[data_item] = [(slot.name, slot.value, slot.data_item_id) for slot in slots]
+            else:
+                data_items[data_item] = [(slot.name, slot.value) for slot in slots]
+        return params
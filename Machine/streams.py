@@ -0,0 +1,134 @@
+from collections import namedtuple
+from xml.etree.ElementTree import XMLPullParser
+from Machine.data_items import DataItemIndex
+
+
+# A single observation (Sample, Event or Condition) read from a ComponentStream
+Observation = namedtuple("Observation", [
+    "component",        # ComponentStream `component` attribute (Controller, Path, Linear, ...)
+    "component_name",   # ComponentStream `name` attribute (X, Y, path, ...)
+    "category",         # Samples, Events or Condition
+    "data_item",        # Element tag (Position, Load, Availability, ...)
+    "sub_type",         # `subType` attribute, None if not present
+    "name",             # `name` attribute, empty string if not present
+    "data_item_id",
+    "timestamp",
+    "sequence",
+    "value",
+])
+
+
+class StreamsDocument:
+
+    def __init__(self):
+        self.header = {}
+        # None when the document does not carry the availability (e.g. a /sample without changes)
+        self.availability = None
+        self.device = None
+        self.observations = []
+        # Error codes of an MTConnectError document (e.g. OUT_OF_RANGE)
+        self.errors = []
+
+
+def local_name(tag):
+
+    # Strip the namespace from the tag - {urn:mtconnect.org:MTConnectStreams:x.y}Tag -> Tag
+    if tag[0] == "{":
+        return tag[tag.index("}") + 1:]
+    return tag
+
+
+class StreamsParser:
+
+    # Read size while feeding the pull parser
+    CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, machine_name, data_item_index=None, converters=None):
+
+        self.machine_name = machine_name
+        self.availability_id = machine_name + "_avail_01"
+        # Only the data items in the index are extracted
+        self.data_item_index = data_item_index if data_item_index is not None else DataItemIndex(None)
+        # dataItemId -> converter of the text to a typed value, see Machine/converters.py
+        self.converters = converters
+
+    def parse(self, content):
+
+        # Walk the MTConnectStreams document once and discard every element as soon as it has been read
+        document = StreamsDocument()
+        parser = XMLPullParser(events=("start", "end"))
+        index = self.data_item_index
+        converter_of = self.converters.get if self.converters else None
+
+        # Position in the document
+        depth = 0
+        streams = None
+        in_device = False
+        component = None
+        component_name = None
+        category = None
+        # Whether the current ComponentStream / category is in the allow-list
+        extract = False
+
+        for offset in range(0, len(content), self.CHUNK_SIZE):
+            parser.feed(content[offset:offset + self.CHUNK_SIZE])
+
+            for event, element in parser.read_events():
+                if event == "start":
+                    depth += 1
+                    tag = local_name(element.tag)
+                    if depth == 2 and tag == "Streams":
+                        streams = element
+                    elif depth == 3 and tag == "DeviceStream":
+                        in_device = element.get("name") == self.machine_name
+                        if in_device:
+                            document.device = dict(element.attrib)
+                    elif depth == 4:
+                        component = element.get("component")
+                        component_name = element.get("name", "")
+                        extract = in_device and index.accepts_component(component)
+                    elif depth == 5:
+                        category = tag
+                        extract = in_device and index.accepts_category(component, category)
+                    continue
+
+                # End events
+                depth -= 1
+                if depth == 5:
+                    tag = local_name(element.tag)
+                    attributes = element.attrib
+
+                    # Availability of the machine
+                    if tag == "Availability" and attributes.get("dataItemId") == self.availability_id:
+                        document.availability = element.text == "AVAILABLE"
+
+                    if extract:
+                        sub_type = attributes.get("subType")
+                        if index.accepts(component, category, tag, sub_type):
+                            data_item_id = attributes.get("dataItemId")
+                            value = element.text
+                            if converter_of is not None:
+                                converter = converter_of(data_item_id)
+                                if converter is not None:
+                                    value = converter(value)
+                            document.observations.append(Observation(
+                                component, component_name, category, tag,
+                                sub_type, attributes.get("name", ""),
+                                data_item_id, attributes.get("timestamp"),
+                                attributes.get("sequence"), value
+                            ))
+                    element.clear()
+                elif depth == 2:
+                    if local_name(element.tag) == "Error":
+                        document.errors.append(element.get("errorCode"))
+                    # DeviceStream finished - drop it from the tree
+                    in_device = False
+                    if streams is not None:
+                        streams.clear()
+                elif depth == 1:
+                    tag = local_name(element.tag)
+                    if tag == "Header":
+                        document.header = dict(element.attrib)
+
+        parser.close()
+        return document
@@ -0,0 +1,210 @@
+import time
+import logging
+import threading
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from Metrics.registry import registry
+
+POLL_SECONDS = registry.histogram("mtc_poll_seconds", "Agent request and machine state update time",
+                                  labels=("machine",))
+PUBLISH_SECONDS = registry.histogram("mtc_publish_seconds", "Serialization, encoding and publish time",
+                                     labels=("machine",))
+
+
+class MachineChannel:
+
+    # One monitored machine - its state, how it is acquired and where it is published
+    # With `rate` (AdaptiveRate) the poll interval follows the machine state, `poll_interval` otherwise
+    # With `event_publisher` (MQTT/lanes.py) the Controller events are published as they are observed, on the
+    # urgent lane, while `publishing` - the batch window is only collected then too
+    def __init__(self, machine_status, acquisition, publisher, batch_publisher=None, poll_interval=1.0, rate=None,
+                 feature_publisher=None, event_publisher=None):
+
+        self.logger = logging.getLogger("MachineChannel")
+        self.machine_status = machine_status
+        self.acquisition = acquisition
+        self.publisher = publisher
+        self.batch_publisher = batch_publisher
+        self.feature_publisher = feature_publisher
+        self.event_publisher = event_publisher
+        # Event-driven acquisitions block until the next update, no need to wait in between
+        self.poll_interval = 0.0 if acquisition.event_driven else poll_interval
+        self.rate = rate
+        self.next_run = 0.0
+        self.running = False
+        # Polling can go on without publishing, e.g. to keep the historian recording
+        self.publishing = True
+        self.poll_seconds = POLL_SECONDS.labels(machine_status.machine_name)
+        self.publish_seconds = PUBLISH_SECONDS.labels(machine_status.machine_name)
+
+    @property
+    def name(self):
+        return self.machine_status.machine_name
+
+    @property
+    def publishing(self):
+        return self._publishing
+
+    @publishing.setter
+    def publishing(self, publishing):
+        self._publishing = publishing
+        if self.event_publisher is not None:
+            self.event_publisher.enabled = publishing
+        if self.batch_publisher is not None:
+            self.batch_publisher.enabled = publishing
+
+    def interval(self):
+        # Seconds until the next poll
+        if not self.poll_interval or self.rate is None:
+            return self.poll_interval
+        return self.rate.interval()
+
+    def cycle(self):
+
+        # Make requests to get machine status and publish
+        try:
+            updated = self.poll()
+        except requests.RequestException as e:
+            self.logger.warning(f"MTConnect agent request for {self.name} failed with {e}")
+            return
+        if not self.machine_status.machine_availability or not self.publishing:
+            return
+        self.publish(updated)
+
+    def poll(self):
+
+        start = time.perf_counter()
+        updated = self.acquisition.poll()
+        # Event-driven acquisitions spend the time waiting for the next update
+        if not self.acquisition.event_driven:
+            self.poll_seconds.observe(time.perf_counter() - start)
+        return updated
+
+    def publish_due(self, updated):
+        # Batches and feature records are published on their own schedule, the status on updates
+        return updated or self.batch_publisher is not None or self.feature_publisher is not None
+
+    def publish(self, updated=True):
+
+        if not self.publish_due(updated):
+            return
+        start = time.perf_counter()
+        if self.batch_publisher is not None:
+            self.batch_publisher.publish_if_ready()
+        elif updated:
+            self.publisher.publish(self.machine_status)
+        if self.feature_publisher is not None:
+            self.feature_publisher.publish()
+        self.publish_seconds.observe(time.perf_counter() - start)
+
+    def reset(self):
+
+        # Start the next upload session with the whole params
+        self.publisher.request_keyframe()
+        if self.batch_publisher is not None:
+            self.batch_publisher.reset()
+
+
+class MachineSupervisor:
+
+    # Runs the acquisition and publish cycle of every machine on a shared thread pool.
+    # Every machine keeps its own schedule, a slow agent response for one machine does not delay the others.
+    # With `always_poll` the machines are polled while the upload is paused too, only publishing stops.
+    def __init__(self, channels, max_workers=None, always_poll=False):
+
+        self.logger = logging.getLogger("MachineSupervisor")
+        self.channels = channels
+        for channel in channels:
+            channel.publishing = False
+        self.executor = ThreadPoolExecutor(max_workers=max_workers or min(32, len(channels)),
+                                           thread_name_prefix="machine")
+        self.lock = threading.Lock()
+        self.active = threading.Event()
+        self.wake = threading.Event()
+        self.always_poll = always_poll
+        self.publishing = False
+        self.running = False
+        self.thread = None
+
+    @property
+    def available_machines(self):
+        return [channel.name for channel in self.channels if channel.machine_status.machine_availability]
+
+    def start(self):
+
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        if self.always_poll:
+            self.schedule()
+
+    def stop(self):
+
+        self.running = False
+        self.active.set()
+        self.wake.set()
+        self.executor.shutdown(wait=False)
+
+    def schedule(self):
+
+        # First cycle of every machine right away
+        now = time.monotonic()
+        with self.lock:
+            for channel in self.channels:
+                channel.next_run = now
+        self.active.set()
+        self.wake.set()
+
+    def resume(self):
+
+        # Start the upload session with the whole params
+        for channel in self.channels:
+            channel.reset()
+            channel.publishing = True
+        self.publishing = True
+        if not self.always_poll:
+            self.schedule()
+
+    def pause(self):
+
+        self.publishing = False
+        for channel in self.channels:
+            channel.publishing = False
+        if not self.always_poll:
+            self.active.clear()
+
+    def run(self):
+
+        while self.running:
+            self.active.wait()
+            self.wake.clear()
+            if not self.running:
+                break
+
+            # Submit every machine that is due and not already in a cycle
+            now = time.monotonic()
+            next_run = now + 1.0
+            with self.lock:
+                for channel in self.channels:
+                    if channel.running:
+                        continue
+                    if channel.next_run <= now:
+                        channel.running = True
+                        # Fixed rate - the next cycle is due one interval after this one started
+                        channel.next_run = max(channel.next_run + channel.interval(), now)
+                        self.executor.submit(self.run_channel, channel)
+                    else:
+                        next_run = min(next_run, channel.next_run)
+
+            self.wake.wait(max(0.0, next_run - time.monotonic()))
+
+    def run_channel(self, channel):
+
+        try:
+            channel.cycle()
+        except Exception as e:
+            self.logger.error(f"Cycle of {channel.name} failed with - {e}")
+        finally:
+            with self.lock:
+                channel.running = False
+            self.wake.set()
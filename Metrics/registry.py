@@ -0,0 +1,273 @@
+import math
+import time
+import bisect
+import threading
+
+# Seconds - 100 us to 10 s
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0)
+
+
+def format_labels(names, values, extra=None):
+
+    pairs = list(zip(names, values))
+    if extra is not None:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+def format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class CounterChild:
+
+    __slots__ = ("value", "lock")
+
+    def __init__(self):
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+
+class GaugeChild:
+
+    __slots__ = ("value", "function")
+
+    def __init__(self):
+        self.value = 0
+        # Read on every scrape instead of being set on the hot path
+        self.function = None
+
+    def set(self, value):
+        self.value = value
+
+    def set_function(self, function):
+        self.function = function
+
+    def get(self):
+        if self.function is not None:
+            try:
+                return self.function()
+            except Exception:
+                return math.nan
+        return self.value
+
+
+class HistogramChild:
+
+    __slots__ = ("bounds", "counts", "sum", "count", "lock")
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        # One count per bucket plus +Inf, not cumulative
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.bounds, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def time(self):
+        return Timer(self)
+
+    def snapshot(self):
+        with self.lock:
+            return list(self.counts), self.sum, self.count
+
+    def quantile(self, q):
+
+        # Estimate from the buckets, linear inside a bucket
+        counts, _, count = self.snapshot()
+        if count == 0:
+            return math.nan
+        rank = q * count
+        seen = 0
+        for index, bucket in enumerate(counts):
+            if seen + bucket >= rank and bucket:
+                lower = self.bounds[index - 1] if index > 0 else 0.0
+                if index == len(self.bounds):
+                    return lower
+                return lower + (self.bounds[index] - lower) * (rank - seen) / bucket
+            seen += bucket
+        return self.bounds[-1]
+
+
+class Timer:
+
+    # with histogram.time(): ...
+    __slots__ = ("histogram", "start")
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self.histogram.observe(time.perf_counter() - self.start)
+
+
+class Metric:
+
+    # Family of one metric - a child per combination of label values
+    child_class = None
+    kind = None
+
+    def __init__(self, name, documentation, labels=()):
+
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self.children = {}
+        self.lock = threading.Lock()
+
+    def new_child(self):
+        return self.child_class()
+
+    def labels(self, *values):
+
+        # Keep the returned child instead of looking it up on every observation
+        values = tuple(str(value) for value in values)
+        child = self.children.get(values)
+        if child is None:
+            with self.lock:
+                child = self.children.setdefault(values, self.new_child())
+        return child
+
+    def render(self):
+
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for values, child in list(self.children.items()):
+            lines.extend(self.render_child(values, child))
+        return lines
+
+
+class Counter(Metric):
+
+    child_class = CounterChild
+    kind = "counter"
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def render_child(self, values, child):
+        return [f"{self.name}{format_labels(self.label_names, values)} {format_value(child.value)}"]
+
+
+class Gauge(Metric):
+
+    child_class = GaugeChild
+    kind = "gauge"
+
+    def set(self, value):
+        self.labels().set(value)
+
+    def set_function(self, function):
+        self.labels().set_function(function)
+
+    def render_child(self, values, child):
+        return [f"{self.name}{format_labels(self.label_names, values)} {format_value(child.get())}"]
+
+
+class Histogram(Metric):
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.bounds = tuple(buckets)
+
+    def new_child(self):
+        return HistogramChild(self.bounds)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def time(self):
+        return self.labels().time()
+
+    def render_child(self, values, child):
+
+        counts, total, count = child.snapshot()
+        lines = []
+        cumulative = 0
+        for bound, bucket in zip(self.bounds + (math.inf,), counts):
+            cumulative += bucket
+            labels = format_labels(self.label_names, values, ("le", format_value(bound)))
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        labels = format_labels(self.label_names, values)
+        lines.append(f"{self.name}_sum{labels} {format_value(total)}")
+        lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class Registry:
+
+    # Metrics of the process, rendered in the Prometheus text format
+    def __init__(self):
+
+        self.lock = threading.Lock()
+        self.metrics = {}
+
+    def register(self, metric_class, name, documentation, **kwargs):
+
+        # Registering the same name again returns the existing metric
+        with self.lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = metric_class(name, documentation, **kwargs)
+            return metric
+
+    def counter(self, name, documentation, labels=()):
+        return self.register(Counter, name, documentation, labels=labels)
+
+    def gauge(self, name, documentation, labels=()):
+        return self.register(Gauge, name, documentation, labels=labels)
+
+    def histogram(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram, name, documentation, labels=labels, buckets=buckets)
+
+    def render(self):
+
+        lines = []
+        for metric in list(self.metrics.values()):
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def summary(self):
+
+        # One line per latency histogram and counter, for the log
+        lines = []
+        for metric in list(self.metrics.values()):
+            for values, child in list(metric.children.items()):
+                label = metric.name + format_labels(metric.label_names, values)
+                if isinstance(metric, Histogram):
+                    _, total, count = child.snapshot()
+                    if count:
+                        lines.append(f"{label}: n={count} mean={1e3 * total / count:.2f} ms "
+                                     f"p95~{1e3 * child.quantile(0.95):.2f} ms")
+                elif isinstance(metric, Counter) and child.value:
+                    lines.append(f"{label}: {child.value}")
+                elif isinstance(metric, Gauge):
+                    lines.append(f"{label}: {child.get()}")
+        return lines
+
+
+# Shared by all modules of the process
+registry = Registry()
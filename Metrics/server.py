@@ -0,0 +1,54 @@
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from Metrics.registry import registry as default_registry
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+
+    registry = None
+
+    def log_message(self, format, *args):
+        return
+
+    def do_GET(self):
+
+        if self.path.split("?")[0] not in ("/metrics", "/"):
+            self.send_error(404)
+            return
+        body = self.registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class MetricsServer:
+
+    # Serves the registry on http://<host>:<port>/metrics for Prometheus or curl
+    def __init__(self, host="127.0.0.1", port=9101, registry=default_registry):
+
+        self.logger = logging.getLogger("MetricsServer")
+        self.host = host
+        self.port = port
+        self.registry = registry
+        self.server = None
+
+    @classmethod
+    def from_config(cls, metrics_config):
+        return cls(host=metrics_config.get("host", "127.0.0.1"), port=metrics_config.get("port", 9101))
+
+    def start(self):
+
+        class Handler(MetricsHandler):
+            registry = self.registry
+
+        self.server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.logger.info(f"Metrics on http://{self.host}:{self.server.server_address[1]}/metrics")
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
@@ -0,0 +1,48 @@
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from Metrics.registry import registry
+
+STARTUP_SECONDS = registry.gauge("mtc_startup_phase_seconds", "Duration of the startup phases of the process",
+                                 labels=("phase",))
+
+
+class StartupTimeline:
+
+    # Start and end of every startup phase relative to the start of the process. Phases run on other threads
+    # overlap, the breakdown shows both the durations and when each phase ran.
+    def __init__(self, started=None):
+
+        self.logger = logging.getLogger("Startup")
+        self.started = time.perf_counter() if started is None else started
+        self.lock = threading.Lock()
+        # [(name, start, end)] in seconds since `started`
+        self.phases = []
+
+    @contextmanager
+    def phase(self, name):
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, start, time.perf_counter())
+
+    def record(self, name, start, end):
+
+        with self.lock:
+            self.phases.append((name, start - self.started, end - self.started))
+        STARTUP_SECONDS.labels(name).set(end - start)
+
+    def report(self):
+
+        # Logged once the process is ready to upload
+        total = time.perf_counter() - self.started
+        STARTUP_SECONDS.labels("total").set(total)
+        with self.lock:
+            phases = sorted(self.phases, key=lambda phase: phase[1])
+        width = max((len(name) for name, _, _ in phases), default=0)
+        self.logger.info(f"Started in {total:.2f} s")
+        for name, start, end in phases:
+            self.logger.info(f"  {name:<{width}} {1e3 * (end - start):8.1f} ms  ({start:6.2f} s -> {end:6.2f} s)")
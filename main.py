@@ -1,6 +1,8 @@
+import time
+# Start of the process, for the startup timing breakdown
+STARTED = time.perf_counter()
 import os
 import re
-import time
 import json
 import requests
 import threading
@@ -12,21 +14,40 @@ import signal
 import logging.config
 from uuid import uuid4
 from datetime import date
+from concurrent.futures import ThreadPoolExecutor
 from MQTT.mqtt_callbacks import MqttCallbacks
+from MQTT.publisher import StatusPublisher
+from MQTT.rpc import MqttRpc
 from awscrt import io as aws_io, mqtt
 from awsiot import mqtt_connection_builder, iotshadow
 from MQTT.mqtt_device_shadows import DeviceShadows, LockedDeviceState
 from Machine.monitoring import MachineStateMonitor
+from Machine.supervisor import MachineChannel, MachineSupervisor
+from Machine.adaptive import SamplingSettings, AdaptiveRate
+from Agent.client import AgentClient
+from Agent.acquisition import get_acquisition
+from Agent.agent_cfg import AgentConfigFile
+from Agent.probe import load_probe
+from Machine.converters import build_converters
+from Metrics.registry import registry
+from Metrics.startup import StartupTimeline
+# Modules of the optional features (spool, batching, historian, metrics server, asyncio runtime) are imported
+# where the feature is enabled
+IMPORTED = time.perf_counter()
 
 
 def manage_ctrlc(*args):
 
     # Reset the shadow
-    global ds, exit_main, mqtt_connection
+    global ds, exit_main, mqtt_connection, runtime
 
     # Change shadow value to init
     ds.change_shadow_value({"upload_enable": 0})
+    # The update is sent after a short merge window - send it before disconnecting
+    ds.flush(timeout=2.0)
     exit_main = True
+    if runtime is not None:
+        runtime.stop()
 
     disconnect_future = mqtt_connection.disconnect()
     disconnect_future.result()
@@ -35,47 +56,36 @@ def manage_ctrlc(*args):
 # Pressing Ctrl+C will call the function `manage_ctrlc` for child process wrap-up
 signal.signal(signal.SIGINT, manage_ctrlc)
 subscribe_receiving_event = threading.Event()
+# Set in the asyncio runtime mode
+runtime = None
 
 
 def get_adapter_ip_from_ssm(topic_ssm_params, ssm_params_payload):
 
-    global subscribe_receiving_event, callbacks
-    # Clear the event
-    subscribe_receiving_event.clear()
-
-    mqtt_connection.publish(
-        topic=topic_ssm_params,
-        payload=json.dumps(ssm_params_payload),
-        qos=mqtt.QoS.AT_LEAST_ONCE
-    )
-    # Wait until you receive a message
-    while not subscribe_receiving_event.is_set():
-        pass
-
-    adapter_ip_ssm = callbacks.params
-    return adapter_ip_ssm
+    global rpc
+    # Wait for the response to this request, without polling
+    try:
+        return rpc.call(topic_ssm_params, ssm_params_payload, timeout=config["SSM"].get("timeout", 60.0))
+    except TimeoutError as e:
+        logger.error(f"SSM parameters request failed with - {e}")
+        return None
 
 
 def monitor_adapter_ip():
 
-    global config, client_id, machine_name
-
-    # Get the adapter IP address
-    # TODO: Improve the way Host is identified
-    start_looking = False
-    agent_conf_file = config["agent"]["cfg_file"]
-    with open(agent_conf_file, "r") as filehandle:
-        agent_conf = filehandle.readlines()
-        for conf in agent_conf:
-            if conf.strip() == machine_name:
-                start_looking = True
-
-            if start_looking:
-                if "Host" in conf:
-                    adapter_ip = conf.strip().split("=")[-1].strip()
-                    # Stop looking
-                    start_looking = False
-                    break
+    # Names of the machines whose adapter Host was updated, empty when they all match, None when the check failed -
+    # the caller exits, this also runs on a startup worker thread
+    global config, client_id, machine_configs, agent_cfg
+
+    # Get the adapter IP address of every machine
+    adapter_ips = {}
+    for machine_config in machine_configs:
+        machine_name = machine_config["machine_name"]
+        adapter = agent_cfg.adapter(machine_name)
+        if adapter is None or adapter.get("Host") is None:
+            logger.error(f"No adapter Host for {machine_name} in {agent_cfg.path}")
+            return None
+        adapter_ips[machine_name] = adapter.get("Host")
 
     # Get the IP address from SSM
     topic_ssm_params = config["SSM"]["topic_ssm_params"] + "/" + client_id
@@ -86,22 +96,31 @@ def monitor_adapter_ip():
     }
     adapter_ip_ssm = get_adapter_ip_from_ssm(topic_ssm_params, ssm_params_payload)
     # Parse the IP
-    if adapter_ip_ssm["Status"] == "connected":
+    if adapter_ip_ssm is not None and adapter_ip_ssm["Status"] == "connected":
         try:
             adapter_ip_ssm = adapter_ip_ssm["ssm_run_command"]["StandardOutputContent"].strip().split()[1]
         except Exception as e:
             logging.error("Cannot get the ip address for the agent from SSM with error message: {}".format(e))
-            exit_process(1)
-        validate_adapter_ip(adapter_ip, adapter_ip_ssm, agent_conf_file)
+            return None
+        updated = set()
+        for machine_name, adapter_ip in adapter_ips.items():
+            changed = validate_adapter_ip(machine_name, adapter_ip, adapter_ip_ssm, agent_cfg)
+            if changed is None:
+                return None
+            if changed:
+                updated.add(machine_name)
+        return updated
     else:
         logger.error("Adapter Offline")
-        exit_process(1)
+        return None
 
 
 def periodically_check_adapter_ip():
+    # Checked once at startup already
     while True:
-        monitor_adapter_ip()
         time.sleep(60 * 60 * 6)
+        if monitor_adapter_ip() is None:
+            exit_process(1)
 
 
 def exit_process(code):
@@ -109,79 +128,113 @@ def exit_process(code):
     sys.exit(code)
 
 
-def validate_adapter_ip(adapter_ip, adapter_ip_ssm, agent_cfg_path):
+def validate_adapter_ip(machine_name, adapter_ip, adapter_ip_ssm, agent_cfg):
 
     # Make sure both the arguments are valid ip addresses
     pattern = r'^\d+$'
     for number in adapter_ip.split("."):
         if not bool(re.match(pattern, number)):
             logger.warn("Invalid adapter ip addresses from agent_cfg")
-            exit_process(1)
+            return None
     for number in adapter_ip_ssm.split("."):
         if not bool(re.match(pattern, number)):
             logger.warn("Invalid adapter ip addresses from SSM  manager")
-            exit_process(1)
+            return None
 
-    if adapter_ip != adapter_ip_ssm:
-        with open(agent_cfg_path, "r") as filehandle:
-            modified_config = ""
-            for line in filehandle.readlines():
-                if "Host" in line:
-                    new_line = line.replace(adapter_ip, adapter_ip_ssm)
-                    modified_config += new_line
-                else:
-                    modified_config += line
-
-        with open(agent_cfg_path, "w") as filehandle:
-            filehandle.write(modified_config)
-        logger.info(f"IP addresses have been updated from {adapter_ip} to {adapter_ip_ssm}")
-        time.sleep(60)
+    # Only the Host of this machine's adapter is rewritten
+    if agent_cfg.set_adapter_value(machine_name, "Host", adapter_ip_ssm):
+        logger.info(f"IP address of {machine_name} has been updated from {adapter_ip} to {adapter_ip_ssm}")
+        return True
     else:
-        logger.info("IP addresses matches")
-        return
-
-
-def initialize_device_shadows(cp):
-
-    # Subscribe to all shadow topics
-    # Update
-    update_accepted_subscribed_future, _ = shadow_client.subscribe_to_update_named_shadow_accepted(
-        request=iotshadow.UpdateNamedShadowSubscriptionRequest(thing_name=cp["client_id"],
-                                                               shadow_name=cp["shadow_thing_name"]),
-        qos=mqtt.QoS.AT_LEAST_ONCE,
-        callback=ds.on_update_shadow_accepted)
-    update_rejected_subscribed_future, _ = shadow_client.subscribe_to_update_named_shadow_rejected(
-        request=iotshadow.UpdateNamedShadowSubscriptionRequest(thing_name=cp["client_id"],
-                                                               shadow_name=cp["shadow_thing_name"]),
-        qos=mqtt.QoS.AT_LEAST_ONCE,
-        callback=ds.on_update_shadow_rejected)
-    # Wait for subscriptions to succeed
-    update_accepted_subscribed_future.result()
-    update_rejected_subscribed_future.result()
-    # Get
-    get_accepted_subscribed_future, _ = shadow_client.subscribe_to_get_named_shadow_accepted(
-        request=iotshadow.GetNamedShadowSubscriptionRequest(thing_name=cp["client_id"],
-                                                            shadow_name=cp["shadow_thing_name"]),
-        qos=mqtt.QoS.AT_LEAST_ONCE,
-        callback=ds.on_get_shadow_accepted)
-    get_rejected_subscribed_future, _ = shadow_client.subscribe_to_get_named_shadow_rejected(
-        request=iotshadow.GetNamedShadowSubscriptionRequest(thing_name=cp["client_id"],
-                                                            shadow_name=cp["shadow_thing_name"]),
-        qos=mqtt.QoS.AT_LEAST_ONCE,
-        callback=ds.on_get_shadow_rejected)
-    # Wait for subscriptions to succeed
-    get_accepted_subscribed_future.result()
-    get_rejected_subscribed_future.result()
-    # Delta
-    delta_subscribed_future, _ = shadow_client.subscribe_to_named_shadow_delta_updated_events(
-        request=iotshadow.NamedShadowDeltaUpdatedSubscriptionRequest(thing_name=cp["client_id"],
-                                                                     shadow_name=cp["shadow_thing_name"]),
-        qos=mqtt.QoS.AT_LEAST_ONCE,
-        callback=ds.on_shadow_delta_updated)
-    # Wait for subscription to succeed
-    delta_subscribed_future.result()
-
-    # Get the current shadow state
+        logger.info(f"IP address of {machine_name} matches")
+        return False
+
+
+def wait_for_machine(acquisition, timeout):
+
+    # Poll until the machine shows up after the agent picked up a new adapter Host
+    deadline = time.time() + timeout
+    while True:
+        try:
+            acquisition.poll()
+            if acquisition.machine_status.machine_availability or time.time() >= deadline:
+                return
+        except requests.RequestException:
+            if time.time() >= deadline:
+                raise
+        time.sleep(1.0)
+
+
+def get_machine_configs(adapter_config):
+
+    # Either a list of machines or the single `machine_name` / `devices_xml` pair
+    if "machines" in adapter_config:
+        return adapter_config["machines"]
+    return [{"machine_name": adapter_config["machine_name"], "devices_xml": adapter_config["devices_xml"]}]
+
+
+def prepare_machine(machine_config, agent_client, timeline):
+
+    # Agent side of the startup of one machine - typed converters from /probe and the first poll
+    machine_name = machine_config["machine_name"]
+    converters = None
+    if config["agent"].get("typed_values", True):
+        with timeline.phase(f"probe {machine_name}"):
+            definitions = load_probe(agent_client, machine_name, cache_dir=config["agent"].get("probe_cache"))
+        if definitions is None:
+            logger.warning(f"No /probe for {machine_name}, values are published as text")
+        else:
+            converters = build_converters(definitions)
+    # Recent history of the samples for the batching and analytics - the feature extraction reads them
+    buffers = None
+    if config.get("ring_buffers", {}).get("enabled", False) or config.get("features", {}).get("enabled", False):
+        from Machine.ring_buffers import RingBufferStore
+        buffers = RingBufferStore.from_config(config.get("ring_buffers", {}))
+    # Collect the params
+    machine_status = MachineStateMonitor(machine_name=machine_name, devices_xml=machine_config.get("devices_xml"),
+                                         converters=converters, buffers=buffers)
+    acquisition = get_acquisition(machine_status, config["agent"], client=agent_client)
+    # Make a http request - To check availability
+    with timeline.phase(f"agent {machine_name}"):
+        acquisition.poll()
+    return machine_status, acquisition
+
+
+def timed(timeline, name, function, *args):
+    with timeline.phase(name):
+        return function(*args)
+
+
+def subscribe_device_shadows(cp):
+
+    # Send the subscriptions to all shadow topics at once, returns their futures
+    update_request = iotshadow.UpdateNamedShadowSubscriptionRequest(thing_name=cp["client_id"],
+                                                                    shadow_name=cp["shadow_thing_name"])
+    get_request = iotshadow.GetNamedShadowSubscriptionRequest(thing_name=cp["client_id"],
+                                                              shadow_name=cp["shadow_thing_name"])
+    delta_request = iotshadow.NamedShadowDeltaUpdatedSubscriptionRequest(thing_name=cp["client_id"],
+                                                                         shadow_name=cp["shadow_thing_name"])
+    subscriptions = [
+        # Update
+        shadow_client.subscribe_to_update_named_shadow_accepted(
+            request=update_request, qos=mqtt.QoS.AT_LEAST_ONCE, callback=ds.on_update_shadow_accepted),
+        shadow_client.subscribe_to_update_named_shadow_rejected(
+            request=update_request, qos=mqtt.QoS.AT_LEAST_ONCE, callback=ds.on_update_shadow_rejected),
+        # Get
+        shadow_client.subscribe_to_get_named_shadow_accepted(
+            request=get_request, qos=mqtt.QoS.AT_LEAST_ONCE, callback=ds.on_get_shadow_accepted),
+        shadow_client.subscribe_to_get_named_shadow_rejected(
+            request=get_request, qos=mqtt.QoS.AT_LEAST_ONCE, callback=ds.on_get_shadow_rejected),
+        # Delta
+        shadow_client.subscribe_to_named_shadow_delta_updated_events(
+            request=delta_request, qos=mqtt.QoS.AT_LEAST_ONCE, callback=ds.on_shadow_delta_updated),
+    ]
+    return [future for future, _ in subscriptions]
+
+
+def request_device_shadow(cp):
+
+    # Get the current shadow state, once the subscriptions succeeded
     with cp["locked_device_state"].lock:
         token = str(uuid4())
 
@@ -238,6 +291,9 @@ if __name__ == '__main__':
     }
     logging.config.dictConfig(d)
     logger = logging.getLogger(__name__)
+    # Startup phases, logged once the upload loop starts
+    timeline = StartupTimeline(started=STARTED)
+    timeline.record("imports", STARTED, IMPORTED)
 
     # Keep track of PIDs
     metadir = os.path.join("/home/minlab/mtconnect-statusUpdate", "metadata")
@@ -286,22 +342,27 @@ if __name__ == '__main__':
                 on_connection_closed=callbacks.on_connection_closed)
         logger.info("Connecting to {} with client ID '{}'...\n".format(
             endpoint, client_id))
-        # Start the connection
+        # Start the connection, the agent side of the startup runs during the handshake
+        connect_started = time.perf_counter()
         connect_future = mqtt_connection.connect()
-        connect_future.result()
-        sys.stdout.write("Connection Successful!\n")
-        # Start the subscription
-        subscribe_future, packet_id = mqtt_connection.subscribe(
-            topic=topic_params_download,
-            qos=mqtt.QoS.AT_MOST_ONCE,
-            callback=callbacks.on_message_received)
-        subscribe_result = subscribe_future.result()
-        logger.info("Subscribed with {}\n".format(str(subscribe_result['qos'])))
-
     except awscrt.exceptions.AwsCrtError as e:
         logger.error(f"MQTT Connection to AWS failed with {e}")
         sys.exit(1)
 
+    # Machines to monitor
+    machine_configs = get_machine_configs(config["adapter"])
+
+    # One pooled session to the agent shared by all machines
+    agent_client = AgentClient.from_config(config["agent"])
+    # /probe and the availability check of every machine, in parallel with the MQTT startup
+    startup_executor = ThreadPoolExecutor(max_workers=len(machine_configs) + 1, thread_name_prefix="startup")
+    machine_futures = [startup_executor.submit(prepare_machine, machine_config, agent_client, timeline)
+                       for machine_config in machine_configs]
+
+    # Requests to the cloud answered on the params topic
+    rpc = MqttRpc(mqtt_connection)
+    callbacks.add_message_listener(rpc.on_message)
+
     # Setup Device Shadows
     # Device State of shadow
     locked_device_state = LockedDeviceState()
@@ -316,37 +377,185 @@ if __name__ == '__main__':
     ds = DeviceShadows(locked_device_state=connection_params["locked_device_state"],
                        client_id=connection_params["client_id"],
                        shadow_thing_name=connection_params["shadow_thing_name"],
-                       shadow_client=shadow_client)
-    initialize_device_shadows(cp=connection_params)
+                       shadow_client=shadow_client,
+                       update_window=aws_config.get("shadow_update_window", 0.2),
+                       token_ttl=aws_config.get("shadow_token_ttl", 10.0))
 
-    # Get the name of machine for status update
-    machine_name = config["adapter"]["machine_name"]
+    try:
+        connect_future.result()
+        timeline.record("mqtt connect", connect_started, time.perf_counter())
+        sys.stdout.write("Connection Successful!\n")
 
-    # Monitor the IP address of the adapter
-    monitor_adapter_ip()
+        # Send the params and the five shadow subscriptions at once and wait for them together
+        subscribe_started = time.perf_counter()
+        subscribe_future, packet_id = mqtt_connection.subscribe(
+            topic=topic_params_download,
+            qos=mqtt.QoS.AT_MOST_ONCE,
+            callback=callbacks.on_message_received)
+        shadow_futures = subscribe_device_shadows(cp=connection_params)
+        subscribe_result = subscribe_future.result()
+        timeline.record("params subscribe", subscribe_started, time.perf_counter())
+        logger.info("Subscribed with {}\n".format(str(subscribe_result['qos'])))
+    except awscrt.exceptions.AwsCrtError as e:
+        logger.error(f"MQTT Connection to AWS failed with {e}")
+        sys.exit(1)
+
+    # Monitor the IP address of the adapter - the SSM round trip runs while the shadow subscriptions complete
+    agent_cfg = AgentConfigFile(config["agent"]["cfg_file"])
+    adapter_future = startup_executor.submit(timed, timeline, "adapter ip", monitor_adapter_ip)
+    for future in shadow_futures:
+        future.result()
+    timeline.record("shadow subscribe", subscribe_started, time.perf_counter())
+    with timeline.phase("shadow get"):
+        request_device_shadow(cp=connection_params)
+    adapter_updated = adapter_future.result()
+    # Shadow write and disconnect on the main thread, once the subscriptions are done
+    if adapter_updated is None:
+        exit_process(1)
     # Enable Periodic monitoring of IP address
     monitor_ip_thread = threading.Thread(target=periodically_check_adapter_ip, daemon=True)
 
-    # Initialize Machine Monitoring
-    # Collect the params
-    devices_xml = config["adapter"]["devices_xml"]
-    machine_status = MachineStateMonitor(machine_name=machine_name, devices_xml=devices_xml)
+    # Stage latencies, publish counters and queue depths on a local /metrics endpoint
+    metrics_config = config.get("metrics", {})
+    report_interval = metrics_config.get("log_interval", 60)
+    if metrics_config.get("enabled", False):
+        from Metrics.server import MetricsServer
+        MetricsServer.from_config(metrics_config).start()
+
+    poll_interval = config["agent"].get("poll_interval", 1.0)
+    # Poll intervals that follow the machine state and the session timeout, overridable through the shadow
+    sampling = SamplingSettings.from_config(config.get("sampling", {}), default_interval=poll_interval)
+    # Shadow listeners may run with the state lock held, read the states without it
+    ds.add_listener(lambda: sampling.apply_shadow(dict(locked_device_state.states)))
+    # The shadow was fetched before the listener was added - apply the values it already holds
+    with locked_device_state.lock:
+        states = dict(locked_device_state.states)
+    sampling.apply_shadow(states)
+
+    # Publish the status - full params or only the changes
+    upload_config = config.get("upload", {})
+    # Store and forward - uploads go to the on-disk spool first and survive outages and restarts
+    upload_connection = mqtt_connection
+    if upload_config.get("spool", {}).get("enabled", False):
+        from MQTT.spool import SpoolForwarder
+        upload_connection = SpoolForwarder.from_config(mqtt_connection, callbacks.connected, upload_config["spool"])
+        upload_connection.start()
+
+    # Controller events on an urgent lane straight to the broker, sample batches on a bulk lane that may drop
+    lanes_config = upload_config.get("lanes", {})
+    urgent_lane = None
+    bulk_connection = upload_connection
+    if lanes_config.get("enabled", False):
+        from MQTT.lanes import PublishLane, EventPublisher
+        # The spool drains in order at its own rate, urgent events bypass it
+        urgent_lane = PublishLane.from_config("urgent", mqtt_connection, lanes_config.get("urgent", {}))
+        urgent_lane.start()
+        bulk_connection = PublishLane.from_config("bulk", upload_connection, lanes_config.get("bulk", {}))
+        bulk_connection.start()
+
+    # Local history of every observation, recorded whether the upload is enabled or not
+    historian_config = config.get("historian", {})
+    historians = []
+    # Cycle and rolling load features computed on the edge
+    features_config = config.get("features", {})
+    extractors = []
 
-    # Make a http request - To check availability
-    url = config["agent"]["url"] + "/" + machine_name + "/current"
-    response = requests.get(url)
-    machine_status.update_machine_state(response)
-    if not machine_status.machine_availability:
-        logger.error("FANUC ROBONANO NOT AVAILABLE")
+    # Initialize Machine Monitoring
+    channels = []
+    for machine_config, machine_future in zip(machine_configs, machine_futures):
+        try:
+            machine_status, acquisition = machine_future.result()
+            if machine_config["machine_name"] in adapter_updated \
+                    and not machine_status.machine_availability:
+                # The agent reconnects to the adapter at the new address
+                with timeline.phase("adapter reconnect"):
+                    wait_for_machine(acquisition, timeout=60.0)
+        except requests.RequestException as e:
+            logger.error(f"MTConnect agent request failed with {e}")
+            sys.exit(1)
+        if not machine_status.machine_availability:
+            logger.error(f"{machine_status.machine_name} NOT AVAILABLE")
+
+        topic = machine_config.get("topic")
+        if topic is None:
+            topic = topic_status_upload if len(machine_configs) == 1 \
+                else topic_status_upload + "/" + machine_status.machine_name
+        publisher = StatusPublisher.from_config(upload_connection, topic, upload_config)
+        # Batch the observations over a window instead of publishing every poll
+        batch_publisher = None
+        if upload_config.get("batch", {}).get("enabled", False):
+            from MQTT.batching import BatchPublisher
+            batch_publisher = BatchPublisher.from_config(bulk_connection, topic + "/batch",
+                                                         publisher.encoder, upload_config["batch"],
+                                                         buffers=machine_status.buffers, lock=machine_status.lock)
+            machine_status.add_listener(batch_publisher.on_observations)
+        if historian_config.get("enabled", False):
+            from Machine.historian import Historian
+            historian = Historian.from_config(machine_status.machine_name, historian_config)
+            machine_status.add_listener(historian.on_observations)
+            historian.start()
+            historians.append(historian)
+        feature_publisher = None
+        if features_config.get("enabled", False):
+            from Machine.features import FeatureExtractor
+            from MQTT.publisher import FeaturePublisher
+            extractor = FeatureExtractor.from_config(machine_status, machine_status.buffers, features_config)
+            machine_status.add_listener(extractor.on_observations)
+            extractor.start()
+            extractors.append(extractor)
+            feature_publisher = FeaturePublisher.from_config(upload_connection, topic + "/features", extractor,
+                                                             publisher.encoder, features_config)
+        event_publisher = None
+        if urgent_lane is not None:
+            event_publisher = EventPublisher.from_config(urgent_lane, topic + "/events", machine_status.machine_name,
+                                                         publisher.encoder, lanes_config.get("urgent", {}))
+            machine_status.add_listener(event_publisher.on_observations)
+        # Without Execution a program that dwells or waits counts as idle
+        if sampling.adaptive and not machine_status.data_item_index.accepts("Path", "Events", "Execution", None):
+            logger.warning(f"Execution of {machine_status.machine_name} is not in devices_xml, the adaptive rate "
+                           f"only follows the axis motion")
+        rate = AdaptiveRate(sampling)
+        machine_status.add_listener(rate.on_observations)
+        channels.append(MachineChannel(machine_status, acquisition, publisher, batch_publisher,
+                                       poll_interval=poll_interval, rate=rate, feature_publisher=feature_publisher,
+                                       event_publisher=event_publisher))
+    startup_executor.shutdown(wait=False)
+
+    if not any(channel.machine_status.machine_availability for channel in channels):
+        logger.error("NO MACHINE AVAILABLE")
         sys.exit(1)
 
+    # Acquisition, publishing and shadow control as tasks on one event loop
+    runtime_config = config.get("runtime", {})
+    if runtime_config.get("mode", "threads") == "asyncio":
+        from Machine.async_runtime import AsyncRuntime
+        runtime = AsyncRuntime.from_config(channels, ds, agent_client, runtime_config, settings=sampling,
+                                           always_poll=bool(historians), report_interval=report_interval)
+        # Initiate by stopping upload
+        ds.change_shadow_value({"upload_enable": 0})
+        monitor_ip_thread.start()
+        timeline.report()
+        runtime.run()
+        for historian in historians:
+            historian.stop()
+        for extractor in extractors:
+            extractor.stop()
+        logger.info(f"Exiting process with PID-{main_process_pid}")
+        sys.exit(0)
+
+    supervisor = MachineSupervisor(channels, max_workers=config["agent"].get("max_workers"),
+                                   always_poll=bool(historians))
+
     # Start sending data every second
     start_upload = False
     start_timer = time.time()
+    report_timer = time.time()
     # Initiate by stopping upload
     ds.change_shadow_value({"upload_enable": 0})
     exit_main = False
     monitor_ip_thread.start()
+    supervisor.start()
+    timeline.report()
     while True:
 
         # Get the shadow state
@@ -357,31 +566,31 @@ if __name__ == '__main__':
                 start_upload = False
 
         if start_upload:
-            # Make requests to get machine status
-            response = requests.get(url)
-            machine_status.update_machine_state(response)
-            if not machine_status.machine_availability:
-                logger.error("FANUC ROBONANO NOT AVAILABLE")
+            # Machines are polled and published by the supervisor
+            if not supervisor.publishing:
+                supervisor.resume()
+            time.sleep(1.0)
+            if not supervisor.available_machines:
+                logger.error("NO MACHINE AVAILABLE")
                 start_upload = False
                 break
-
-            # Construct MQTT Messages
-            mqtt_connection.publish(
-                topic=topic_status_upload,
-                payload=json.dumps(machine_status.machine_params),
-                qos=mqtt.QoS.AT_LEAST_ONCE
-            )
-
-            # Sleep for a while
-            time.sleep(1.0)
             end_timer = time.time()
 
-            # Shutdown data transfer after an hour
-            if end_timer - start_timer > 1800:
+            # Time spent on the agent round trip
+            if end_timer - report_timer > report_interval:
+                logger.info(agent_client.latency.summary(period=poll_interval))
+                for line in registry.summary():
+                    logger.info(line)
+                report_timer = end_timer
+
+            # Shutdown data transfer after the session timeout
+            if sampling.session_expired(start_timer, [channel.rate for channel in channels], now=end_timer):
                 start_upload = False
                 ds.change_shadow_value({"upload_enable": 0})
 
         else:
+            if supervisor.publishing:
+                supervisor.pause()
             time.sleep(5.0)
             start_timer = time.time()
 
@@ -390,4 +599,8 @@ if __name__ == '__main__':
             logger.info(f"Exiting process with PID-{main_process_pid}")
             break
 
-
+    supervisor.stop()
+    for historian in historians:
+        historian.stop()
+    for extractor in extractors:
+        extractor.stop()
@@ -0,0 +1,95 @@
+import os
+import sys
+import threading
+import unittest
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from Machine.streams import Observation
+
+try:
+    from Machine.ring_buffers import RingBufferStore
+    from Machine.features import FeatureExtractor
+    RingBufferStore()
+except ImportError:
+    RingBufferStore = None
+
+START = 1.7e9
+
+
+class Monitor:
+
+    # The parts of MachineStateMonitor the extractor uses
+    machine_name = "machine"
+
+    def __init__(self):
+        self.lock = threading.Lock()
+
+
+@unittest.skipIf(RingBufferStore is None, "needs numpy")
+class FeedrateCycleTest(unittest.TestCase):
+
+    # Cycles of a device without Execution, from the PathFeedrate fallback
+    def setUp(self):
+
+        self.store = RingBufferStore(capacity=4096)
+        self.extractor = FeatureExtractor(Monitor(), self.store, rolling_interval=1e9, idle_seconds=5.0)
+        self.sequence = 0
+
+    def feed(self, seconds, feedrate, load):
+
+        observations = []
+        for value, data_item, sub_type in ((feedrate, "PathFeedrate", "ACTUAL"), (load, "Load", None)):
+            self.sequence += 1
+            timestamp = datetime.fromtimestamp(START + seconds, timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+            observations.append(Observation("Linear", "X", "Samples", data_item, sub_type, "",
+                                            f"x_{data_item}", timestamp, self.sequence, value))
+        for observation in observations:
+            self.store.append(observation)
+        self.extractor.on_observations(observations)
+
+    def cut(self, start, end):
+        for tenth in range(int(start * 10), int(end * 10)):
+            self.feed(tenth / 10, 1000.0, 20.0)
+
+    def cycles(self, idle=False):
+        # `idle` - the machine stood still on the wall clock since the last motion
+        if idle:
+            self.extractor.last_motion_seen -= 10.0
+        self.extractor.update()
+        return [record for record in self.extractor.take_records() if record["type"] == "cycle"]
+
+    def test_idle_gap_without_samples_splits_the_cuts(self):
+
+        # The filters drop the constant zero feedrate, nothing arrives between the cuts
+        self.cut(0, 40)
+        self.cut(70, 110)
+        cycles = self.cycles(idle=True)
+        self.assertEqual(len(cycles), 2)
+        self.assertAlmostEqual(cycles[0]["start"], START, places=3)
+        self.assertAlmostEqual(cycles[0]["end"], START + 39.9, places=3)
+        self.assertEqual(cycles[0]["load"]["X"]["n"], 400)
+
+    def test_idle_samples_end_the_cycle(self):
+
+        self.cut(0, 40)
+        for second in range(40, 70):
+            self.feed(second, 0.0, 1.0)
+        self.cut(70, 110)
+        cycles = self.cycles(idle=True)
+        self.assertEqual(len(cycles), 2)
+        self.assertAlmostEqual(cycles[1]["start"], START + 70, places=3)
+        self.assertEqual(cycles[1]["load"]["X"]["n"], 400)
+
+    def test_idle_on_the_wall_clock_ends_the_cycle(self):
+
+        # No samples at all after the cut - the cycle still ends once `idle_seconds` passed
+        self.cut(0, 40)
+        self.assertEqual(self.cycles(), [])
+        cycles = self.cycles(idle=True)
+        self.assertEqual(len(cycles), 1)
+        self.assertAlmostEqual(cycles[0]["end"], START + 39.9, places=3)
+
+
+if __name__ == '__main__':
+    unittest.main()